@@ -0,0 +1,291 @@
+#****************************************************************************
+#* bench_bfm.py
+#*
+#* Benchmark for the Python side of RiscvDebugBfm. The BFM is created
+#* with riscv_offline, so import-task calls are counted rather than
+#* sent to an HDL. The export-task calls the HDL would make are
+#* replayed for each trace level, from a synthetic RV32IMC program or
+#* from a recorded trace.
+#*
+#* For each trace level, with disassembly on and off, reports:
+#* - notifications (export-task calls) and instructions per second
+#* - import- and export-task call counts
+#* - memory retained per instruction and peak memory (tracemalloc)
+#*
+#* Results are written as JSON.
+#*
+#* Usage: python bench/bench_bfm.py [-n <instructions>] [-r <repeats>]
+#*                                  [-t <trace>] [-o <json>]
+#****************************************************************************
+import argparse
+import json
+import platform
+import random
+import time
+import tracemalloc
+
+from riscv_debug_bfms import riscv_offline, riscv_decoder
+from riscv_debug_bfms.riscv_debug_bfm import RiscvDebugBfm, RiscvDebugTraceLevel
+from riscv_debug_bfms.riscv_trace_recorder import RiscvTraceReader, \
+    REC_RETIRE, REC_REGS, REC_REGS_MAX
+
+# Event kinds: registers sent before the _instr_exec call
+EV_NO_REGS = 0
+EV_WRITE_REG = 1
+EV_WRITE_REGS = 2
+EV_SAMPLE = 3 # _sample call instead of _instr_exec
+
+# Sampling interval used at RiscvDebugTraceLevel.Sample
+SAMPLE_PERIOD = 1000
+
+# Encodings used by the synthetic program
+JALR_RA_T1 = 0x000300E7 # jalr ra, 0(t1)
+JALR_ZERO_RA = 0x00008067 # jalr zero, 0(ra)
+C_JR_RA = 0x8082 # c.jr ra
+
+def gen_program(n, seed=0):
+    """Returns n retire tuples (pc, instr, rd, rd_val, mem_addr,
+    mem_data, wmask, rmask) for a synthetic program with balanced
+    calls and returns"""
+    rnd = random.Random(seed)
+    funcs = [0x80000000 + 0x400*i for i in range(64)]
+    ret_l = []
+    pc = funcs[0]
+    ret = []
+
+    for _ in range(n):
+        p = rnd.random()
+        rd = 0
+        rd_val = 0
+        mem = (0, 0, 0, 0)
+
+        if p < 0.03 and len(ret) < 16:
+            instr = JALR_RA_T1
+            rd = 1
+            rd_val = pc + 4
+            ret.append(pc + 4)
+            npc = rnd.choice(funcs)
+        elif p < 0.06 and len(ret) > 0:
+            instr = C_JR_RA if rnd.random() < 0.5 else JALR_ZERO_RA
+            npc = ret.pop()
+        elif p < 0.16:
+            # sw rs2, 0(sp)
+            instr = (rnd.randrange(8, 16) << 20) | (2 << 15) | (2 << 12) | 0x23
+            mem = (0x80100000 + 4*rnd.randrange(1024), rnd.getrandbits(32), 0xF, 0)
+            npc = pc + 4
+        elif p < 0.26:
+            # lw rd, 0(sp)
+            rd = rnd.randrange(8, 16)
+            rd_val = rnd.getrandbits(32)
+            instr = (2 << 15) | (2 << 12) | (rd << 7) | 0x03
+            mem = (0x80100000 + 4*rnd.randrange(1024), rd_val, 0, 0xF)
+            npc = pc + 4
+        elif p < 0.60:
+            # c.addi rd, imm
+            rd = rnd.randrange(8, 16)
+            rd_val = rnd.getrandbits(32)
+            instr = 0x0001 | (rd << 7) | (rnd.randrange(1, 32) << 2)
+            npc = pc + 2
+        else:
+            # addi rd, rs1, imm
+            rd = rnd.randrange(5, 32)
+            rd_val = rnd.getrandbits(32)
+            instr = (rnd.getrandbits(12) << 20) | (rnd.randrange(32) << 15) | (rd << 7) | 0x13
+            npc = pc + 4
+
+        ret_l.append((pc, instr, rd, rd_val) + mem)
+        pc = npc
+
+    return ret_l
+
+def _notify(level, last_instr, wmask):
+    """Mirrors the HDL's notification conditions"""
+    if level == RiscvDebugTraceLevel.Sample:
+        return False
+    if level == RiscvDebugTraceLevel.All or wmask:
+        return True
+    if level == RiscvDebugTraceLevel.Jump:
+        return riscv_decoder.jump_regs(last_instr) is not None
+    is_push, is_pop, _ = riscv_decoder.pushpop(last_instr)
+    return is_push or is_pop
+
+def _reg_event(mask, regs):
+    if mask == 0:
+        return (EV_NO_REGS, None)
+    if (mask & (mask-1)) == 0:
+        r = mask.bit_length()-1
+        return (EV_WRITE_REG, (r, regs[r]))
+    return (EV_WRITE_REGS, (mask,) + tuple(regs[1:32]))
+
+def program_events(prog, level):
+    """Converts a synthetic program into the export-task calls the HDL
+    makes at 'level'. Returns a list of (kind, reg_args, exec_args)"""
+    regs = [0]*32
+    mask = 0
+    ev_l = []
+    last_pc = 0
+    last_instr = 0
+
+    for i,(pc, instr, rd, rd_val, mem_addr, mem_data, wmask, rmask) in enumerate(prog):
+        if rd:
+            regs[rd] = rd_val
+            mask |= (1 << rd)
+
+        if _notify(level, last_instr, wmask):
+            is_push, is_pop, _ = riscv_decoder.pushpop(last_instr)
+            kind, reg_args = _reg_event(mask, regs)
+            ev_l.append((kind, reg_args, (last_pc, last_instr, pc, instr, 0, 0,
+                mem_addr, mem_data, wmask, rmask, i+1,
+                (1 if is_push else 0) | (2 if is_pop else 0))))
+            mask = 0
+        if level == RiscvDebugTraceLevel.Sample and ((i+1) % SAMPLE_PERIOD) == 0:
+            ev_l.append((EV_SAMPLE, None, (pc, i+1)))
+        last_pc = pc
+        last_instr = instr
+
+    return ev_l
+
+def trace_events(path):
+    """Converts a recorded trace into export-task calls. Returns the
+    trace level of the recording and the list of events"""
+    rd = RiscvTraceReader(path)
+    regs = [0]*32
+    mask = 0
+    ev_l = []
+
+    for rec in rd.records():
+        w0 = rec[0]
+        if (w0 & 0xFF) == REC_REGS:
+            m = rec[1]
+            mask |= m
+            for i in range(REC_REGS_MAX):
+                if m == 0:
+                    break
+                lsb = m & -m
+                regs[lsb.bit_length()-1] = rec[2+i]
+                m ^= lsb
+        elif (w0 & 0xFF) == REC_RETIRE:
+            kind, reg_args = _reg_event(mask, regs)
+            ev_l.append((kind, reg_args, (rec[1], rec[2], rec[3], rec[4],
+                (w0 >> 8) & 1, (w0 >> 9) & 1, rec[5], rec[6],
+                (w0 >> 20) & 0xF, (w0 >> 16) & 0xF, rec[7], (w0 >> 10) & 0x3)))
+            mask = 0
+
+    return (RiscvDebugTraceLevel(rd.trace_level), ev_l)
+
+def _new_bfm(level, disasm):
+    bfm = riscv_offline.new_bfm(RiscvDebugBfm)
+    bfm.set_trace_level(level)
+    bfm.set_sample_period(SAMPLE_PERIOD)
+    bfm.en_disasm = disasm
+    return bfm
+
+def _drive(bfm, ev_l):
+    write_reg = bfm._write_reg
+    write_regs = bfm._write_regs
+    instr_exec = bfm._instr_exec
+    sample = bfm._sample
+
+    for kind, reg_args, exec_args in ev_l:
+        if kind == EV_SAMPLE:
+            sample(*exec_args)
+            continue
+        if kind == EV_WRITE_REG:
+            write_reg(*reg_args)
+        elif kind == EV_WRITE_REGS:
+            write_regs(*reg_args)
+        instr_exec(*exec_args)
+
+def run(ev_l, n_instr, level, disasm, repeats):
+    mgr = riscv_offline.install()
+    best = None
+
+    for _ in range(repeats):
+        bfm = _new_bfm(level, disasm)
+        mgr.msg_count_m.clear()
+        start = time.perf_counter()
+        _drive(bfm, ev_l)
+        t = time.perf_counter() - start
+        best = t if best is None else min(best, t)
+
+    import_info = mgr.bfm_type_info_m[RiscvDebugBfm].import_info
+    imports = {}
+    for msg_id, n in mgr.msg_count_m.items():
+        imports[import_info[msg_id].T.__name__] = n
+
+    exports = {"_instr_exec": 0, "_sample": 0, "_write_reg": 0, "_write_regs": 0}
+    for kind, _, _ in ev_l:
+        if kind == EV_SAMPLE:
+            exports["_sample"] += 1
+            continue
+        exports["_instr_exec"] += 1
+        if kind == EV_WRITE_REG:
+            exports["_write_reg"] += 1
+        elif kind == EV_WRITE_REGS:
+            exports["_write_regs"] += 1
+
+    # Memory is measured in a separate run, since tracing slows it down
+    bfm = _new_bfm(level, disasm)
+    tracemalloc.start()
+    cur0, _ = tracemalloc.get_traced_memory()
+    _drive(bfm, ev_l)
+    cur1, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "level": level.name,
+        "disasm": disasm,
+        "instructions": n_instr,
+        "events": len(ev_l),
+        "seconds": best,
+        "events_per_sec": len(ev_l)/best if best else 0,
+        "instr_per_sec": n_instr/best if best else 0,
+        "export_calls": exports,
+        "import_calls": imports,
+        "retained_bytes_per_instr": (cur1-cur0)/n_instr if n_instr else 0,
+        "peak_kib": (peak-cur0)/1024
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=100000,
+        help="number of instructions in the synthetic program")
+    parser.add_argument("-r", type=int, default=3,
+        help="number of repeats; the best is reported")
+    parser.add_argument("-t", "--trace",
+        help="recorded trace to run instead of the synthetic program")
+    parser.add_argument("-o", default="bench_bfm.json",
+        help="JSON output file")
+    args = parser.parse_args()
+
+    riscv_offline.install()
+    results = []
+
+    if args.trace is not None:
+        level, ev_l = trace_events(args.trace)
+        n_instr = ev_l[-1][2][10] if len(ev_l) > 0 else 0
+        cases = [(level, ev_l)]
+        stream = args.trace
+    else:
+        prog = gen_program(args.n)
+        n_instr = args.n
+        cases = [(l, program_events(prog, l)) for l in RiscvDebugTraceLevel]
+        stream = "synthetic"
+
+    for level, ev_l in cases:
+        for disasm in (True, False):
+            res = run(ev_l, n_instr, level, disasm, args.r)
+            results.append(res)
+            print("%-6s disasm=%-5s %10d events %12.0f events/s %12.0f instr/s" % (
+                level.name, disasm, res["events"],
+                res["events_per_sec"], res["instr_per_sec"]))
+
+    with open(args.o, "w") as fp:
+        json.dump({
+            "stream": stream,
+            "python": platform.python_version(),
+            "results": results}, fp, indent=2)
+
+if __name__ == "__main__":
+    main()
+
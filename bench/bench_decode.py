@@ -0,0 +1,95 @@
+#****************************************************************************
+#* bench_decode.py
+#*
+#* Micro-benchmark for instruction decode. Measures the throughput, in
+#* instructions per second, of RiscvDebugBfm.disasm_32/disasm_16 and
+#* RiscvDebugBfm.is_pushpop over a synthetic RV32IMC instruction stream.
+#*
+#* The methods are called on a minimal stand-in object, so the same
+#* script can be run against earlier revisions for comparison.
+#*
+#* Usage: python bench/bench_decode.py [-n <instructions>] [-r <repeats>]
+#****************************************************************************
+import argparse
+import random
+import time
+import types
+
+from riscv_debug_bfms.riscv_debug_bfm import RiscvDebugBfm
+
+# Opcodes and compressed {funct3,quadrant} combinations that appear
+# in typical RV32IMC firmware
+OPCODES_32 = (0x03, 0x13, 0x13, 0x13, 0x17, 0x23, 0x33, 0x37, 0x63, 0x63, 0x67, 0x6F, 0x73)
+FUNCT7_OP = (0x00, 0x00, 0x01, 0x20)
+
+def gen_stream(n, seed=0):
+    """Returns a list of n (pc, instr) tuples"""
+    rnd = random.Random(seed)
+    ret = []
+    pc = 0x80000000
+
+    for _ in range(n):
+        if rnd.random() < 0.6:
+            op = rnd.choice(OPCODES_32)
+            instr = (rnd.getrandbits(25) << 7) | op
+            if op == 0x33:
+                instr = (instr & 0x01FFFFFF) | (rnd.choice(FUNCT7_OP) << 25)
+            elif op == 0x13 and ((instr >> 12) & 0x3) == 1:
+                # Keep shift-immediates legal: funct7 is 0, or 0x20 for srai
+                f7 = rnd.choice((0x00, 0x20)) if ((instr >> 12) & 0x7) == 5 else 0x00
+                instr = (instr & 0x01FFFFFF) | (f7 << 25)
+            ret.append((pc, instr & 0xFFFFFFFF))
+            pc += 4
+        else:
+            instr = rnd.getrandbits(16)
+            while (instr & 0x3) == 0x3 or instr == 0:
+                instr = rnd.getrandbits(16)
+            ret.append((pc, instr))
+            pc += 2
+    return ret
+
+def run(stream, repeats):
+    # Stand-in for the BFM instance. The decode methods only
+    # depend on the register file
+    bfm = types.SimpleNamespace(regs=[0]*32)
+    disasm_32 = RiscvDebugBfm.disasm_32
+    disasm_16 = RiscvDebugBfm.disasm_16
+    is_pushpop = RiscvDebugBfm.is_pushpop
+
+    best_dis = None
+    best_pp = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for pc,instr in stream:
+            if (instr & 0x3) == 0x3:
+                disasm_32(bfm, pc, instr)
+            else:
+                disasm_16(bfm, pc, instr)
+        t = time.perf_counter() - start
+        best_dis = t if best_dis is None else min(best_dis, t)
+
+        start = time.perf_counter()
+        for pc,instr in stream:
+            is_pushpop(bfm, instr, pc)
+        t = time.perf_counter() - start
+        best_pp = t if best_pp is None else min(best_pp, t)
+
+    return (len(stream)/best_dis, len(stream)/best_pp)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=200000,
+        help="number of instructions in the stream")
+    parser.add_argument("-r", type=int, default=5,
+        help="number of repeats; the best is reported")
+    args = parser.parse_args()
+
+    stream = gen_stream(args.n)
+    dis_ips, pp_ips = run(stream, args.r)
+
+    print("disasm:     %12.0f instr/s" % dis_ips)
+    print("is_pushpop: %12.0f instr/s" % pp_ips)
+
+if __name__ == "__main__":
+    main()
+
@@ -1,3 +1,3 @@
 # TODO: import BFMs here
 from .riscv_debug_bfm import *
-
+from .riscv_debug_mh_bfm import *
@@ -30,9 +30,121 @@ module riscv_debug_bfm #(
 	
 	riscv_debug_bfm_ctrl_m	_ctrl();
 	riscv_debug_bfm_ctxt_m  #(MSG_SZ) ctxt();
+	
+	// Maximum number of retire records buffered before 
+	// they are sent to Python. Must match BATCH_MAX in riscv_debug_bfm.py
+	localparam BATCH_MAX = 4;
+	
+	// Buffered retire records. See _instr_exec_batch in riscv_debug_bfm.py.
+	// Fields are kept to 32 bits, since export-task parameters are 
+	// limited to 32 bits under Verilog
+	reg[31:0]				batch_last_pc[0:BATCH_MAX-1];
+	reg[31:0]				batch_last_instr[0:BATCH_MAX-1];
+	reg[31:0]				batch_pc[0:BATCH_MAX-1];
+	reg[31:0]				batch_instr[0:BATCH_MAX-1];
+	reg[31:0]				batch_mem_addr[0:BATCH_MAX-1];
+	reg[31:0]				batch_mem_data[0:BATCH_MAX-1];
+	reg[31:0]				batch_count[0:BATCH_MAX-1];
+	reg[31:0]				batch_flags[0:BATCH_MAX-1]; // {bp, wmask, rmask, pop, push, iret, intr}
+	
+	// Number of memory-access address windows. Must match 
+	// MEM_WIN_MAX in riscv_debug_bfm.py
+	localparam MEM_WIN_MAX = 4;
+	
+	// Address windows [base..limit] for memory-access notifications.
+	// When no window is enabled for a direction, all accesses in 
+	// that direction are reported
+	reg[31:0]				mem_win_base[0:MEM_WIN_MAX-1];
+	reg[31:0]				mem_win_limit[0:MEM_WIN_MAX-1];
+	reg[MEM_WIN_MAX-1:0]	mem_win_rd_en = {MEM_WIN_MAX{1'b0}};
+	reg[MEM_WIN_MAX-1:0]	mem_win_wr_en = {MEM_WIN_MAX{1'b0}};
+	
+	// Access masks of the current instruction, after window filtering
+	reg[3:0]				mem_wmask_f;
+	reg[3:0]				mem_rmask_f;
+	
+	// Number of PC breakpoint comparators. Must match BP_MAX 
+	// in riscv_debug_bfm.py
+	localparam BP_MAX = 4;
+	
+	// PC ranges [base..limit]. When the current instruction's pc 
+	// falls within an enabled range, Python is notified and all 
+	// registers are sent
+	reg[31:0]				bp_base[0:BP_MAX-1];
+	reg[31:0]				bp_limit[0:BP_MAX-1];
+	reg[BP_MAX-1:0]			bp_en = {BP_MAX{1'b0}};
+	
+	// Set when the current instruction hits a breakpoint
+	reg						bp_hit = 0;
+	
+	// Number of 32-bit words in the coverage bitmap. Must match 
+	// COV_WORDS in riscv_debug_bfm.py
+	localparam COV_WORDS = 4096;
+	
+	// Coverage bitmap over [cov_base..cov_limit]. Bit n is set when
+	// an instruction at cov_base+2*n retires
+	reg[31:0]				cov_map[0:COV_WORDS-1];
+	reg[31:0]				cov_base = 0;
+	reg[31:0]				cov_limit = 0;
+	reg						cov_en = 0;
+	reg[31:0]				cov_idx;
+	
+	// Number of machine CSRs shadowed. Must match CSR_ADDRS in 
+	// riscv_debug_bfm.py
+	localparam CSR_MAX = 8;
+	
+	// Shadow of mstatus, mie, mtvec, mscratch, mepc, mcause, mtval 
+	// and mip. CSRs written since the last notification are sent 
+	// before it, like registers
+	reg[31:0]				csr_shadow[0:CSR_MAX-1];
+	reg[CSR_MAX-1:0]		csr_written = {CSR_MAX{1'b0}};
+	reg[3:0]				csr_idx;
+	
+	// Call/return classification of the last instruction, using the
+	// return-address-stack hints from the RISC-V spec: x1 and x5 are 
+	// link registers. A jump that writes a link register is a call 
+	// (push). A jump through a link register is a return (pop), unless
+	// it also writes the same link register.
+	wire					last_is_jal = (_ctrl.last_instr[6:0] == 7'b1101111);
+	wire					last_is_jalr = (_ctrl.last_instr[6:0] == 7'b1100111 &&
+								_ctrl.last_instr[14:12] == 3'b000);
+	wire					last_is_cjal = (_ctrl.last_instr[1:0] == 2'b01 &&
+								_ctrl.last_instr[15:13] == 3'b001);
+	wire					last_is_cj = (_ctrl.last_instr[1:0] == 2'b01 &&
+								_ctrl.last_instr[15:13] == 3'b101);
+	wire					last_is_cjr_cjalr = (_ctrl.last_instr[1:0] == 2'b10 &&
+								_ctrl.last_instr[15:13] == 3'b100 &&
+								_ctrl.last_instr[6:2] == 5'b0 && |_ctrl.last_instr[11:7]);
+	wire					last_is_jump = (last_is_jal || last_is_jalr ||
+								last_is_cjal || last_is_cj || last_is_cjr_cjalr);
+	wire[4:0]				last_jump_rd = 
+								(last_is_jal || last_is_jalr)?_ctrl.last_instr[11:7]:
+								(last_is_cjal)?5'd1:
+								(last_is_cjr_cjalr && _ctrl.last_instr[12])?5'd1:5'd0;
+	wire[4:0]				last_jump_rs1 = 
+								(last_is_jalr)?_ctrl.last_instr[19:15]:
+								(last_is_cjr_cjalr)?_ctrl.last_instr[11:7]:5'd0;
+	wire					last_rd_link = (last_jump_rd == 5'd1 || last_jump_rd == 5'd5);
+	wire					last_rs1_link = (last_jump_rs1 == 5'd1 || last_jump_rs1 == 5'd5);
+	wire					last_push = (last_is_jump && last_rd_link);
+	wire					last_pop = (last_is_jump && last_rs1_link &&
+								(!last_rd_link || last_jump_rd != last_jump_rs1));
+								
+	// Calls and returns are not reported while tracing is suppressed
+	// or sampled
+	wire					rec_push = (last_push && !_ctrl.run && !_ctrl.trace_sample);
+	wire					rec_pop = (last_pop && !_ctrl.run && !_ctrl.trace_sample);
+	
+	// Memory accesses are only reported while sampling when enabled
+	// with _set_sample
+	wire					mem_trace_en = (!_ctrl.trace_sample || _ctrl.sample_mem);
     
     always @(posedge clock or posedge reset) begin
         if (reset) begin
+            // Deliver buffered records before entering reset
+            if (_ctrl.batch_n != 0) begin
+            	_flush_batch_regs(0);
+            end
             _ctrl.in_reset <= 1;
             _ctrl.reg_written <= 32'h0;
         end else begin
@@ -41,6 +153,16 @@ module riscv_debug_bfm #(
                 _ctrl.in_reset <= 1'b0;
             end
             
+            // CSRs can be written by trap entry as well as by 
+            // instructions, so writes are captured on any cycle
+            if (csr_write) begin
+            	csr_idx = _csr_idx(csr_waddr);
+            	if (csr_idx < CSR_MAX) begin
+            		csr_shadow[csr_idx] = csr_wdata;
+            		csr_written[csr_idx] = 1'b1;
+            	end
+            end
+            
             if (valid) begin
             	_ctrl.last_instr <= instr;
             	_ctrl.last_pc    <= pc;
@@ -50,6 +172,17 @@ module riscv_debug_bfm #(
             	ctxt.pc <= pc;
             	ctxt.instr <= instr;
             	
+            	// Drop accesses outside the address windows
+            	mem_wmask_f = (_mem_win_hit(mem_addr, mem_win_wr_en))?mem_wmask:4'b0;
+            	mem_rmask_f = (_mem_win_hit(mem_addr, mem_win_rd_en))?mem_rmask:4'b0;
+            	
+            	bp_hit = _bp_hit(pc);
+            	
+            	if (cov_en && pc >= cov_base && pc <= cov_limit) begin
+            		cov_idx = (pc - cov_base) >> 1;
+            		cov_map[cov_idx[31:5]] = cov_map[cov_idx[31:5]] | (32'h1 << cov_idx[4:0]);
+            	end
+            	
            		// Cache the registers updated while we're 
            		// not notifying the Python environment
            		if (|rd_addr) begin
@@ -93,34 +226,38 @@ module riscv_debug_bfm #(
             		endcase
             	end
             	
-            	if (_ctrl.trace_instr_all 
-            			|| (_ctrl.trace_mem_writes && |mem_wmask)
-            			|| (_ctrl.trace_mem_reads && |mem_rmask)
+            	if (bp_hit) begin
+            		_notify_exec_state();
+            		
+            		// Tracing resumes at the configured level
+            		_ctrl.run = 0;
+            	end else if (_ctrl.run) begin
+            		// Tracing is suppressed until a breakpoint hits. 
+            		// Memory accesses are still reported, so the 
+            		// mirror memory stays current
+            		if ((_ctrl.trace_mem_writes && |mem_wmask_f)
+            				|| (_ctrl.trace_mem_reads && |mem_rmask_f)
+            				|| (_ctrl.instr_limit_count == 1)) begin
+            			_notify_exec_state();
+            		end
+            	end else if (_ctrl.trace_instr_all 
+            			|| (_ctrl.trace_mem_writes && |mem_wmask_f && mem_trace_en)
+            			|| (_ctrl.trace_mem_reads && |mem_rmask_f && mem_trace_en)
             			|| (_ctrl.instr_limit_count == 1)
-            			|| _ctrl.last_intr || _ctrl.last_iret) begin
-            		_update_exec_state();
-            		_ctrl.reg_written <= 32'h0;
+            			|| ((_ctrl.last_intr || _ctrl.last_iret) && !_ctrl.trace_sample)) begin
+            		_notify_exec_state();
             	end else if (_ctrl.trace_instr_jump) begin
-            		// Notify on all jumps
-           			if (_ctrl.last_instr[6:0] == 7'b1101111 || // jal
-           				_ctrl.last_instr[6:0] == 7'b1100111) begin // jalr
-           				_update_exec_state();
-            			_ctrl.reg_written <= 32'h0;
+            		// Notify on all jumps (jal, jalr, c.j, c.jal, c.jr, c.jalr)
+           			if (last_is_jump) begin
+           				_notify_exec_state();
            			end 
             	end else if (_ctrl.trace_instr_call) begin
-            		// Notify on call/ret instructions
-            		if ((_ctrl.last_instr[6:0] == 7'b1101111 && // jal
-           				(_ctrl.last_instr[11:7] == 1 || _ctrl.last_instr[11:7] == 5 ||
-           					_ctrl.last_instr[19:15] == 1 || _ctrl.last_instr[19:15] == 5))
-           				|| _ctrl.last_instr[6:0] == 7'b1100111) begin  // jalr
-       					// Likely call or return
+            		// Notify on call/ret instructions only. Plain and 
+            		// tail jumps are not reported
+            		if (last_push || last_pop) begin
        					// Note that we update the Python environment on
       					// the target instruction, not its source
-       					_update_exec_state();
-       					_ctrl.reg_written <= 32'h0;
-            		end else if ((_ctrl.last_instr[1:0] == 'b10 && _ctrl.last_instr[15:13] == 'b100)
-            				|| (_ctrl.last_instr[1:0] == 'b10 && _ctrl.last_instr[15:13] == 'b001)) begin
-            			// Compressed c.jal/c.jalr
+       					_notify_exec_state();
             		end
             	end else begin
             		// Cache the registers updated while we're 
@@ -133,6 +270,20 @@ module riscv_debug_bfm #(
             	if (_ctrl.instr_limit_count > 0) begin
             		_ctrl.instr_limit_count = _ctrl.instr_limit_count - 1;
             	end
+            	bp_hit = 0;
+            	
+            	// Report the pc every sample_period (+jitter) instructions
+            	if (_ctrl.trace_sample) begin
+            		if (_ctrl.sample_count <= 1) begin
+            			_sample(pc, _ctrl.instr_count);
+            			_ctrl.sample_count = _ctrl.sample_period + 
+            				(_ctrl.sample_lfsr & _ctrl.sample_jitter);
+            			_ctrl.sample_lfsr = (_ctrl.sample_lfsr >> 1) ^ 
+            				({32{_ctrl.sample_lfsr[0]}} & 32'h80200003);
+            		end else begin
+            			_ctrl.sample_count = _ctrl.sample_count - 1;
+            		end
+            	end
             end
         end
     end
@@ -140,49 +291,67 @@ module riscv_debug_bfm #(
     task init;
     begin
         $display("riscv_debug_bfm: %m");
+        _clr_cov();
         _set_parameters(MSG_SZ);
     end
     endtask
     	
-    task _update_exec_state;
+    // Notifies the Python environment of the current execution 
+    // state, either immediately or by buffering the retire record
+    task _notify_exec_state;
     begin
-    	// Send the current-instruction's write (if any)
-    	if (|rd_addr) begin
-    		_write_reg(rd_addr, rd_wdata);
+    	if (_ctrl.batch_sz > 1) begin
+    		batch_last_pc[_ctrl.batch_n] = _ctrl.last_pc;
+    		batch_last_instr[_ctrl.batch_n] = _ctrl.last_instr;
+    		batch_pc[_ctrl.batch_n] = pc;
+    		batch_instr[_ctrl.batch_n] = instr;
+    		batch_mem_addr[_ctrl.batch_n] = mem_addr;
+    		batch_mem_data[_ctrl.batch_n] = mem_data;
+    		batch_count[_ctrl.batch_n] = _ctrl.instr_count;
+    		batch_flags[_ctrl.batch_n] = {19'b0, bp_hit, mem_wmask_f, mem_rmask_f, 
+    			rec_pop, rec_push, _ctrl.last_iret, _ctrl.last_intr};
+    		_ctrl.batch_n = _ctrl.batch_n + 1;
+    		
+    		// Interrupt entry/exit, breakpoint and instruction-limit 
+    		// hits must be seen by Python immediately
+    		if (_ctrl.batch_n >= _ctrl.batch_sz
+    				|| _ctrl.last_intr || _ctrl.last_iret || bp_hit
+    				|| _ctrl.instr_limit_count == 1) begin
+    			_flush_batch_regs(1);
+    		end
+    	end else begin
+    		_update_exec_state();
+    		_ctrl.reg_written <= 32'h0;
     	end
+    end
+    endtask
+    
+    // Sends modified registers, followed by all buffered retire records.
+    // 'cur_rd' specifies whether the current instruction's register
+    // write must also be sent
+    task _flush_batch_regs(input reg cur_rd);
+    begin
+    	_send_regs(cur_rd);
+    	_ctrl.reg_written <= 32'h0;
+    	
+    	_instr_exec_batch(
+    		_ctrl.batch_n,
+    		batch_last_pc[0], batch_last_instr[0], batch_pc[0], batch_instr[0],
+    		batch_mem_addr[0], batch_mem_data[0], batch_count[0], batch_flags[0],
+    		batch_last_pc[1], batch_last_instr[1], batch_pc[1], batch_instr[1],
+    		batch_mem_addr[1], batch_mem_data[1], batch_count[1], batch_flags[1],
+    		batch_last_pc[2], batch_last_instr[2], batch_pc[2], batch_instr[2],
+    		batch_mem_addr[2], batch_mem_data[2], batch_count[2], batch_flags[2],
+    		batch_last_pc[3], batch_last_instr[3], batch_pc[3], batch_instr[3],
+    		batch_mem_addr[3], batch_mem_data[3], batch_count[3], batch_flags[3]);
+    	_ctrl.batch_n = 0;
+    end
+    endtask
     	
-    	// Send previously-updated registers
-    	if (_ctrl.reg_written[1]) _write_reg(1, ctxt.regs.x1);
-    	if (_ctrl.reg_written[2]) _write_reg(2, ctxt.regs.x2);
-    	if (_ctrl.reg_written[3]) _write_reg(3, ctxt.regs.x3);
-    	if (_ctrl.reg_written[4]) _write_reg(4, ctxt.regs.x4);
-    	if (_ctrl.reg_written[5]) _write_reg(5, ctxt.regs.x5);
-    	if (_ctrl.reg_written[6]) _write_reg(6, ctxt.regs.x6);
-    	if (_ctrl.reg_written[7]) _write_reg(7, ctxt.regs.x7);
-    	if (_ctrl.reg_written[8]) _write_reg(8, ctxt.regs.x8);
-    	if (_ctrl.reg_written[9]) _write_reg(9, ctxt.regs.x9);
-    	if (_ctrl.reg_written[10]) _write_reg(10, ctxt.regs.x10);
-    	if (_ctrl.reg_written[11]) _write_reg(11, ctxt.regs.x11);
-    	if (_ctrl.reg_written[12]) _write_reg(12, ctxt.regs.x12);
-    	if (_ctrl.reg_written[13]) _write_reg(13, ctxt.regs.x13);
-    	if (_ctrl.reg_written[14]) _write_reg(14, ctxt.regs.x14);
-    	if (_ctrl.reg_written[15]) _write_reg(15, ctxt.regs.x15);
-    	if (_ctrl.reg_written[16]) _write_reg(16, ctxt.regs.x16);
-    	if (_ctrl.reg_written[17]) _write_reg(17, ctxt.regs.x17);
-    	if (_ctrl.reg_written[18]) _write_reg(18, ctxt.regs.x18);
-    	if (_ctrl.reg_written[19]) _write_reg(19, ctxt.regs.x19);
-    	if (_ctrl.reg_written[20]) _write_reg(20, ctxt.regs.x20);
-    	if (_ctrl.reg_written[21]) _write_reg(21, ctxt.regs.x21);
-    	if (_ctrl.reg_written[22]) _write_reg(22, ctxt.regs.x22);
-    	if (_ctrl.reg_written[23]) _write_reg(23, ctxt.regs.x23);
-    	if (_ctrl.reg_written[24]) _write_reg(24, ctxt.regs.x24);
-    	if (_ctrl.reg_written[25]) _write_reg(25, ctxt.regs.x25);
-    	if (_ctrl.reg_written[26]) _write_reg(26, ctxt.regs.x26);
-    	if (_ctrl.reg_written[27]) _write_reg(27, ctxt.regs.x27);
-    	if (_ctrl.reg_written[28]) _write_reg(28, ctxt.regs.x28);
-    	if (_ctrl.reg_written[29]) _write_reg(29, ctxt.regs.x29);
-    	if (_ctrl.reg_written[30]) _write_reg(30, ctxt.regs.x30);
-    	if (_ctrl.reg_written[31]) _write_reg(31, ctxt.regs.x31);
+    task _update_exec_state;
+    begin
+    	// Send the registers written since the last notification
+    	_send_regs(1);
 
     	// Finally, signal the instruction execution
     	_instr_exec(
@@ -194,12 +363,141 @@ module riscv_debug_bfm #(
     			_ctrl.last_iret,
     			mem_addr,
     			mem_data,
-    			mem_wmask,
-    			mem_rmask,
-    			_ctrl.instr_count);
+    			mem_wmask_f,
+    			mem_rmask_f,
+    			_ctrl.instr_count,
+    			{bp_hit, rec_pop, rec_push});
     end
     endtask
     
+    // Sends registers written since the last notification. 
+    // 'cur_rd' specifies whether the current instruction's register 
+    // write must also be sent. A lone write goes through _write_reg, 
+    // while multiple writes are sent as a single _write_regs call.
+    // All registers are sent on a breakpoint hit
+    task _send_regs(input reg cur_rd);
+    	reg[31:0]		mask;
+    	reg[4:0]		rd_sel;
+   	begin
+   		if (|csr_written) begin
+   			_write_csrs(csr_written,
+   				csr_shadow[0], csr_shadow[1], csr_shadow[2], csr_shadow[3],
+   				csr_shadow[4], csr_shadow[5], csr_shadow[6], csr_shadow[7]);
+   			csr_written = {CSR_MAX{1'b0}};
+   		end
+   		
+   		mask = (bp_hit)?32'hFFFFFFFF:_ctrl.reg_written;
+   		rd_sel = (cur_rd)?rd_addr:5'd0;
+   		if (|rd_sel) begin
+   			mask[rd_sel] = 1'b1;
+   		end
+   		mask[0] = 1'b0;
+   		
+   		if (|rd_sel && mask == (32'h1 << rd_sel)) begin
+   			_write_reg(rd_sel, rd_wdata);
+   		end else if (|mask) begin
+   			_write_regs(mask,
+   				_reg_val(1, rd_sel), _reg_val(2, rd_sel), _reg_val(3, rd_sel), _reg_val(4, rd_sel),
+   				_reg_val(5, rd_sel), _reg_val(6, rd_sel), _reg_val(7, rd_sel), _reg_val(8, rd_sel),
+   				_reg_val(9, rd_sel), _reg_val(10, rd_sel), _reg_val(11, rd_sel), _reg_val(12, rd_sel),
+   				_reg_val(13, rd_sel), _reg_val(14, rd_sel), _reg_val(15, rd_sel), _reg_val(16, rd_sel),
+   				_reg_val(17, rd_sel), _reg_val(18, rd_sel), _reg_val(19, rd_sel), _reg_val(20, rd_sel),
+   				_reg_val(21, rd_sel), _reg_val(22, rd_sel), _reg_val(23, rd_sel), _reg_val(24, rd_sel),
+   				_reg_val(25, rd_sel), _reg_val(26, rd_sel), _reg_val(27, rd_sel), _reg_val(28, rd_sel),
+   				_reg_val(29, rd_sel), _reg_val(30, rd_sel), _reg_val(31, rd_sel));
+   		end
+   	end
+    endtask
+    
+    // Returns the current value of register 'n'. The value written
+    // by the current instruction (rd_sel) is not yet in ctxt.regs
+    function [31:0] _reg_val(input [4:0] n, input [4:0] rd_sel);
+   	begin
+   		if (|rd_sel && n == rd_sel) begin
+   			_reg_val = rd_wdata;
+   		end else begin
+   			case (n)
+   				1: _reg_val = ctxt.regs.x1;
+   				2: _reg_val = ctxt.regs.x2;
+   				3: _reg_val = ctxt.regs.x3;
+   				4: _reg_val = ctxt.regs.x4;
+   				5: _reg_val = ctxt.regs.x5;
+   				6: _reg_val = ctxt.regs.x6;
+   				7: _reg_val = ctxt.regs.x7;
+   				8: _reg_val = ctxt.regs.x8;
+   				9: _reg_val = ctxt.regs.x9;
+   				10: _reg_val = ctxt.regs.x10;
+   				11: _reg_val = ctxt.regs.x11;
+   				12: _reg_val = ctxt.regs.x12;
+   				13: _reg_val = ctxt.regs.x13;
+   				14: _reg_val = ctxt.regs.x14;
+   				15: _reg_val = ctxt.regs.x15;
+   				16: _reg_val = ctxt.regs.x16;
+   				17: _reg_val = ctxt.regs.x17;
+   				18: _reg_val = ctxt.regs.x18;
+   				19: _reg_val = ctxt.regs.x19;
+   				20: _reg_val = ctxt.regs.x20;
+   				21: _reg_val = ctxt.regs.x21;
+   				22: _reg_val = ctxt.regs.x22;
+   				23: _reg_val = ctxt.regs.x23;
+   				24: _reg_val = ctxt.regs.x24;
+   				25: _reg_val = ctxt.regs.x25;
+   				26: _reg_val = ctxt.regs.x26;
+   				27: _reg_val = ctxt.regs.x27;
+   				28: _reg_val = ctxt.regs.x28;
+   				29: _reg_val = ctxt.regs.x29;
+   				30: _reg_val = ctxt.regs.x30;
+   				31: _reg_val = ctxt.regs.x31;
+   				default: _reg_val = 32'h0;
+   			endcase
+   		end
+   	end
+    endfunction
+    
+    // Returns 1 if 'addr' falls within one of the windows enabled
+    // in 'en', or if no window is enabled
+    function _mem_win_hit(input [31:0] addr, input [MEM_WIN_MAX-1:0] en);
+    	integer i;
+   	begin
+   		_mem_win_hit = ~|en;
+   		for (i=0; i<MEM_WIN_MAX; i=i+1) begin
+   			if (en[i] && addr >= mem_win_base[i] && addr <= mem_win_limit[i]) begin
+   				_mem_win_hit = 1'b1;
+   			end
+   		end
+   	end
+    endfunction
+    
+    // Returns the shadow index of a CSR, or CSR_MAX if not shadowed
+    function [3:0] _csr_idx(input [11:0] addr);
+   	begin
+   		case (addr)
+   			12'h300: _csr_idx = 0; // mstatus
+   			12'h304: _csr_idx = 1; // mie
+   			12'h305: _csr_idx = 2; // mtvec
+   			12'h340: _csr_idx = 3; // mscratch
+   			12'h341: _csr_idx = 4; // mepc
+   			12'h342: _csr_idx = 5; // mcause
+   			12'h343: _csr_idx = 6; // mtval
+   			12'h344: _csr_idx = 7; // mip
+   			default: _csr_idx = CSR_MAX;
+   		endcase
+   	end
+    endfunction
+    
+    // Returns 1 if 'addr' falls within an enabled breakpoint range
+    function _bp_hit(input [31:0] addr);
+    	integer i;
+   	begin
+   		_bp_hit = 1'b0;
+   		for (i=0; i<BP_MAX; i=i+1) begin
+   			if (bp_en[i] && addr >= bp_base[i] && addr <= bp_limit[i]) begin
+   				_bp_hit = 1'b1;
+   			end
+   		end
+   	end
+    endfunction
+    
     task _set_tid_c(
     	input reg[7:0] 		idx, 
     	input reg[7:0] 		ch);
@@ -210,6 +508,17 @@ module riscv_debug_bfm #(
    	end
    	endtask
    	
+   	task _set_tid_w(
+   		input reg[7:0]		idx,
+   		input reg[31:0]		w0,
+   		input reg[31:0]		w1,
+   		input reg[31:0]		w2,
+   		input reg[31:0]		w3);
+   	begin
+   		ctxt.tid = _msg_set_chunk(ctxt.tid, idx, {w0, w1, w2, w3});
+   	end
+   	endtask
+   	
    	task _clr_tid;
    		ctxt.tid = {MSG_SZ{1'b0}};
    	endtask
@@ -251,6 +560,27 @@ module riscv_debug_bfm #(
    	end
     endtask
     
+    task _set_func_w(
+    	input reg[7:0]		frame,
+    	input reg[7:0]		idx,
+    	input reg[31:0]		w0,
+    	input reg[31:0]		w1,
+    	input reg[31:0]		w2,
+    	input reg[31:0]		w3);
+   	begin
+   		case (frame)
+   			0: ctxt.frame0 = _msg_set_chunk(ctxt.frame0, idx, {w0, w1, w2, w3});
+   			1: ctxt.frame1 = _msg_set_chunk(ctxt.frame1, idx, {w0, w1, w2, w3});
+   			2: ctxt.frame2 = _msg_set_chunk(ctxt.frame2, idx, {w0, w1, w2, w3});
+   			3: ctxt.frame3 = _msg_set_chunk(ctxt.frame3, idx, {w0, w1, w2, w3});
+   			4: ctxt.frame4 = _msg_set_chunk(ctxt.frame4, idx, {w0, w1, w2, w3});
+   			5: ctxt.frame5 = _msg_set_chunk(ctxt.frame5, idx, {w0, w1, w2, w3});
+   			6: ctxt.frame6 = _msg_set_chunk(ctxt.frame6, idx, {w0, w1, w2, w3});
+   			7: ctxt.frame7 = _msg_set_chunk(ctxt.frame7, idx, {w0, w1, w2, w3});
+   		endcase
+   	end
+    endtask
+    
     task _clr_func(input reg[7:0] frame);
    	begin
    		case (frame)
@@ -296,10 +626,142 @@ module riscv_debug_bfm #(
    	end
     endtask
     
+    task _set_disasm_w(
+    	input reg[7:0]		idx,
+    	input reg[31:0]		w0,
+    	input reg[31:0]		w1,
+    	input reg[31:0]		w2,
+    	input reg[31:0]		w3);
+   	begin
+   		ctxt.disasm = _msg_set_chunk(ctxt.disasm, idx, {w0, w1, w2, w3});
+   	end
+    endtask
+    
+    // Replaces 16 characters of a message string, starting at 
+    // character 16*idx. The first character of the chunk is in
+    // the most-significant byte. Characters beyond MSG_SZ are ignored
+    function [8*MSG_SZ-1:0] _msg_set_chunk(
+    	input [8*MSG_SZ-1:0]	msg,
+    	input [7:0]				idx,
+    	input [127:0]			chunk);
+    	integer i, j;
+   	begin
+   		_msg_set_chunk = msg;
+   		for (j=0; j<16; j=j+1) begin
+   			i = 16*idx + j;
+   			if (i < MSG_SZ) begin
+   				_msg_set_chunk[8*(MSG_SZ-i-1) +: 8] = chunk[8*(15-j) +: 8];
+   			end
+   		end
+   	end
+    endfunction
+    
     task _set_instr_limit(input reg[31:0] limit);
     	_ctrl.instr_limit_count = limit;
     endtask
     
+    task _set_mem_win(
+    	input reg[7:0]		idx,
+    	input reg[31:0]		base,
+    	input reg[31:0]		limit,
+    	input reg[7:0]		en);
+   	begin
+   		if (idx < MEM_WIN_MAX) begin
+   			mem_win_base[idx] = base;
+   			mem_win_limit[idx] = limit;
+   			mem_win_rd_en[idx] = en[0];
+   			mem_win_wr_en[idx] = en[1];
+   		end
+   	end
+    endtask
+    
+    task _set_bp(
+    	input reg[7:0]		idx,
+    	input reg[31:0]		base,
+    	input reg[31:0]		limit,
+    	input reg[7:0]		en);
+   	begin
+   		if (idx < BP_MAX) begin
+   			bp_base[idx] = base;
+   			bp_limit[idx] = limit;
+   			bp_en[idx] = en[0];
+   		end
+   	end
+    endtask
+    
+    task _set_run(input reg[7:0] en);
+    	_ctrl.run = en[0];
+    endtask
+    
+    // Sets the sampling interval to 'period' plus a pseudo-random 
+    // value masked by 'jitter'. 'mem' enables reporting of memory 
+    // accesses while sampling
+    task _set_sample(
+    	input reg[31:0]		period,
+    	input reg[31:0]		jitter,
+    	input reg[7:0]		mem);
+   	begin
+   		_ctrl.sample_period = period;
+   		_ctrl.sample_jitter = jitter;
+   		_ctrl.sample_mem = |mem;
+   		_ctrl.sample_count = period;
+   	end
+    endtask
+    
+    task _set_cov(
+    	input reg[31:0]		base,
+    	input reg[31:0]		limit,
+    	input reg[7:0]		en);
+   	begin
+   		cov_base = base;
+   		cov_limit = limit;
+   		cov_en = en[0];
+   	end
+    endtask
+    
+    task _clr_cov;
+    	integer i;
+   	begin
+   		for (i=0; i<COV_WORDS; i=i+1) begin
+   			cov_map[i] = 32'h0;
+   		end
+   	end
+    endtask
+    
+    // Sends the first 'n' words of the coverage bitmap, 16 words 
+    // per _cov_data call
+    task _cov_dump(input reg[31:0] n);
+    	integer i;
+   	begin
+   		for (i=0; i<n && i<COV_WORDS; i=i+16) begin
+   			_cov_data(i,
+   				cov_map[i], cov_map[i+1], cov_map[i+2], cov_map[i+3],
+   				cov_map[i+4], cov_map[i+5], cov_map[i+6], cov_map[i+7],
+   				cov_map[i+8], cov_map[i+9], cov_map[i+10], cov_map[i+11],
+   				cov_map[i+12], cov_map[i+13], cov_map[i+14], cov_map[i+15]);
+   		end
+   	end
+    endtask
+    
+    task _set_batch_sz(input reg[31:0] n);
+    begin
+    	_ctrl.batch_sz = n;
+    	
+    	// Deliver any records buffered under the old size
+    	if (_ctrl.batch_n != 0 && _ctrl.batch_n >= _ctrl.batch_sz) begin
+    		_flush_batch_regs(0);
+    	end
+    end
+    endtask
+    
+    task _flush_batch;
+    begin
+    	if (_ctrl.batch_n != 0) begin
+    		_flush_batch_regs(0);
+    	end
+    end
+    endtask
+    
     task _set_trace_level(input reg[31:0] level);
    	begin
    		case (level)
@@ -307,16 +769,26 @@ module riscv_debug_bfm #(
    				_ctrl.trace_instr_all = 0;
    				_ctrl.trace_instr_jump = 0;
    				_ctrl.trace_instr_call = 1;
+   				_ctrl.trace_sample = 0;
    			end
    			1: begin //
    				_ctrl.trace_instr_all = 0;
    				_ctrl.trace_instr_jump = 1;
    				_ctrl.trace_instr_call = 0;
+   				_ctrl.trace_sample = 0;
    			end
    			2: begin //
    				_ctrl.trace_instr_all = 1;
    				_ctrl.trace_instr_jump = 0;
    				_ctrl.trace_instr_call = 0;
+   				_ctrl.trace_sample = 0;
+   			end
+   			3: begin // Sample
+   				_ctrl.trace_instr_all = 0;
+   				_ctrl.trace_instr_jump = 0;
+   				_ctrl.trace_instr_call = 0;
+   				_ctrl.trace_sample = 1;
+   				_ctrl.sample_count = _ctrl.sample_period;
    			end
    			default: begin
    				$display("%m Error: unknown trace level %0d", level);
@@ -425,12 +897,27 @@ module riscv_debug_bfm_ctrl_m();
 	reg						trace_instr_all   = 1;
 	reg						trace_instr_jump  = 1;
 	reg						trace_instr_call  = 1;
+	reg						trace_sample      = 0;
 	reg						trace_reg_writes  = 0;
 	reg						trace_mem_writes  = 1;
 	reg						trace_mem_reads   = 0;
 	reg[31:0]				instr_limit_count = 0;
 	reg[31:0]				instr_count = 0;
 	
+	// Suppresses tracing until a breakpoint hits
+	reg						run = 0;
+	
+	// PC sampling
+	reg[31:0]				sample_period = 10000;
+	reg[31:0]				sample_jitter = 0;
+	reg[31:0]				sample_count = 0;
+	reg[31:0]				sample_lfsr = 32'h1;
+	reg						sample_mem = 0;
+	
+	// Retire-record batching
+	reg[7:0]				batch_sz = 0;
+	reg[7:0]				batch_n = 0;
+	
     reg            			in_reset = 0;
     
     reg[31:0]				last_pc = {32{1'b0}};
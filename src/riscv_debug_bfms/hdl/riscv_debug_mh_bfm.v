@@ -0,0 +1,378 @@
+/****************************************************************************
+ * riscv_debug_mh_bfm.v
+ *
+ * Multi-hart variant of riscv_debug_bfm. Each retire port is a vector
+ * with one element per hart. Retire records from all harts that retire
+ * in a clock cycle are delivered to Python in up to REC_MAX records
+ * per call.
+ ****************************************************************************/
+
+module riscv_debug_mh_bfm #(
+		parameter NHARTS = 4,		// Number of harts (1..8)
+		parameter MSG_SZ = 32 		// Maximum characters in the message fields
+		) (
+        input						clock,
+        input						reset,
+		input[NHARTS-1:0]			valid,
+		input[32*NHARTS-1:0] 		instr,
+		input[NHARTS-1:0]			intr,
+		input[NHARTS-1:0]			iret,
+		// RD
+		input[5*NHARTS-1:0] 		rd_addr,
+		input[32*NHARTS-1:0] 		rd_wdata,
+
+		input[32*NHARTS-1:0]		pc,
+
+		input[32*NHARTS-1:0]		mem_addr,
+		input[4*NHARTS-1:0]			mem_rmask,
+		input[4*NHARTS-1:0]			mem_wmask,
+		input[32*NHARTS-1:0]		mem_data
+        );
+
+	// Maximum number of harts. Must match MH_HARTS_MAX in riscv_debug_mh_bfm.py
+	localparam HARTS_MAX = 8;
+	
+	// Maximum number of retire records per _instr_exec_mh call. Must 
+	// match MH_REC_MAX in riscv_debug_mh_bfm.py
+	localparam REC_MAX = 4;
+
+	reg						in_reset = 0;
+	reg						trace_instr_all   = 1;
+	reg						trace_instr_jump  = 1;
+	reg						trace_instr_call  = 1;
+	reg						trace_mem_writes  = 1;
+	reg						trace_mem_reads   = 0;
+
+	// Per-hart state
+	reg[31:0]				last_pc[0:HARTS_MAX-1];
+	reg[31:0]				last_instr[0:HARTS_MAX-1];
+	reg						last_intr[0:HARTS_MAX-1];
+	reg						last_iret[0:HARTS_MAX-1];
+	reg[31:0]				instr_count[0:HARTS_MAX-1];
+	reg[31:0]				reg_written[0:HARTS_MAX-1];
+	reg[31:0]				regs[0:32*HARTS_MAX-1];
+
+	// Message strings shown for each hart
+	reg[8*MSG_SZ-1:0]		disasm_s[0:HARTS_MAX-1];
+	reg[8*MSG_SZ-1:0]		tid_s[0:HARTS_MAX-1];
+	reg[8*MSG_SZ-1:0]		frame_s[0:8*HARTS_MAX-1];
+
+	// Retire records of the current cycle. See _instr_exec_mh in
+	// riscv_debug_mh_bfm.py. Fields are kept to 32 bits, since 
+	// export-task parameters are limited to 32 bits under Verilog
+	reg[31:0]				rec_last_pc[0:HARTS_MAX-1];
+	reg[31:0]				rec_last_instr[0:HARTS_MAX-1];
+	reg[31:0]				rec_pc[0:HARTS_MAX-1];
+	reg[31:0]				rec_instr[0:HARTS_MAX-1];
+	reg[31:0]				rec_mem_addr[0:HARTS_MAX-1];
+	reg[31:0]				rec_mem_data[0:HARTS_MAX-1];
+	reg[31:0]				rec_count[0:HARTS_MAX-1];
+	reg[31:0]				rec_flags[0:HARTS_MAX-1]; // {rd, hart, wmask, rmask, pop, push, iret, intr}
+	reg[31:0]				rec_rd[0:HARTS_MAX-1];    // rd_wdata
+	reg[7:0]				rec_n;
+
+	integer					h, i;
+	reg[31:0]				h_instr;
+	reg[31:0]				h_pc;
+	reg[4:0]				h_rd;
+	reg[3:0]				h_wmask;
+	reg[3:0]				h_rmask;
+	reg[1:0]				h_pushpop;
+	reg[31:0]				h_mask;
+
+	initial begin
+		for (h=0; h<HARTS_MAX; h=h+1) begin
+			last_pc[h] = 0;
+			last_instr[h] = 0;
+			last_intr[h] = 0;
+			last_iret[h] = 0;
+			instr_count[h] = 0;
+			reg_written[h] = 0;
+			disasm_s[h] = {MSG_SZ{8'h00}};
+			tid_s[h] = {MSG_SZ{8'h00}};
+		end
+		for (i=0; i<32*HARTS_MAX; i=i+1) begin
+			regs[i] = 0;
+		end
+		for (i=0; i<8*HARTS_MAX; i=i+1) begin
+			frame_s[i] = {MSG_SZ{8'h00}};
+		end
+		for (h=0; h<HARTS_MAX; h=h+1) begin
+			rec_last_pc[h] = 0;
+			rec_last_instr[h] = 0;
+			rec_pc[h] = 0;
+			rec_instr[h] = 0;
+			rec_mem_addr[h] = 0;
+			rec_mem_data[h] = 0;
+			rec_count[h] = 0;
+			rec_flags[h] = 0;
+			rec_rd[h] = 0;
+		end
+	end
+
+    always @(posedge clock or posedge reset) begin
+        if (reset) begin
+            in_reset <= 1;
+            for (h=0; h<NHARTS; h=h+1) begin
+            	reg_written[h] = 32'h0;
+            end
+        end else begin
+            if (in_reset) begin
+                _reset();
+                in_reset <= 1'b0;
+            end
+
+            rec_n = 0;
+            for (h=0; h<NHARTS; h=h+1) begin
+            	if (valid[h]) begin
+            		h_instr = instr[32*h +: 32];
+            		h_pc = pc[32*h +: 32];
+            		h_rd = rd_addr[5*h +: 5];
+            		h_wmask = mem_wmask[4*h +: 4];
+            		h_rmask = mem_rmask[4*h +: 4];
+            		h_pushpop = _pushpop(last_instr[h]);
+            		instr_count[h] = instr_count[h] + 1;
+
+            		if (trace_instr_all
+            				|| (trace_mem_writes && |h_wmask)
+            				|| (trace_mem_reads && |h_rmask)
+            				|| last_intr[h] || last_iret[h]
+            				|| (trace_instr_jump && _is_jump(last_instr[h]))
+            				|| (trace_instr_call && |h_pushpop)) begin
+
+            			// Send registers written since the last notification.
+            			// This instruction's write is carried in the record
+            			h_mask = reg_written[h];
+            			h_mask[h_rd] = 1'b0;
+            			if (|h_mask) begin
+            				_send_regs(h, h_mask);
+            			end
+            			reg_written[h] = 32'h0;
+
+            			rec_last_pc[rec_n] = last_pc[h];
+            			rec_last_instr[rec_n] = last_instr[h];
+            			rec_pc[rec_n] = h_pc;
+            			rec_instr[rec_n] = h_instr;
+            			rec_mem_addr[rec_n] = mem_addr[32*h +: 32];
+            			rec_mem_data[rec_n] = mem_data[32*h +: 32];
+            			rec_count[rec_n] = instr_count[h];
+            			rec_flags[rec_n] = {3'b0, h_rd, 5'b0, h[2:0], 4'b0,
+            				h_wmask, h_rmask, h_pushpop[1], h_pushpop[0], last_iret[h], last_intr[h]};
+            			rec_rd[rec_n] = rd_wdata[32*h +: 32];
+            			rec_n = rec_n + 1;
+            		end else if (|h_rd) begin
+            			reg_written[h][h_rd] = 1'b1;
+            		end
+
+            		if (|h_rd) begin
+            			regs[32*h+h_rd] = rd_wdata[32*h +: 32];
+            		end
+
+            		last_pc[h] = h_pc;
+            		last_instr[h] = h_instr;
+            		last_intr[h] = intr[h];
+            		last_iret[h] = iret[h];
+            	end
+            end
+
+            for (i=0; i<rec_n; i=i+REC_MAX) begin
+            	_send_recs(i, (rec_n-i > REC_MAX)?REC_MAX:rec_n-i);
+            end
+        end
+    end
+
+    task init;
+    begin
+        $display("riscv_debug_mh_bfm: %m");
+        if (NHARTS < 1 || NHARTS > HARTS_MAX) begin
+        	$display("%m Error: NHARTS=%0d is outside the range 1..%0d", NHARTS, HARTS_MAX);
+        	$finish();
+        end
+        _set_parameters(NHARTS, MSG_SZ);
+    end
+    endtask
+
+    // Classifies a jump as a call (bit 0) and/or return (bit 1), using
+    // the return-address-stack hints. See riscv_debug_bfm.v
+    function [1:0] _pushpop(input [31:0] li);
+    	reg[4:0]	rd, rs1;
+    	reg			rd_link, rs1_link;
+   	begin
+   		rd = 0;
+   		rs1 = 0;
+   		if (li[6:0] == 7'b1101111) begin // jal
+   			rd = li[11:7];
+   		end else if (li[6:0] == 7'b1100111 && li[14:12] == 3'b000) begin // jalr
+   			rd = li[11:7];
+   			rs1 = li[19:15];
+   		end else if (li[1:0] == 2'b01 && li[15:13] == 3'b001) begin // c.jal
+   			rd = 5'd1;
+   		end else if (li[1:0] == 2'b10 && li[15:13] == 3'b100 &&
+   				li[6:2] == 5'b0 && |li[11:7]) begin // c.jr, c.jalr
+   			rd = (li[12])?5'd1:5'd0;
+   			rs1 = li[11:7];
+   		end
+   		rd_link = (rd == 5'd1 || rd == 5'd5);
+   		rs1_link = (rs1 == 5'd1 || rs1 == 5'd5);
+   		_pushpop[0] = rd_link;
+   		_pushpop[1] = rs1_link && (!rd_link || rd != rs1);
+   	end
+    endfunction
+
+    // Returns 1 for jal, jalr, c.j, c.jal, c.jr and c.jalr
+    function _is_jump(input [31:0] li);
+   	begin
+   		_is_jump = (li[6:0] == 7'b1101111 ||
+   			(li[6:0] == 7'b1100111 && li[14:12] == 3'b000) ||
+   			(li[1:0] == 2'b01 && (li[15:13] == 3'b001 || li[15:13] == 3'b101)) ||
+   			(li[1:0] == 2'b10 && li[15:13] == 3'b100 && li[6:2] == 5'b0 && |li[11:7]));
+   	end
+    endfunction
+
+    // Sends 'n' retire records, starting at record 'base'
+    task _send_recs(input reg[7:0] base, input reg[7:0] n);
+   	begin
+   		_instr_exec_mh(n,
+   			rec_last_pc[base+0], rec_last_instr[base+0], rec_pc[base+0], rec_instr[base+0],
+   			rec_mem_addr[base+0], rec_mem_data[base+0], rec_count[base+0], rec_flags[base+0],
+   			rec_rd[base+0],
+   			rec_last_pc[base+1], rec_last_instr[base+1], rec_pc[base+1], rec_instr[base+1],
+   			rec_mem_addr[base+1], rec_mem_data[base+1], rec_count[base+1], rec_flags[base+1],
+   			rec_rd[base+1],
+   			rec_last_pc[base+2], rec_last_instr[base+2], rec_pc[base+2], rec_instr[base+2],
+   			rec_mem_addr[base+2], rec_mem_data[base+2], rec_count[base+2], rec_flags[base+2],
+   			rec_rd[base+2],
+   			rec_last_pc[base+3], rec_last_instr[base+3], rec_pc[base+3], rec_instr[base+3],
+   			rec_mem_addr[base+3], rec_mem_data[base+3], rec_count[base+3], rec_flags[base+3],
+   			rec_rd[base+3]);
+   	end
+    endtask
+
+    // Sends the registers of hart 'hn' selected by 'mask'
+    task _send_regs(input reg[7:0] hn, input reg[31:0] mask);
+    	integer base;
+   	begin
+   		base = 32*hn;
+   		_write_regs_h(hn, mask,
+   			regs[base+1], regs[base+2], regs[base+3], regs[base+4],
+   			regs[base+5], regs[base+6], regs[base+7], regs[base+8],
+   			regs[base+9], regs[base+10], regs[base+11], regs[base+12],
+   			regs[base+13], regs[base+14], regs[base+15], regs[base+16],
+   			regs[base+17], regs[base+18], regs[base+19], regs[base+20],
+   			regs[base+21], regs[base+22], regs[base+23], regs[base+24],
+   			regs[base+25], regs[base+26], regs[base+27], regs[base+28],
+   			regs[base+29], regs[base+30], regs[base+31]);
+   	end
+    endtask
+
+   	task _set_tid_w_h(
+   		input reg[7:0]		hart,
+   		input reg[7:0]		idx,
+   		input reg[31:0]		w0,
+   		input reg[31:0]		w1,
+   		input reg[31:0]		w2,
+   		input reg[31:0]		w3);
+   	begin
+   		tid_s[hart] = _msg_set_chunk(tid_s[hart], idx, {w0, w1, w2, w3});
+   	end
+   	endtask
+
+    task _set_func_w_h(
+    	input reg[7:0]		hart,
+    	input reg[7:0]		frame,
+    	input reg[7:0]		idx,
+    	input reg[31:0]		w0,
+    	input reg[31:0]		w1,
+    	input reg[31:0]		w2,
+    	input reg[31:0]		w3);
+   	begin
+   		frame_s[8*hart+frame] = _msg_set_chunk(frame_s[8*hart+frame], idx, {w0, w1, w2, w3});
+   	end
+    endtask
+
+    task _clr_func_h(input reg[7:0] hart, input reg[7:0] frame);
+   	begin
+   		frame_s[8*hart+frame] = {MSG_SZ{8'h00}};
+   	end
+    endtask
+
+    task _set_disasm_w_h(
+    	input reg[7:0]		hart,
+    	input reg[7:0]		idx,
+    	input reg[31:0]		w0,
+    	input reg[31:0]		w1,
+    	input reg[31:0]		w2,
+    	input reg[31:0]		w3);
+   	begin
+   		disasm_s[hart] = _msg_set_chunk(disasm_s[hart], idx, {w0, w1, w2, w3});
+   	end
+    endtask
+
+    // Replaces 16 characters of a message string. See riscv_debug_bfm.v
+    function [8*MSG_SZ-1:0] _msg_set_chunk(
+    	input [8*MSG_SZ-1:0]	msg,
+    	input [7:0]				idx,
+    	input [127:0]			chunk);
+    	integer i, j;
+   	begin
+   		_msg_set_chunk = msg;
+   		for (j=0; j<16; j=j+1) begin
+   			i = 16*idx + j;
+   			if (i < MSG_SZ) begin
+   				_msg_set_chunk[8*(MSG_SZ-i-1) +: 8] = chunk[8*(15-j) +: 8];
+   			end
+   		end
+   	end
+    endfunction
+
+    task _set_trace_level(input reg[31:0] level);
+   	begin
+   		case (level)
+   			0: begin //
+   				trace_instr_all = 0;
+   				trace_instr_jump = 0;
+   				trace_instr_call = 1;
+   			end
+   			1: begin //
+   				trace_instr_all = 0;
+   				trace_instr_jump = 1;
+   				trace_instr_call = 0;
+   			end
+   			2: begin //
+   				trace_instr_all = 1;
+   				trace_instr_jump = 0;
+   				trace_instr_call = 0;
+   			end
+   			default: begin
+   				$display("%m Error: unknown trace level %0d", level);
+   				$finish();
+   			end
+   		endcase
+   	end
+    endtask
+
+    // Per-hart signals, for display in waveforms
+    genvar gi;
+    generate
+    	for (gi=0; gi<NHARTS; gi=gi+1) begin : harts
+    		wire[31:0]				pc = last_pc[gi];
+    		wire[31:0]				instr = last_instr[gi];
+    		wire[8*MSG_SZ-1:0]		disasm = disasm_s[gi];
+    		wire[8*MSG_SZ-1:0]		tid = tid_s[gi];
+    		wire[8*MSG_SZ-1:0]		frame0 = frame_s[8*gi+0];
+    		wire[8*MSG_SZ-1:0]		frame1 = frame_s[8*gi+1];
+    		wire[8*MSG_SZ-1:0]		frame2 = frame_s[8*gi+2];
+    		wire[8*MSG_SZ-1:0]		frame3 = frame_s[8*gi+3];
+    		wire[8*MSG_SZ-1:0]		frame4 = frame_s[8*gi+4];
+    		wire[8*MSG_SZ-1:0]		frame5 = frame_s[8*gi+5];
+    		wire[8*MSG_SZ-1:0]		frame6 = frame_s[8*gi+6];
+    		wire[8*MSG_SZ-1:0]		frame7 = frame_s[8*gi+7];
+    	end
+    endgenerate
+
+    // Auto-generated code to implement the BFM API
+`ifdef PYBFMS_GEN
+${pybfms_api_impl}
+`endif
+
+endmodule
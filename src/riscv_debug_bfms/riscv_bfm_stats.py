@@ -0,0 +1,119 @@
+#****************************************************************************
+#* riscv_bfm_stats.py
+#*
+#* Opt-in call counters and timers for RiscvDebugBfm. While attached,
+#* the BFM's export-task dispatch, import tasks, memory forwards and
+#* call/return events are wrapped at the instance level. When detached,
+#* the wrappers are removed, so there is no cost while disabled.
+#****************************************************************************
+import atexit
+import json
+import time
+
+
+class RiscvBfmStats(object):
+    """Counts and times the calls made to and from a BFM. Times are
+    inclusive: an export task's time includes the import tasks it calls"""
+
+    def __init__(self, path=None, period=0):
+        self.path = path
+        self.period = period
+        self.n_exports = 0
+        self.t_start = time.perf_counter()
+
+        # group -> name -> [count, seconds]
+        self.calls = {
+            "exports": {},
+            "imports": {},
+            "mem": {},
+            "events": {}}
+
+        self._wrapped = []
+        self._bfm_info = None
+
+    def attach(self, bfm):
+        bfm_info = bfm.bfm_info
+        type_info = bfm_info.type_info
+
+        # Export tasks are dispatched by the BfmInfo, not through the
+        # BFM instance
+        call_method = bfm_info.call_method
+        ents = [self._ent("exports", m.T.__name__) for m in type_info.export_info]
+        perf_counter = time.perf_counter
+
+        def call_method_w(method_id, params):
+            ent = ents[method_id]
+            t = perf_counter()
+            try:
+                call_method(method_id, params)
+            finally:
+                ent[0] += 1
+                ent[1] += perf_counter() - t
+
+            if self.period > 0:
+                self.n_exports += 1
+                if (self.n_exports % self.period) == 0:
+                    self.dump()
+
+        bfm_info.call_method = call_method_w
+        self._bfm_info = bfm_info
+
+        for m in type_info.import_info:
+            self._wrap(bfm, "imports", m.T.__name__, m.T.__name__)
+
+        self._wrap(bfm, "mem", "memwrite", "memwrite")
+        self._wrap(bfm, "mem", "memread", "memread")
+        self._wrap(bfm, "events", "call", "enter")
+        self._wrap(bfm, "events", "return", "exit")
+        self._wrap(bfm, "events", "excp", "excp")
+        self._wrap(bfm, "events", "eret", "eret")
+
+        if self.path is not None:
+            atexit.register(self.dump)
+
+    def detach(self, bfm):
+        for name in self._wrapped:
+            delattr(bfm, name)
+        self._wrapped.clear()
+
+        if self._bfm_info is not None:
+            del self._bfm_info.call_method
+            self._bfm_info = None
+
+        if self.path is not None:
+            atexit.unregister(self.dump)
+
+    def to_dict(self):
+        ret = {"elapsed_s": time.perf_counter() - self.t_start}
+        for group, ent_m in self.calls.items():
+            ret[group] = {
+                name : {"count": ent[0], "time_s": ent[1]}
+                for name, ent in ent_m.items()}
+        return ret
+
+    def dump(self, path=None):
+        """Writes the counters to a JSON file"""
+        if path is None:
+            path = self.path
+        with open(path, "w") as fp:
+            json.dump(self.to_dict(), fp, indent=2)
+
+    def _ent(self, group, name):
+        return self.calls[group].setdefault(name, [0, 0.0])
+
+    def _wrap(self, bfm, group, name, attr):
+        f = getattr(bfm, attr)
+        ent = self._ent(group, name)
+        perf_counter = time.perf_counter
+
+        def wrapper(*args):
+            t = perf_counter()
+            try:
+                return f(*args)
+            finally:
+                ent[0] += 1
+                ent[1] += perf_counter() - t
+
+        setattr(bfm, attr, wrapper)
+        self._wrapped.append(attr)
+
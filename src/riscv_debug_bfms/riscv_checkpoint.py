@@ -0,0 +1,227 @@
+#****************************************************************************
+#* riscv_checkpoint.py
+#*
+#* Periodic checkpoints of the RiscvDebugBfm state: registers, call
+#* stack and memory mirror. Memory is saved incrementally: the first
+#* checkpoint holds every page known to be resident, later ones hold
+#* only the pages written since the previous one, and restoring takes
+#* the latest version of each page. Checkpoints are written to a 
+#* memory-mapped file.
+#*
+#* File layout (little-endian):
+#* - header: HDR_FMT
+#* - checkpoints: CK_FMT, 32 registers, n_frames (entry, return address)
+#*   pairs, then n_pages (page number, PAGE_SZ bytes) entries
+#****************************************************************************
+from array import array
+import bisect
+import mmap
+import struct
+
+import core_debug_common as cdbgc
+from elftools.elf.elffile import ELFFile
+
+CK_MAGIC = b"RVCK"
+CK_VERSION = 1
+
+# magic, version, page shift
+HDR_FMT = "<4sHH"
+HDR_SZ = struct.calcsize(HDR_FMT)
+
+# record size, count, trace record, n_frames, n_pages
+CK_FMT = "<IQQII"
+CK_SZ = struct.calcsize(CK_FMT)
+
+PAGE_SHIFT = 12
+PAGE_SZ = (1 << PAGE_SHIFT)
+PAGE_WORDS = PAGE_SZ // 4
+
+# Trace record of a checkpoint taken while no trace was recorded
+NO_TRACE = 0xFFFFFFFFFFFFFFFF
+
+# Size by which the checkpoint file is grown
+FILE_CHUNK = (16 << 20)
+
+
+def _elf_pages(path):
+    """Returns the pages spanned by the loadable segments of an ELF file"""
+    ret = set()
+    with open(path, "rb") as fp:
+        elf = ELFFile(fp)
+        for seg in elf.iter_segments():
+            if seg["p_type"] != "PT_LOAD" or seg["p_memsz"] == 0:
+                continue
+            first = seg["p_vaddr"] >> PAGE_SHIFT
+            last = (seg["p_vaddr"] + seg["p_memsz"] - 1) >> PAGE_SHIFT
+            ret.update(range(first, last+1))
+    return ret
+
+
+class RiscvCheckpointer(object):
+    """Takes a checkpoint of a BFM's state every 'period' instructions.
+    The first checkpoint saves the pages of the ELF file's loadable 
+    segments (see set_elf) and every page the BFM has seen written"""
+
+    def __init__(self, bfm, path, period):
+        self.bfm = bfm
+        self.path = path
+        self.period = period
+        self.next_count = period
+        self.n_ckpts = 0
+
+        # Pages written since the last checkpoint
+        self.dirty = set()
+
+        # Call stack: (entry, return address) for each frame
+        self.frames = []
+
+        self.fp = open(path, "w+b")
+        self.size = FILE_CHUNK
+        self.fp.truncate(self.size)
+        self.map = mmap.mmap(self.fp.fileno(), self.size)
+        struct.pack_into(HDR_FMT, self.map, 0, CK_MAGIC, CK_VERSION, PAGE_SHIFT)
+        self.off = HDR_SZ
+
+    def retire(self, last_pc, last_instr, pc, count, pushpop):
+        if (pushpop & 2) != 0 and len(self.frames) > 0:
+            self.frames.pop()
+        if (pushpop & 1) != 0:
+            self.frames.append(
+                (pc, last_pc + 4 if (last_instr & 0x3) == 3 else last_pc + 2))
+
+        if count >= self.next_count:
+            self.checkpoint(count)
+            self.next_count = count + self.period
+
+    def checkpoint(self, count):
+        """Saves the registers, call stack and dirty pages"""
+        bfm = self.bfm
+        rec = bfm.recorder
+        trace_rec = NO_TRACE if rec is None else rec.n_recs
+        if self.n_ckpts == 0:
+            # Memory loaded or written before the checkpointer was attached
+            self.dirty |= bfm.mem_pages
+            if bfm.symtab is not None:
+                self.dirty |= _elf_pages(bfm.symtab.path)
+        pages = sorted(self.dirty)
+        self.dirty.clear()
+
+        rec_sz = CK_SZ + 4*32 + 8*len(self.frames) + (4+PAGE_SZ)*len(pages)
+        self._reserve(rec_sz)
+
+        m = self.map
+        off = self.off
+        struct.pack_into(CK_FMT, m, off, rec_sz, count, trace_rec,
+            len(self.frames), len(pages))
+        off += CK_SZ
+        struct.pack_into("<32I", m, off, *bfm.regs)
+        off += 4*32
+        for f in self.frames:
+            struct.pack_into("<II", m, off, f[0], f[1])
+            off += 8
+
+        read32 = bfm.mm.read32
+        page_fmt = "<I%dI" % PAGE_WORDS
+        for p in pages:
+            base = p << PAGE_SHIFT
+            struct.pack_into(page_fmt, m, off, p,
+                *[read32(base + 4*i) for i in range(PAGE_WORDS)])
+            off += 4 + PAGE_SZ
+
+        self.off = off
+        self.n_ckpts += 1
+
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+            self.fp.truncate(self.off)
+            self.fp.close()
+
+    def _reserve(self, n):
+        if self.off + n <= self.size:
+            return
+        while self.off + n > self.size:
+            self.size += FILE_CHUNK
+        self.map.flush()
+        self.map.close()
+        self.fp.truncate(self.size)
+        self.map = mmap.mmap(self.fp.fileno(), self.size)
+
+
+class RiscvCheckpointReader(object):
+    """Reads a checkpoint file written by RiscvCheckpointer"""
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as fp:
+            self.map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, page_shift = struct.unpack_from(HDR_FMT, self.map, 0)
+        if magic != CK_MAGIC:
+            raise Exception("%s is not a checkpoint file" % path)
+        if version != CK_VERSION or page_shift != PAGE_SHIFT:
+            raise Exception("%s: unsupported checkpoint version %d" % (path, version))
+
+        # Instruction count, trace record and file offset of each checkpoint
+        self.counts = []
+        self.trace_recs = []
+        self.offsets = []
+        off = HDR_SZ
+        while off + CK_SZ <= len(self.map):
+            rec_sz, count, trace_rec = struct.unpack_from("<IQQ", self.map, off)
+            if rec_sz == 0:
+                break
+            self.counts.append(count)
+            self.trace_recs.append(trace_rec)
+            self.offsets.append(off)
+            off += rec_sz
+
+    def find(self, count):
+        """Returns the index of the last checkpoint at or before 'count',
+        or None"""
+        i = bisect.bisect_right(self.counts, count)
+        return None if i == 0 else i-1
+
+    def state(self, idx):
+        """Returns (count, trace_rec, regs, frames, pages) at checkpoint
+        'idx'. 'pages' maps page numbers to their latest contents"""
+        pages = {}
+        for i in range(idx+1):
+            off = self.offsets[i]
+            _, count, trace_rec, n_frames, n_pages = struct.unpack_from(CK_FMT, self.map, off)
+            off += CK_SZ
+            regs = array('I', self.map[off:off+4*32])
+            off += 4*32
+            frames = list(struct.iter_unpack("<II", self.map[off:off+8*n_frames]))
+            off += 8*n_frames
+            for _ in range(n_pages):
+                p, = struct.unpack_from("<I", self.map, off)
+                pages[p] = memoryview(self.map)[off+4:off+4+PAGE_SZ]
+                off += 4 + PAGE_SZ
+
+        return (count, trace_rec, regs, frames, pages)
+
+    def restore(self, bfm, idx):
+        """Applies checkpoint 'idx' to a BFM that hasn't executed any
+        instructions. Every saved page is written in full, while pages
+        not in the file keep their contents. Returns (count, trace_rec)
+        of the checkpoint"""
+        count, trace_rec, regs, frames, pages = self.state(idx)
+
+        bfm._regs_wr()[:] = regs
+        bfm.instr_count = count
+
+        for p,data in pages.items():
+            base = p << PAGE_SHIFT
+            for i,w in enumerate(data.cast('I')):
+                bfm.memwrite(0, base + 4*i, w, 0xF)
+
+        # Rebuild the call stack by replaying the calls
+        for entry, retaddr in frames:
+            bfm.execute(entry, retaddr, 0, cdbgc.ExecEvent.Call)
+        bfm.call_depth = len(frames)
+
+        return (count, trace_rec)
@@ -0,0 +1,191 @@
+#****************************************************************************
+#* riscv_cov_map.py
+#*
+#* PC coverage bitmaps collected by RiscvDebugBfm. Bit n of a map is
+#* set when an instruction at base+2*n retired. Maps from many runs
+#* can be merged, and mapped back to the functions and source lines
+#* of an ELF file.
+#*
+#* Usage: python -m riscv_debug_bfms.riscv_cov_map [-o <merged>]
+#*                                     [-e <elf>] <map> [<map> ...]
+#****************************************************************************
+import argparse
+import struct
+
+from elftools.elf.constants import SH_FLAGS
+from elftools.elf.elffile import ELFFile
+
+from riscv_debug_bfms.riscv_elf_symtab import RiscvElfSymtab
+
+# magic, version, base address, number of bits
+HDR_FMT = "<4sHxxII"
+HDR_SZ = struct.calcsize(HDR_FMT)
+MAGIC = b"RVCV"
+VERSION = 1
+
+
+class RiscvCovMap(object):
+    """Coverage bitmap over the halfword slots starting at 'base'"""
+
+    def __init__(self, base, n_bits, data=None):
+        self.base = base
+        self.n_bits = n_bits
+        if data is None:
+            data = bytearray((n_bits + 7) // 8)
+        self.data = data
+
+    @classmethod
+    def load(cls, path) -> 'RiscvCovMap':
+        with open(path, "rb") as fp:
+            magic, version, base, n_bits = struct.unpack(HDR_FMT, fp.read(HDR_SZ))
+            if magic != MAGIC or version != VERSION:
+                raise Exception("%s is not a coverage map" % path)
+            data = bytearray(fp.read())
+        if len(data) != (n_bits + 7) // 8:
+            raise Exception("coverage map %s is truncated" % path)
+        return RiscvCovMap(base, n_bits, data)
+
+    def save(self, path):
+        with open(path, "wb") as fp:
+            fp.write(struct.pack(HDR_FMT, MAGIC, VERSION, self.base, self.n_bits))
+            fp.write(self.data)
+
+    def merge(self, other : 'RiscvCovMap'):
+        """ORs the bits of another map over the same range into this map"""
+        if other.base != self.base or other.n_bits != self.n_bits:
+            raise Exception("cannot merge coverage maps of different ranges")
+        n = len(self.data)
+        self.data[:] = (int.from_bytes(self.data, "little") |
+            int.from_bytes(other.data, "little")).to_bytes(n, "little")
+
+    def covered(self, addr) -> bool:
+        i = (addr - self.base) >> 1
+        if i < 0 or i >= self.n_bits:
+            return False
+        return (self.data[i >> 3] >> (i & 7)) & 1 != 0
+
+    def addrs(self):
+        """Yields the addresses of executed instructions, in order"""
+        base = self.base
+        for i,b in enumerate(self.data):
+            while b:
+                lsb = b & -b
+                yield base + 2*(8*i + lsb.bit_length()-1)
+                b ^= lsb
+
+    def func_coverage(self, elf_path):
+        """Returns a list of (function, executed, instructions) for the
+        functions of an ELF file that lie within the map"""
+        symtab = RiscvElfSymtab(elf_path)
+        text = _text_sections(elf_path)
+        ret = []
+        for entry in symtab.addr_l:
+            start, end = symtab.range(entry)
+            n = 0
+            n_cov = 0
+            for addr in _instr_addrs(text, start, end):
+                n += 1
+                if self.covered(addr):
+                    n_cov += 1
+            if n != 0 and self.base <= start < self.base + 2*self.n_bits:
+                ret.append((symtab.addr_m[entry], n_cov, n))
+        return ret
+
+    def line_coverage(self, elf_path):
+        """Returns {(file, line) : covered} for the source lines of an
+        ELF file with DWARF line information. A line is covered when
+        any of its instructions executed"""
+        ret = {}
+        for fname, line, start, end in _line_ranges(elf_path):
+            if end <= self.base or start >= self.base + 2*self.n_bits:
+                continue
+            key = (fname, line)
+            if not ret.get(key, False):
+                ret[key] = any(self.covered(a) for a in range(start, end, 2))
+        return ret
+
+
+def merge_files(paths) -> RiscvCovMap:
+    """Merges the coverage maps in 'paths'"""
+    ret = None
+    for p in paths:
+        m = RiscvCovMap.load(p)
+        if ret is None:
+            ret = m
+        else:
+            ret.merge(m)
+    return ret
+
+
+def _text_sections(elf_path):
+    """Returns (addr, data) for each executable section"""
+    ret = []
+    with open(elf_path, "rb") as fp:
+        elf = ELFFile(fp)
+        for sec in elf.iter_sections():
+            if (sec["sh_flags"] & SH_FLAGS.SHF_EXECINSTR) and sec["sh_type"] == "SHT_PROGBITS":
+                ret.append((sec["sh_addr"], sec.data()))
+    return ret
+
+
+def _instr_addrs(text, start, end):
+    """Yields the instruction addresses in [start..end), using the
+    instruction-length encoding"""
+    for addr, data in text:
+        if start < addr or start >= addr + len(data):
+            continue
+        a = start
+        while a < end and a+2 <= addr + len(data):
+            yield a
+            a += 4 if (data[a-addr] & 0x3) == 0x3 else 2
+        return
+
+
+def _line_ranges(elf_path):
+    """Yields (file, line, start, end) for each row of the DWARF line
+    programs"""
+    with open(elf_path, "rb") as fp:
+        elf = ELFFile(fp)
+        if not elf.has_dwarf_info():
+            return
+        dwarf = elf.get_dwarf_info()
+        for cu in dwarf.iter_CUs():
+            lp = dwarf.line_program_for_CU(cu)
+            if lp is None:
+                continue
+            files = lp["file_entry"]
+            # DWARF 5 file indices are 0-based
+            fbase = 0 if lp["version"] >= 5 else 1
+            prev = None
+            for ent in lp.get_entries():
+                st = ent.state
+                if st is None:
+                    continue
+                if prev is not None and st.address > prev.address:
+                    fi = prev.file - fbase
+                    fname = files[fi].name.decode() if 0 <= fi < len(files) else "??"
+                    yield (fname, prev.line, prev.address, st.address)
+                prev = None if st.end_sequence else st
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", help="file to write the merged map to")
+    parser.add_argument("-e", "--elf", help="ELF file to report coverage against")
+    parser.add_argument("maps", nargs="+")
+    args = parser.parse_args()
+
+    m = merge_files(args.maps)
+    if args.o is not None:
+        m.save(args.o)
+
+    if args.elf is not None:
+        for func, n_cov, n in m.func_coverage(args.elf):
+            print("%-40s %6d/%-6d %5.1f%%" % (func, n_cov, n, 100.0*n_cov/n))
+        lines = m.line_coverage(args.elf)
+        n_cov = sum(1 for v in lines.values() if v)
+        if len(lines) > 0:
+            print("lines: %d/%d %5.1f%%" % (n_cov, len(lines), 100.0*n_cov/len(lines)))
+
+if __name__ == "__main__":
+    main()
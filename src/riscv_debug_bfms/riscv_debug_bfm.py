@@ -2,12 +2,22 @@
 #* riscv_debug_bfm.py
 #*
 #****************************************************************************
+from array import array
+from collections import OrderedDict
 from enum import Enum, auto, IntEnum
+import struct
 
 import core_debug_common as cdbgc
 from core_debug_common.stack_frame import StackFrame
 import pybfms
+from riscv_debug_bfms import riscv_decoder
+from riscv_debug_bfms.riscv_bfm_stats import RiscvBfmStats
+from riscv_debug_bfms.riscv_checkpoint import RiscvCheckpointer, PAGE_SHIFT
+from riscv_debug_bfms.riscv_elf_symtab import RiscvElfSymtab
+from riscv_debug_bfms.riscv_func_profiler import RiscvFuncProfiler
 from riscv_debug_bfms.riscv_params_iterator import RiscvParamsIterator
+from riscv_debug_bfms.riscv_reg_snapshot import RiscvRegSnapshot
+from riscv_debug_bfms.riscv_trace_recorder import RiscvTraceRecorder
 from core_debug_common.callframe_window_mgr import CallframeWindowMgr
 
 
@@ -15,6 +25,46 @@ class RiscvDebugTraceLevel(IntEnum):
     Call = 0
     Jump = 1
     All  = 2
+    Sample = 3 # pc sampled every sample_period instructions
+    
+# Maximum number of retire records the HDL buffers before flushing 
+# them to Python. Must match BATCH_MAX in riscv_debug_bfm.v
+BATCH_MAX = 4
+
+# Number of call-frame slots in the HDL
+N_FRAMES = 8
+
+# Marks a cleared frame slot
+FRAME_CLR = ()
+
+# Size of the blocks in which strings are read from the mirror memory
+STR_BLK_SZ = 64
+STR_BLK_FMT = "<%dI" % (STR_BLK_SZ // 4)
+
+# Number of memory-access address windows implemented by the HDL.
+# Must match MEM_WIN_MAX in riscv_debug_bfm.v
+MEM_WIN_MAX = 4
+
+# Number of PC breakpoint comparators implemented by the HDL.
+# Must match BP_MAX in riscv_debug_bfm.v
+BP_MAX = 4
+
+# Number of 32-bit words in the HDL's coverage bitmap. Must match 
+# COV_WORDS in riscv_debug_bfm.v
+COV_WORDS = 4096
+
+# Machine CSRs shadowed by the HDL, in shadow-index order. Must 
+# match _csr_idx in riscv_debug_bfm.v
+CSR_MSTATUS  = 0x300
+CSR_MIE      = 0x304
+CSR_MTVEC    = 0x305
+CSR_MSCRATCH = 0x340
+CSR_MEPC     = 0x341
+CSR_MCAUSE   = 0x342
+CSR_MTVAL    = 0x343
+CSR_MIP      = 0x344
+CSR_ADDRS = (CSR_MSTATUS, CSR_MIE, CSR_MTVEC, CSR_MSCRATCH,
+             CSR_MEPC, CSR_MCAUSE, CSR_MTVAL, CSR_MIP)
     
 @pybfms.bfm(hdl={
     pybfms.BfmType.Verilog : pybfms.bfm_hdl_path(__file__, "hdl/riscv_debug_bfm.v"),
@@ -31,12 +81,30 @@ class RiscvDebugBfm(cdbgc.BfmBase):
         self.en_disasm = True
         
         self.window_mgr = CallframeWindowMgr(
-            8,
+            N_FRAMES,
             self._set_func_s,
-            self._clr_func,
+            self._clr_func_s,
             lambda t : self._set_tid_s(t.tid))
         
-        self.regs = [0]*32
+        # Register file, and a read-only view of it. Snapshots share 
+        # the register file until the next write (see _regs_wr)
+        self.regs = array('I', [0]*32)
+        self.regs_v = memoryview(self.regs).toreadonly()
+        self.regs_shared = False
+        
+        # Instruction count of the last retire record
+        self.instr_count = 0
+        
+        # Shadowed CSRs (see CSR_ADDRS)
+        self.csrs = array('I', [0]*len(CSR_ADDRS))
+        self.csr_idx_m = {a : i for i,a in enumerate(CSR_ADDRS)}
+        
+        # mcause, mepc and mtval at the last exception or interrupt
+        # entry, and the pc returned to by the last mret
+        self.excp_cause = 0
+        self.excp_epc = 0
+        self.excp_tval = 0
+        self.eret_pc = 0
         
         self.last_instr = 0
         
@@ -45,9 +113,115 @@ class RiscvDebugBfm(cdbgc.BfmBase):
         
         self.last_limit = 0
 
+        # Trace level of the HDL, and the level set by the user. The 
+        # two differ while waits need a different level
         self.trace_level : RiscvDebugTraceLevel = RiscvDebugTraceLevel.All
+        self.user_trace_level : RiscvDebugTraceLevel = RiscvDebugTraceLevel.All
+        
+        # When set, the HDL trace level is lowered to Call while 
+        # only call, return and memory-write waits are pending
+        self.auto_trace_level = False
+        
+        # Pending waits, keyed by target. Entries are [event, result]
+        self.call_w = {}  # entry address, or None for any call
+        self.ret_w = {}   # call depth returned to
+        self.pc_w = {}    # pc, for waits beyond the HDL comparators
+        self.mem_w = {}   # word address written
+        self.n_waiters = 0
+        
+        # Number of calls minus returns seen
+        self.call_depth = 0
+        
+        # Number of retire records buffered by the HDL. A value 
+        # of 0 or 1 delivers each record as soon as it occurs
+        self.batch_sz = 0
+        
+        # Memory-access address windows: (base, limit, read, write) or None
+        self.mem_win = [None]*MEM_WIN_MAX
+        
+        # PC breakpoint comparators: [base, limit, event, run, pc] or None
+        self.bp = [None]*BP_MAX
+        
+        # Sampling interval at RiscvDebugTraceLevel.Sample, and the 
+        # number of samples taken at each pc
+        self.sample_period = 10000
+        self.sample_hist = {}
+        self.sample_count = 0
+        
+        # LRU cache of disassembly, keyed by (pc,instr). Entries hold 
+        # [text, packed words], with words computed on first display
+        self.disasm_cache = OrderedDict()
+        self.disasm_cache_sz = 4096
+        self.disasm_cache_hits = 0
+        self.disasm_cache_misses = 0
+        
+        # Packed words currently shown in the disasm field
+        self.disasm_w = None
+        
+        self.recorder : RiscvTraceRecorder = None
+        
+        self.stats : RiscvBfmStats = None
+        
+        self.profiler : RiscvFuncProfiler = None
+        
+        self.checkpointer : RiscvCheckpointer = None
+        
+        # Pages of the memory mirror written through memwrite
+        self.mem_pages = set()
+        
+        # Coverage map being collected by the HDL, and the event 
+        # signaled when a dump completes
+        self.cov = None
+        self.cov_buf = None
+        self.cov_n_words = 0
+        self.cov_ev = None
+        
+        # Set by _set_parameters when the HDL initializes
+        self.msg_sz = None
+        
+        self.symtab : RiscvElfSymtab = None
+        
+        # Packed message words for function names, shared by all 
+        # frame slots. Prefilled with the functions of the ELF file
+        self.func_w = {}
+        
+        # Packed words shown in each frame slot and the tid field. 
+        # None when unknown, and FRAME_CLR when the slot is clear
+        self.frame_w = [None]*N_FRAMES
+        self.tid_w = None
+        
+        # Maximum length of strings read by read_str
+        self.str_max = 1024
+        
+        # Strings recently read by read_str, keyed by address. The 
+        # cache is cleared when memory in [str_cache_lo..str_cache_hi) 
+        # is written
+        self.str_cache = {}
+        self.str_cache_sz = 64
+        self.str_cache_lo = 0
+        self.str_cache_hi = 0
         
     def set_trace_level(self, l : RiscvDebugTraceLevel):
+        self.user_trace_level = l
+        self._update_trace_level()
+        
+    def set_auto_trace_level(self, en):
+        """Enables lowering the trace level to Call while only call, 
+        return, memory-write and breakpoint waits are pending. Note 
+        that execution listeners won't see other instructions then"""
+        self.auto_trace_level = en
+        self._update_trace_level()
+        
+    def _update_trace_level(self):
+        if len(self.pc_w) != 0:
+            # pc waits beyond the comparators must see every instruction
+            l = RiscvDebugTraceLevel.All
+        elif self.auto_trace_level and (self.n_waiters != 0 or 
+                any(e is not None for e in self.bp)):
+            l = RiscvDebugTraceLevel.Call
+        else:
+            l = self.user_trace_level
+            
         if self.trace_level != l:
             self.trace_level = l
             self._set_trace_level(int(l))
@@ -55,6 +229,352 @@ class RiscvDebugBfm(cdbgc.BfmBase):
             if l != RiscvDebugTraceLevel.All:
                 self._set_disasm_s("")
                 
+    def set_sample_period(self, n, jitter=0, mem=False):
+        """Sets the number of instructions between pc samples at 
+        RiscvDebugTraceLevel.Sample. When 'jitter' (a power of 2) is
+        non-zero, each interval is randomized within n +/- jitter/2 to 
+        avoid aliasing with loops in the firmware. Memory accesses 
+        are only reported while sampling when 'mem' is True"""
+        if (jitter & (jitter-1)) != 0 or jitter > n:
+            raise Exception("jitter %d must be a power of 2 no larger than %d" % (jitter, n))
+        self.sample_period = n
+        
+        if jitter != 0:
+            self._set_sample(n - jitter//2, jitter-1, 1 if mem else 0)
+        else:
+            self._set_sample(n, 0, 1 if mem else 0)
+            
+    def clr_samples(self):
+        self.sample_hist.clear()
+        self.sample_count = 0
+        
+    def sample_profile(self):
+        """Resolves the pc samples to the functions of the ELF file 
+        specified with set_elf. Returns a list of (function, samples),
+        most-sampled first. Samples outside all functions are 
+        reported against '??'"""
+        if self.symtab is None:
+            raise Exception("sample_profile requires an ELF file (see set_elf)")
+        
+        prof_m = {}
+        func = self.symtab.func
+        for pc,n in self.sample_hist.items():
+            f = func(pc)
+            name = "??" if f is None else f[1]
+            prof_m[name] = prof_m.get(name, 0) + n
+            
+        return sorted(prof_m.items(), key=lambda e: e[1], reverse=True)
+            
+    def set_batch_size(self, n):
+        """Sets the number of retire records buffered by the HDL before 
+        they are delivered to Python. 0 or 1 disables batching.
+        
+        When batching is enabled, register values are updated once per
+        batch, and reflect the state after the last record in the batch.
+        Buffered records are always flushed on interrupt entry/exit, 
+        when the instruction limit is reached, and on reset"""
+        if n < 0 or n > BATCH_MAX:
+            raise Exception("batch size %d is outside the range 0..%d" % (n, BATCH_MAX))
+        
+        if self.batch_sz != n:
+            self._set_batch_sz(n)
+            self.batch_sz = n
+            
+    def set_mem_window(self, idx, base, limit, read=True, write=True):
+        """Restricts memory-access notifications to the addresses
+        base..limit (inclusive). Up to MEM_WIN_MAX windows may be set.
+        
+        While no window is enabled for reads (or writes), all reads
+        (or writes) are reported. Accesses outside the windows neither
+        notify Python nor update the mirror memory"""
+        if idx < 0 or idx >= MEM_WIN_MAX:
+            raise Exception("window %d is outside the range 0..%d" % (idx, MEM_WIN_MAX-1))
+        if limit < base:
+            raise Exception("window limit 0x%08x is below base 0x%08x" % (limit, base))
+        
+        win = (base, limit, read, write)
+        if self.mem_win[idx] != win:
+            self.mem_win[idx] = win
+            self._set_mem_win(idx, base, limit, 
+                (1 if read else 0) | (2 if write else 0))
+            
+    def clr_mem_window(self, idx):
+        """Disables an address window"""
+        if self.mem_win[idx] is not None:
+            self.mem_win[idx] = None
+            self._set_mem_win(idx, 0, 0, 0)
+            
+    def clr_mem_windows(self):
+        """Disables all address windows, reporting all accesses"""
+        for i in range(MEM_WIN_MAX):
+            self.clr_mem_window(i)
+            
+    async def wait_pc(self, addr, limit=None, run=True) -> int:
+        """Waits for an instruction in [addr..limit] to retire, and 
+        returns its pc. The HDL compares the pc, so no notifications are 
+        needed while waiting. When 'run' is True, tracing is suppressed
+        until the breakpoint hits. All registers are updated on a hit.
+        
+        Once all BP_MAX comparators are in use, waits for a single 
+        address are made by tracing at the All level"""
+        if limit is None:
+            limit = addr
+            
+        idx = self.bp.index(None) if None in self.bp else -1
+        if idx == -1:
+            if limit != addr:
+                raise Exception("all %d breakpoint comparators are in use" % BP_MAX)
+            return await self._wait(self.pc_w, addr)
+        
+        ent = [addr, limit, pybfms.event(), run, None]
+        self.bp[idx] = ent
+        self._set_bp(idx, addr, limit, 1)
+        if run:
+            self._set_run(1)
+        self._update_trace_level()
+            
+        await ent[2].wait()
+        
+        return ent[4]
+    
+    async def wait_call(self, func=None) -> int:
+        """Waits for a call to 'func', which is either a function name 
+        or an entry address. Waits for any call when 'func' is None. 
+        Returns the entry address of the called function"""
+        if isinstance(func, str):
+            if self.symtab is None:
+                raise Exception("waiting on a function name requires an ELF file (see set_elf)")
+            addr = self.symtab.addr(func)
+            if addr is None:
+                raise Exception("unknown function \"%s\"" % func)
+            func = addr
+        return await self._wait(self.call_w, func)
+    
+    async def wait_return(self) -> int:
+        """Waits for the current function to return, and returns the
+        address returned to"""
+        return await self._wait(self.ret_w, self.call_depth-1)
+    
+    async def wait_mem_write(self, addr) -> int:
+        """Waits for a write to the 32-bit word containing 'addr', and
+        returns the data written. Writes outside the memory-access 
+        windows are not seen"""
+        return await self._wait(self.mem_w, addr & ~3)
+    
+    async def _wait(self, wait_m, key):
+        ent = [pybfms.event(), None]
+        l = wait_m.get(key)
+        if l is None:
+            wait_m[key] = [ent]
+        else:
+            l.append(ent)
+        self.n_waiters += 1
+        self._update_trace_level()
+        
+        await ent[0].wait()
+        
+        return ent[1]
+    
+    def _wake(self, wait_m, key, val):
+        l = wait_m.pop(key, None)
+        if l is None:
+            return
+        for ent in l:
+            ent[1] = val
+            ent[0].set()
+        self.n_waiters -= len(l)
+        self._update_trace_level()
+    
+    async def run_until(self, sym) -> int:
+        """Runs, with tracing suppressed, until function 'sym' is entered.
+        Requires the ELF file to have been specified with set_elf"""
+        if self.symtab is None:
+            raise Exception("run_until requires an ELF file (see set_elf)")
+        addr = self.symtab.addr(sym)
+        if addr is None:
+            raise Exception("unknown function \"%s\"" % sym)
+        return await self.wait_pc(addr)
+    
+    def set_recorder(self, rec : RiscvTraceRecorder):
+        """Starts recording the retire stream with 'rec'. Passing None
+        stops and closes the active recorder"""
+        if self.recorder is not None:
+            self.recorder.close()
+        self.recorder = rec
+        
+        if rec is not None:
+            rec.start(self.addr_width, self.trace_level)
+            
+    def enable_stats(self, path=None, period=0) -> RiscvBfmStats:
+        """Starts counting and timing the BFM's calls. When 'path' is
+        specified, the counters are written to it as JSON at exit and,
+        if 'period' is non-zero, every 'period' export-task calls"""
+        if period > 0 and path is None:
+            raise Exception("enable_stats: a periodic dump requires a path")
+        self.disable_stats()
+        self.stats = RiscvBfmStats(path, period)
+        self.stats.attach(self)
+        return self.stats
+    
+    def disable_stats(self):
+        """Stops counting, writing the counters out if a path was 
+        specified. Counters remain available in the RiscvBfmStats object"""
+        if self.stats is not None:
+            self.stats.detach(self)
+            if self.stats.path is not None:
+                self.stats.dump()
+            self.stats = None
+            
+    def enable_profile(self, max_depth=256, max_paths=65536) -> RiscvFuncProfiler:
+        """Starts counting the instructions retired by each function,
+        using the call and return events. Requires the ELF file to have 
+        been specified with set_elf. The Call trace level is sufficient"""
+        if self.symtab is None:
+            raise Exception("enable_profile requires an ELF file (see set_elf)")
+        self.profiler = RiscvFuncProfiler(self.symtab, max_depth, max_paths)
+        return self.profiler
+    
+    def disable_profile(self) -> RiscvFuncProfiler:
+        """Stops profiling, and returns the profiler"""
+        ret = self.profiler
+        self.profiler = None
+        return ret
+        
+    def enable_checkpoints(self, path, period) -> RiscvCheckpointer:
+        """Saves the registers, call stack and memory mirror to 'path' 
+        every 'period' instructions. When a trace is being recorded, 
+        each checkpoint notes its position in the trace, so a replay 
+        can start from it (see RiscvTraceReplay)"""
+        if self.checkpointer is not None:
+            self.checkpointer.close()
+        self.checkpointer = RiscvCheckpointer(self, path, period)
+        return self.checkpointer
+    
+    def disable_checkpoints(self):
+        if self.checkpointer is not None:
+            self.checkpointer.close()
+            self.checkpointer = None
+        
+    def set_cov_range(self, base, limit):
+        """Starts collecting pc coverage over [base..limit] in the HDL.
+        No notifications are made while collecting"""
+        # Not imported with the module, since riscv_cov_map is 
+        # also run as a script
+        from riscv_debug_bfms.riscv_cov_map import RiscvCovMap
+        
+        n_bits = ((limit - base) >> 1) + 1
+        if base > limit or n_bits > 32*COV_WORDS:
+            raise Exception("coverage range 0x%08x..0x%08x exceeds %d bytes" % (
+                base, limit, 64*COV_WORDS))
+        
+        self._set_cov(base, limit, 1)
+        self._clr_cov()
+        
+        self.cov = RiscvCovMap(base, n_bits)
+        self.cov_n_words = (n_bits + 31) // 32
+        
+        # Dumps arrive in blocks of 16 words
+        self.cov_buf = bytearray(64*((self.cov_n_words + 15) // 16))
+        
+    def clr_cov_range(self):
+        """Stops collecting coverage"""
+        self._set_cov(0, 0, 0)
+        
+    async def cov_dump(self) -> 'RiscvCovMap':
+        """Reads the coverage bitmap from the HDL. The returned map's 
+        data is a view of the bitmap"""
+        if self.cov is None:
+            raise Exception("no coverage range is set (see set_cov_range)")
+        self.cov_ev = pybfms.event()
+        self._cov_dump(self.cov_n_words)
+        await self.cov_ev.wait()
+        self.cov_ev = None
+        
+        self.cov.data = memoryview(self.cov_buf)[:len(self.cov.data)]
+        return self.cov
+    
+    def set_elf(self, path):
+        """Reads function symbols from an ELF file, and prepares the
+        frame-slot contents for each function"""
+        self.symtab = RiscvElfSymtab(path)
+        self.func_w.clear()
+        
+        if self.msg_sz is not None:
+            self._build_func_w()
+            
+    def _build_func_w(self):
+        for name in self.symtab.names():
+            self.func_w[name] = self._msg_words(name)
+            
+    def set_str_max(self, n):
+        """Sets the maximum length of strings read from memory"""
+        self.str_max = n
+        self._clr_str_cache()
+        
+    def read_str(self, addr) -> str:
+        """Reads a NUL-terminated string from the mirror memory"""
+        ret = self.str_cache.get(addr)
+        if ret is not None:
+            return ret
+        
+        read32 = self.mm.read32
+        buf = bytearray()
+        
+        # Read aligned blocks until the terminator is found
+        blk = addr & ~(STR_BLK_SZ-1)
+        start = addr - blk
+        limit = start + self.str_max
+        end = -1
+        while end == -1 and len(buf) < limit:
+            buf += struct.pack(STR_BLK_FMT, 
+                *map(read32, range(blk, blk+STR_BLK_SZ, 4)))
+            end = buf.find(0, start)
+            start = len(buf)
+            blk += STR_BLK_SZ
+            
+        if end == -1 or end > limit:
+            end = limit
+        ret = buf[addr & (STR_BLK_SZ-1):end].decode("latin-1")
+        
+        if self.str_cache_sz > 0:
+            if len(self.str_cache) >= self.str_cache_sz:
+                self._clr_str_cache()
+            if len(self.str_cache) == 0:
+                self.str_cache_lo = addr
+                self.str_cache_hi = addr
+            self.str_cache[addr] = ret
+            self.str_cache_lo = min(self.str_cache_lo, addr)
+            self.str_cache_hi = max(self.str_cache_hi, addr+len(ret)+1)
+            
+        return ret
+    
+    def _clr_str_cache(self):
+        self.str_cache.clear()
+        self.str_cache_lo = 0
+        self.str_cache_hi = 0
+        
+    def memwrite(self, pc, addr, data, mask):
+        # Strings read from the written word may have changed
+        if addr < self.str_cache_hi and addr+4 > self.str_cache_lo:
+            self._clr_str_cache()
+        page = addr >> PAGE_SHIFT
+        self.mem_pages.add(page)
+        if self.checkpointer is not None:
+            self.checkpointer.dirty.add(page)
+        super().memwrite(pc, addr, data, mask)
+            
+    def set_disasm_cache_size(self, n):
+        """Sets the maximum number of entries in the disassembly cache. 
+        0 disables the cache"""
+        self.disasm_cache_sz = n
+        while len(self.disasm_cache) > n:
+            self.disasm_cache.popitem(last=False)
+            
+    def flush_batch(self):
+        """Requests the HDL to deliver any buffered retire records"""
+        if self.batch_sz > 1:
+            self._flush_batch()
+                
     def param_iter(self) -> RiscvParamsIterator:
         """Returns a parameter iterator based on current state"""
         return RiscvParamsIterator(self)
@@ -63,24 +583,69 @@ class RiscvDebugBfm(cdbgc.BfmBase):
         """Gets the value of the specified register"""
         return self.regs[addr]
     
+    def csr(self, addr):
+        """Gets the value of a shadowed machine CSR (see CSR_ADDRS)"""
+        idx = self.csr_idx_m.get(addr)
+        if idx is None:
+            raise Exception("CSR 0x%03x is not shadowed" % addr)
+        return self.csrs[idx]
+    
+    def excp_is_intr(self) -> bool:
+        """Returns True if the last trap was an interrupt"""
+        return (self.excp_cause & 0x80000000) != 0
+    
+    def snapshot(self) -> RiscvRegSnapshot:
+        """Returns the current register values, tagged with the current
+        instruction count. The registers are only copied when next 
+        written, and only once for any number of snapshots"""
+        self.regs_shared = True
+        return RiscvRegSnapshot(self.instr_count, self.regs_v)
+    
+    def _regs_wr(self):
+        """Returns the register file for writing, first copying it if
+        a snapshot shares it"""
+        if self.regs_shared:
+            self.regs = array('I', self.regs)
+            self.regs_v = memoryview(self.regs).toreadonly()
+            self.regs_shared = False
+        return self.regs
+    
+    def _msg_words(self, v):
+        """Packs a string into the 32-bit words used by the _set_*_w tasks.
+        Strings longer than the message size are truncated and end with '...'"""
+        b = v.encode()
+        
+        if len(b) > self.msg_sz:
+            b = b[:self.msg_sz-3] + b"..."
+            
+        return struct.unpack(self.msg_fmt, b.ljust(4*self.msg_nw, b'\0'))
+    
     def _set_disasm_s(self, v):
-        self._clr_disasm()
+        self._set_disasm_words(self._msg_words(v))
+        
+    def _set_disasm_words(self, w):
+        # Skip the update when the field already shows this text
+        if w == self.disasm_w:
+            return
+        self.disasm_w = w
 
-        if len(v) > self.msg_sz:
-            v = v[:-3]
-            v += "..."
-            
-        for i,c in enumerate(v.encode()):
-            self._set_disasm_c(i, c)
+        for i in range(0, self.msg_nw, 4):
+            self._set_disasm_w(i>>2, w[i], w[i+1], w[i+2], w[i+3])
         
     def _set_tid_s(self, v):
-        self._clr_tid()
-        if len(v) > self.msg_sz:
-            v = v[:-3]
-            v += "..."
+        w = self._msg_words(v)
+        
+        # Thread switches usually leave the tid unchanged
+        if w == self.tid_w:
+            return
+        self.tid_w = w
         
-        for i,c in enumerate(v.encode()):
-            self._set_tid_c(i, c)
+        for i in range(0, self.msg_nw, 4):
+            self._set_tid_w(i>>2, w[i], w[i+1], w[i+2], w[i+3])
+            
+    @pybfms.import_task(pybfms.uint8_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t)
+    def _set_tid_w(self, idx, w0, w1, w2, w3):
+        pass
             
     @pybfms.import_task(pybfms.uint8_t, pybfms.uint8_t)
     def _set_tid_c(self, i, v):
@@ -92,15 +657,29 @@ class RiscvDebugBfm(cdbgc.BfmBase):
         
         
     def _set_func_s(self, frame, v):
-        self._clr_func(frame)
-        
-        #
-        if len(v) > self.msg_sz:
-            v = v[:-3]
-            v += "..."
+        w = self.func_w.get(v)
+        if w is None:
+            w = self._msg_words(v)
+            self.func_w[v] = w
+            
+        # When the window shifts, only slots whose contents
+        # change need to be rewritten
+        if w is self.frame_w[frame]:
+            return
+        self.frame_w[frame] = w
+
+        for i in range(0, self.msg_nw, 4):
+            self._set_func_w(frame, i>>2, w[i], w[i+1], w[i+2], w[i+3])
+            
+    @pybfms.import_task(pybfms.uint8_t,pybfms.uint8_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t)
+    def _set_func_w(self, frame, idx, w0, w1, w2, w3):
+        pass
 
-        for i,c in enumerate(v.encode()):
-            self._set_func_c(frame, i, c)
+    def _clr_func_s(self, frame):
+        if self.frame_w[frame] is FRAME_CLR:
+            return
+        self.frame_w[frame] = FRAME_CLR
+        self._clr_func(frame)
 
     @pybfms.import_task(pybfms.uint8_t)
     def _clr_func(self, frame):
@@ -110,8 +689,15 @@ class RiscvDebugBfm(cdbgc.BfmBase):
     @pybfms.export_task(pybfms.uint32_t)
     def _set_parameters(self, msg_sz):
         self.msg_sz = msg_sz
+        
+        # Message strings are transferred 16 characters at a time
+        self.msg_nw = 4*((msg_sz + 15) // 16)
+        self.msg_fmt = ">%dI" % self.msg_nw
+        
+        if self.symtab is not None:
+            self._build_func_w()
 
-    @pybfms.export_task(pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint8_t,pybfms.uint8_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint8_t,pybfms.uint8_t,pybfms.uint32_t)
+    @pybfms.export_task(pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint8_t,pybfms.uint8_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint8_t,pybfms.uint8_t,pybfms.uint32_t,pybfms.uint8_t)
     def _instr_exec(self, 
                     last_pc,
                     last_instr,
@@ -123,24 +709,110 @@ class RiscvDebugBfm(cdbgc.BfmBase):
                     mem_data,
                     mem_wmask,
                     mem_rmask,
-                    count):
-#        if mem_wmask:
-#            print("Write: " + hex(mem_waddr) + " = " + hex(mem_wmask))
+                    count,
+                    pushpop):
+        self._retire(
+            last_pc,
+            last_instr,
+            pc,
+            instr,
+            intr,
+            iret,
+            mem_addr,
+            mem_data,
+            mem_wmask,
+            mem_rmask,
+            count,
+            pushpop)
+
+        # Handle disassembly            
+        if self.en_disasm and self.trace_level == RiscvDebugTraceLevel.All:
+            self._set_disasm_pc(pc, instr)
+            
+    @pybfms.export_task(pybfms.uint8_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t)
+    def _instr_exec_batch(self, n,
+                          lp0, li0, pc0, in0, ma0, md0, c0, f0,
+                          lp1, li1, pc1, in1, ma1, md1, c1, f1,
+                          lp2, li2, pc2, in2, ma2, md2, c2, f2,
+                          lp3, li3, pc3, in3, ma3, md3, c3, f3):
+        """Receives up to BATCH_MAX buffered retire records. Each record
+        is passed as eight 32-bit parameters: last_pc, last_instr, pc, 
+        instr, mem_addr, mem_data, count and flags. The flags are
+        {bp[12], wmask[11:8], rmask[7:4], pop[3], push[2], iret[1], intr[0]}
+        """
+        recs = (
+            (lp0, li0, pc0, in0, ma0, md0, c0, f0),
+            (lp1, li1, pc1, in1, ma1, md1, c1, f1),
+            (lp2, li2, pc2, in2, ma2, md2, c2, f2),
+            (lp3, li3, pc3, in3, ma3, md3, c3, f3))
+        
+        pc = 0
+        instr = 0
+        for i in range(n):
+            last_pc, last_instr, pc, instr, mem_addr, mem_data, count, f = recs[i]
+            self._retire(
+                last_pc,
+                last_instr,
+                pc,
+                instr,
+                (f & 1),
+                ((f >> 1) & 1),
+                mem_addr,
+                mem_data,
+                ((f >> 8) & 0xF),
+                ((f >> 4) & 0xF),
+                count,
+                ((f >> 2) & 0x3) | ((f >> 10) & 0x4))
+            
+        # Only the last instruction in the batch is visible 
+        if n > 0 and self.en_disasm and self.trace_level == RiscvDebugTraceLevel.All:
+            self._set_disasm_pc(pc, instr)
+            
+    def _retire(self,
+                last_pc,
+                last_instr,
+                pc,
+                instr,
+                intr,
+                iret,
+                mem_addr,
+                mem_data,
+                mem_wmask,
+                mem_rmask,
+                count,
+                pushpop):
+        """Processes a single retire record. 'pushpop' holds the HDL's 
+        call (bit 0) and return (bit 1) classification of last_instr,
+        and whether 'pc' hit a breakpoint (bit 2)"""
+        self.instr_count = count
+        
+        if self.recorder is not None:
+            self.recorder.retire(
+                last_pc,
+                last_instr,
+                pc,
+                instr,
+                intr,
+                iret,
+                mem_addr,
+                mem_data,
+                mem_wmask,
+                mem_rmask,
+                count,
+                pushpop)
 
         flags = 0
 
         if intr:
             flags |= cdbgc.ExecEvent.Excp
+            _, _, _, _, self.excp_epc, self.excp_cause, self.excp_tval, _ = self.csrs
         elif iret:
             flags |= cdbgc.ExecEvent.Eret
-            
-#        if mem_wmask: # and mem_waddr == 0x80009298:
-#            print("Write: " + hex(mem_waddr) + " " + hex(mem_wdata))
-            
-#        print("instr_exec: " + hex(pc))
-#        instr_exec_f_copy = self.instr_exec_f.copy()
-#        for f in instr_exec_f_copy:
-#            f(pc, instr)
+            self.eret_pc = pc
 
         if mem_wmask != 0:
             # Update the mirror memory
@@ -148,23 +820,29 @@ class RiscvDebugBfm(cdbgc.BfmBase):
         elif mem_rmask != 0:
             self.memread(pc, mem_addr, mem_data, mem_rmask)
             
-
-        # Handle disassembly            
-        if self.trace_level == RiscvDebugTraceLevel.All:
-            self._set_disasm_s(self.disasm(pc, instr))
-
-        (last_is_push,last_is_pop,npc) = self.is_pushpop(last_instr, 0)
+        last_is_push = (pushpop & 1) != 0
+        last_is_pop = (pushpop & 2) != 0
+        
+        if last_is_pop:
+            self.call_depth -= 1
+        if last_is_push:
+            self.call_depth += 1
         
         if last_is_push:
-            # Last was the push, so 'pc' is the target
-            retaddr = last_pc + 4 if (instr & 0x3) == 3 else last_pc + 2
+            # Last was the push, so 'pc' is the target. The return
+            # address follows the (possibly-compressed) call instruction
+            retaddr = last_pc + 4 if (last_instr & 0x3) == 3 else last_pc + 2
+            
+            if last_is_pop:
+                # Jump through one link register while writing the
+                # other (eg coroutine swap): return, then call
+                super().execute(pc, last_pc, instr, flags | cdbgc.ExecEvent.Ret)
+                
             flags |= cdbgc.ExecEvent.Call
             super().execute(pc, retaddr, instr, flags)
         elif last_is_pop:
             flags |= cdbgc.ExecEvent.Ret
             super().execute(pc, last_pc, instr, flags)
-        elif last_is_push and last_is_pop:
-            print("TODO: both push/pop")
         else:
             # Pass execution along to BFM
             super().execute(pc, last_pc, instr, flags)
@@ -174,49 +852,54 @@ class RiscvDebugBfm(cdbgc.BfmBase):
                 
         self.last_instr = instr
         
+        if self.profiler is not None:
+            self.profiler.retire(last_pc, pc, count, intr, iret, pushpop)
+            
+        if self.checkpointer is not None:
+            self.checkpointer.retire(last_pc, last_instr, pc, count, pushpop)
+        
+        if (pushpop & 4) != 0:
+            self._bp_hit(pc)
+            
+        if self.n_waiters != 0:
+            if last_is_pop:
+                # Depth after the return, before any call by the same jump
+                self._wake(self.ret_w, 
+                    self.call_depth - (1 if last_is_push else 0), pc)
+            if last_is_push:
+                self._wake(self.call_w, pc, pc)
+                self._wake(self.call_w, None, pc)
+            if mem_wmask != 0:
+                self._wake(self.mem_w, mem_addr & ~3, mem_data)
+            self._wake(self.pc_w, pc, pc)
+            
+    def _bp_hit(self, pc):
+        """Releases the waiters whose breakpoint 'pc' hit. Breakpoints
+        are one-shot, so their comparators are freed"""
+        run = False
+        for i,ent in enumerate(self.bp):
+            if ent is None:
+                continue
+            if ent[0] <= pc <= ent[1]:
+                ent[4] = pc
+                self.bp[i] = None
+                self._set_bp(i, 0, 0, 0)
+                ent[2].set()
+            elif ent[3]:
+                run = True
+                
+        # The HDL stops suppressing tracing on any hit
+        if run:
+            self._set_run(1)
+        self._update_trace_level()
+        
     def is_pushpop(self, instr, pc):
-        is_push = False 
-        is_pop = False
-        npc = pc
-        
-        if (instr & 0x7f) == 0x67:
-            # jalr
-            rs1 = (instr >> 15) & 0x1f
-            rd = (instr >> 7) & 0x1f
-            
-            rs1_islink = rs1 in [1,5]
-            rd_islink = rd in [1,5]
-            
-            if not rd_islink and rs1_islink:
-                is_pop = True
-            elif rd_islink and not rs1_islink:
-                is_push = True
-            elif rd_islink and rs1_islink:
-                if rd != rs1:
-                    is_push = True
-                    is_pop = True
-                else:
-                    is_push = True
-            if is_push:
-                npc = pc+4
-        elif (instr & 0x7f) == 0x6f:
-            # jal
-            rd = (instr >> 7) & 0x1f
-            is_push = rd in [1,5]
-            
-            if is_push:
-                npc = pc+4
-        elif (instr & 0x3) == 2 and ((instr >> 13) & 0x7) == 4:
-            # c.jal
-            rd = (instr >> 7) & 0x1f
-            is_push = rd in [1,5]
-            
-            if is_push:
-                npc = pc+2
-        elif (instr & 0x3) == 2 and ((instr >> 13) & 0x7) == 8:
-            print("TODO: c.jalr")
-        elif (instr & 0x3) == 1 and ((instr >> 13) & 0x7) == 1:
-            print("TODO: c.jal")
+        """Classifies instr as a call (push) and/or return (pop). 
+        Returns (is_push, is_pop, npc), where npc is the return 
+        address of a call"""
+        is_push, is_pop, size = riscv_decoder.pushpop(instr)
+        
+        npc = pc+size if is_push else pc
         
         return (is_push,is_pop,npc)
 
@@ -232,9 +915,81 @@ class RiscvDebugBfm(cdbgc.BfmBase):
     def eret(self):
         self.window_mgr.set_thread(self.active_thread)
  
+    @pybfms.export_task(pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t)
+    def _cov_data(self, idx,
+                  w0, w1, w2, w3, w4, w5, w6, w7,
+                  w8, w9, w10, w11, w12, w13, w14, w15):
+        """Receives 16 words of the coverage bitmap, starting at word 'idx'"""
+        struct.pack_into("<16I", self.cov_buf, 4*idx, 
+            w0, w1, w2, w3, w4, w5, w6, w7,
+            w8, w9, w10, w11, w12, w13, w14, w15)
+        
+        if idx + 16 >= self.cov_n_words and self.cov_ev is not None:
+            self.cov_ev.set()
+        
+    @pybfms.export_task(pybfms.uint32_t,pybfms.uint32_t)
+    def _sample(self, pc, count):
+        hist = self.sample_hist
+        hist[pc] = hist.get(pc, 0) + 1
+        self.sample_count = count
+ 
+    @pybfms.export_task(pybfms.uint8_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t)
+    def _write_csrs(self, mask, c0, c1, c2, c3, c4, c5, c6, c7):
+        """Updates the shadowed CSRs whose bit is set in 'mask'. Values
+        are in shadow-index order (see CSR_ADDRS)"""
+        vals = (c0, c1, c2, c3, c4, c5, c6, c7)
+        csrs = self.csrs
+        for i in range(len(CSR_ADDRS)):
+            if (mask & (1 << i)) != 0:
+                csrs[i] = vals[i]
+                
     @pybfms.export_task(pybfms.uint32_t,pybfms.uint32_t)
     def _write_reg(self, addr, data):
+        if self.regs_shared:
+            self._regs_wr()
         self.regs[addr] = data
+        
+        if self.recorder is not None:
+            self.recorder.write_regs((1 << addr), self.regs)
+        
+    @pybfms.export_task(pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t)
+    def _write_regs(self, mask,
+                    x1, x2, x3, x4, x5, x6, x7, x8,
+                    x9, x10, x11, x12, x13, x14, x15, x16,
+                    x17, x18, x19, x20, x21, x22, x23, x24,
+                    x25, x26, x27, x28, x29, x30, x31):
+        """Updates the registers whose bit is set in 'mask'. Values are
+        passed one per parameter, since export-task parameters are 
+        limited to 32 bits under Verilog"""
+        vals = (0, x1, x2, x3, x4, x5, x6, x7, x8,
+                x9, x10, x11, x12, x13, x14, x15, x16,
+                x17, x18, x19, x20, x21, x22, x23, x24,
+                x25, x26, x27, x28, x29, x30, x31)
+        regs = self._regs_wr()
+        
+        m = mask
+        while m:
+            lsb = m & -m
+            r = lsb.bit_length()-1
+            regs[r] = vals[r]
+            m ^= lsb
+            
+        if self.recorder is not None:
+            self.recorder.write_regs(mask, regs)
     
     @pybfms.import_task(pybfms.uint8_t,pybfms.uint8_t,pybfms.uint8_t)
     def _set_func_c(self, frame, idx, ch):
@@ -248,6 +1003,10 @@ class RiscvDebugBfm(cdbgc.BfmBase):
     def _set_disasm_c(self, idx, ch):
         pass
     
+    @pybfms.import_task(pybfms.uint8_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t)
+    def _set_disasm_w(self, idx, w0, w1, w2, w3):
+        pass
+    
     @pybfms.import_task(pybfms.uint32_t)
     def _set_instr_limit(self, count):
         pass
@@ -261,183 +1020,78 @@ class RiscvDebugBfm(cdbgc.BfmBase):
     def _set_trace_level(self, l):
         pass
     
+    @pybfms.import_task(pybfms.uint32_t)
+    def _set_batch_sz(self, n):
+        pass
+    
+    @pybfms.import_task()
+    def _flush_batch(self):
+        pass
+    
+    @pybfms.import_task(pybfms.uint8_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint8_t)
+    def _set_mem_win(self, idx, base, limit, en):
+        pass
+    
+    @pybfms.import_task(pybfms.uint8_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint8_t)
+    def _set_bp(self, idx, base, limit, en):
+        pass
+    
+    @pybfms.import_task(pybfms.uint8_t)
+    def _set_run(self, en):
+        pass
+    
+    @pybfms.import_task(pybfms.uint32_t,pybfms.uint32_t,pybfms.uint8_t)
+    def _set_sample(self, period, jitter, mem):
+        pass
+    
+    @pybfms.import_task(pybfms.uint32_t,pybfms.uint32_t,pybfms.uint8_t)
+    def _set_cov(self, base, limit, en):
+        pass
+    
+    @pybfms.import_task()
+    def _clr_cov(self):
+        pass
+    
+    @pybfms.import_task(pybfms.uint32_t)
+    def _cov_dump(self, n):
+        pass
+    
     def disasm(self, pc, instr):
         """Disassembles a single RISC-V instruction"""
-        if (instr & 0x3) == 0x3:
-            return self.disasm_32(pc, instr)
+        return self._disasm_ent(pc, instr)[0]
+    
+    def _disasm_ent(self, pc, instr):
+        """Returns the disassembly-cache entry for an instruction"""
+        key = (pc, instr)
+        ent = self.disasm_cache.get(key)
+        
+        if ent is not None:
+            self.disasm_cache_hits += 1
+            self.disasm_cache.move_to_end(key)
         else:
-            return self.disasm_16(pc, instr)
+            self.disasm_cache_misses += 1
+            ent = [riscv_decoder.disasm(pc, instr), None]
+                
+            if self.disasm_cache_sz > 0:
+                self.disasm_cache[key] = ent
+                if len(self.disasm_cache) > self.disasm_cache_sz:
+                    self.disasm_cache.popitem(last=False)
+        return ent
+    
+    def _set_disasm_pc(self, pc, instr):
+        """Displays the disassembly of the specified instruction"""
+        ent = self._disasm_ent(pc, instr)
+        if ent[1] is None:
+            ent[1] = self._msg_words(ent[0])
+        self._set_disasm_words(ent[1])
         
     def get_sp(self) -> int:
         return self.regs[2]
         
     def disasm_32(self, pc, instr):
-        ret = ""
-        
-        rd = ((instr >> 7) & 0x1F)
-        rs1 = ((instr >> 15) & 0x1F)
-        rs2 = ((instr >> 20) & 0x1F)
-        
-        rnm = [
-            "zero", "ra", "sp", "gp", "tp",
-            "t0", "t1", "t2", "s0", "s1",
-            "a0", "a1", "a2", "a3", "a4",
-            "a5", "a6", "a7", "s2", "s3",
-            "s4", "s5", "s6", "s7", "s8",
-            "s9", "s10", "s11", "t3", "t4",
-            "t5", "t6"
-            ]
-        
-        if (instr & 0x7F) == 0x37:
-            ret = "lui %s,0x%05x" % (rnm[rd], (instr >> 12) & 0xFFFFF)
-        elif (instr & 0x7F) == 0x17:
-            imm = (instr & 0xFFFFF000)
-            
-            if (imm & 0x80000000) != 0:
-                imm = -(~imm + 1)
-                
-            ret = "auipc %s,0x%08x" % (rnm[rd],(pc+imm))
-        elif (instr & 0x7F) == 0x6f:
-            imm = 0
-            imm |= (((instr >> 31) & 1) << 20)
-            imm |= (((instr >> 21) & 0x3FF) << 1)
-            imm |= (((instr >> 20) & 1) << 11)
-            imm |= (((instr >> 12) & 0xFF) << 12)
-                    
-            if (imm & (1 << 20)) != 0:
-                imm = -(~imm + 1)
-
-            if rd == 0:
-                ret = "j 0x%08x" % (pc+imm)
-            else:
-                ret = "jal %s,0x%08x" % (rnm[rd],(pc+imm))
-        elif (instr & 0x7F) == 0x67 and ((instr & 0x7000) == 0):
-            imm = (instr >> 20) & 0xFFF
-            rs1_v = self.regs[rs1]
-            
-            if imm & 0x800:
-                imm = -((~imm&0xFFF)+1)
-                
-            target = pc + imm
-            
-            if rd != 0:
-                if imm == 0:
-                    ret = "jalr %s,(%s)" % (rnm[rd], rnm[rs1])
-                else:
-                    ret = "jalr %s,%d(%s)" % (rnm[rd], imm, rnm[rs1])
-            else:
-                if imm == 0:
-                    ret = "jalr (%s)" % (rnm[rs1],)
-                else:
-                    ret = "jalr %d(%s)" % (imm,rnm[rs1])
-        elif (instr & 0x7F) == 0x63:
-            op = [
-                "beq", "bne", "ill", "ill",
-                "blt", "bge", "bltu", "bgeu"
-                ][(instr >> 12) & 0x7]
-            imm = 0
-            imm |= ((instr >> 8) & 0xF) << 1
-            imm |= ((instr >> 25) & 0x3F) << 5
-            imm |= ((instr >> 7) & 0x1) << 11
-            imm |= ((instr >> 31) & 0x1) << 12
-            
-            if (imm & 0x1000) != 0:
-                imm = -((~imm&0x1FFF) + 1)
-                
-            ret = "%s %s,%s,0x%04x" % (op, rnm[rs1], rnm[rs2], (pc+imm))
-        elif (instr & 0x7F) == 0x03:
-            op = ["lb", "lh", "lw", "ill"
-                  "lbu", "lhb", "ill", "ill"][(instr >> 12) & 0x3]
-            imm = (instr >> 20) & 0xFFF
-            if imm & 0x800:
-                # Actually a signed number
-                imm = -((~imm&0xFFF) + 1)
-            ret = "%s %s,%d(%s)" % (op,rnm[rd],imm,rnm[rs1])
-        elif (instr & 0x7F) == 0x23:
-            op = ["sb", "sh", "sw", "ill"][(instr >> 12) & 0x3]
-            imm = (((instr >> 25) & 0x7F) << 5) | ((instr >> 7) & 0x1F)
-            if imm & 0x800:
-                # Actually a signed number
-                imm = -((~imm&0xFFF) + 1)
-                
-            ret = "%s %s,%d(%s)" % (op, rnm[rs2], imm,rnm[rs1])
-        elif (instr & 0x7F) == 0x13:
-            f3 = (instr >> 12) & 0x7
-            op = ["addi", "slli", "slti", "sltiu", 
-                      "xori", "srli", "ori", "andi"][f3]
-            imm = (instr >> 20) & 0xFFF
-            
-            if imm & 0x800 and f3 in [0, 2]: # addi, slti
-                # Actually a signed number
-                imm = -((~imm&0xFFF) + 1)
-
-            if f3 == 0 and rs1 == 0:
-                if rd == 0:
-                    # nop
-                    ret = "nop"
-                else:
-                    # Synthetic li
-                    ret = "li %s,%d" % (rnm[rd],imm)
-            else:                                
-                ret = "%s %s,%s,%d" % (op,rnm[rd],rnm[rs1],imm)
-        elif (instr & 0x7F) == 0x33:
-            op = "ill"
-            if (instr & 0x40000000) == 0:
-                op = ["add", "sll", "slt", "sltu", 
-                      "xor", "srl", "or", "and"][(instr >> 12) & 0x3]
-            else:
-                op = ["sub", "ill", "ill", "ill", 
-                      "ill", "sra", "ill", "ill"][(instr >> 12) & 0x3]
-                
-            ret = "%s %s,%s,%s" % (op, rnm[rd], rnm[rs1], rnm[rs2])
-        elif (instr & 0x7F) == 0x1F:
-            ret = "fence" if (instr & 0x1000) == 0 else "fence.i"
-        elif (instr & 0x73) == 0x1F:
-            if ((instr >> 12) & 0x7) == 0:
-                ret = "ecall" if (instr & 0x100000) == 0 else "ebreak"
-            else:
-                op = ["ill", "csrrw", "csrrs", "csrrc",
-                      "ill", "csrrwi", "csrrsi", "csrrci"][(instr >> 12) & 0x7]
-                # TODO: CSR number
-                ret = "%s %s,%s" % (op, rnm[rd], rnm[rs1])
-        else:
-            ret = "ill "
-            
-        return ret
+        """Disassembles a 32-bit RISC-V instruction"""
+        return riscv_decoder.disasm_32(pc, instr)
     
     def disasm_16(self, pc, instr):
-        ret = "ill"
-        
-        rnm = [
-            "zero", "ra", "sp", "gp", "tp",
-            "t0", "t1", "t2", "s0", "s1",
-            "a0", "a1", "a2", "a3", "a4",
-            "a5", "a6", "a7", "s2", "s3",
-            "s4", "s5", "s6", "s7", "s8",
-            "s9", "s10", "s11", "t3", "t4",
-            "t5", "t6"
-            ]
-        
-        if (instr & 0x3) == 0:
-            pass
-        elif (instr & 0x3) == 1:
-            op = (instr >> 13) & 0x7
-            rd = (instr >> 7) & 0x1f
-            imm = (instr >> 2) & 0x1f
-            imm |= ((instr >> 12) & 1) << 5
-            
-            if op == 0:
-                if rd == 0:
-                    ret = "c.nop"
-                else:
-                    ret = "c.addi %s,%d" % (rnm[rd], imm)
-            elif op == 1:
-                pass
-            elif op == 2:
-                
-                ret = "c.li %s,%d" % (rnm[rd], imm)
-        elif (instr & 0x3) == 2:
-            pass
-        
-        return ret;
-        
+        """Disassembles a 16-bit (compressed) RISC-V instruction"""
+        return riscv_decoder.disasm_16(pc, instr)
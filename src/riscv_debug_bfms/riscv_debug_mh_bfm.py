@@ -0,0 +1,240 @@
+#****************************************************************************
+#* riscv_debug_mh_bfm.py
+#*
+#* Multi-hart variant of RiscvDebugBfm. A single BFM instance tracks
+#* several harts, each with its own register file and call stack. The
+#* harts share one memory mirror and symbol table.
+#****************************************************************************
+import pybfms
+from riscv_debug_bfms.riscv_debug_bfm import RiscvDebugBfm, RiscvDebugTraceLevel
+from riscv_debug_bfms.riscv_elf_symtab import RiscvElfSymtab
+
+# Maximum number of harts. Must match HARTS_MAX in riscv_debug_mh_bfm.v
+MH_HARTS_MAX = 8
+
+# Maximum number of retire records per _instr_exec_mh call. Must match
+# REC_MAX in riscv_debug_mh_bfm.v
+MH_REC_MAX = 4
+
+
+class RiscvDebugHart(RiscvDebugBfm):
+    """State of a single hart within RiscvDebugMhBfm. Messages to the
+    HDL are sent through the parent BFM, tagged with the hart id"""
+
+    def __init__(self, parent, hart_id):
+        super().__init__()
+        self.parent = parent
+        self.hart_id = hart_id
+
+    def _set_tid_w(self, idx, w0, w1, w2, w3):
+        self.parent._set_tid_w_h(self.hart_id, idx, w0, w1, w2, w3)
+
+    def _set_func_w(self, frame, idx, w0, w1, w2, w3):
+        self.parent._set_func_w_h(self.hart_id, frame, idx, w0, w1, w2, w3)
+
+    def _clr_func(self, frame):
+        self.parent._clr_func_h(self.hart_id, frame)
+
+    def _set_disasm_w(self, idx, w0, w1, w2, w3):
+        self.parent._set_disasm_w_h(self.hart_id, idx, w0, w1, w2, w3)
+
+    def _set_trace_level(self, l):
+        raise Exception("the trace level is set on RiscvDebugMhBfm")
+
+    def _set_batch_sz(self, n):
+        raise Exception("batching is not supported by RiscvDebugMhBfm")
+
+    def _flush_batch(self):
+        raise Exception("batching is not supported by RiscvDebugMhBfm")
+
+    def _set_mem_win(self, idx, base, limit, en):
+        raise Exception("address windows are not supported by RiscvDebugMhBfm")
+
+    def _set_instr_limit(self, count):
+        raise Exception("instruction limits are not supported by RiscvDebugMhBfm")
+
+    def _set_bp(self, idx, base, limit, en):
+        raise Exception("breakpoints are not supported by RiscvDebugMhBfm")
+
+    def _set_run(self, en):
+        raise Exception("breakpoints are not supported by RiscvDebugMhBfm")
+
+    def _set_sample(self, period, jitter, mem):
+        raise Exception("sampling is not supported by RiscvDebugMhBfm")
+
+    def _set_cov(self, base, limit, en):
+        raise Exception("coverage collection is not supported by RiscvDebugMhBfm")
+
+    def _clr_cov(self):
+        raise Exception("coverage collection is not supported by RiscvDebugMhBfm")
+
+    def _cov_dump(self, n):
+        raise Exception("coverage collection is not supported by RiscvDebugMhBfm")
+
+    def memwrite(self, pc, addr, data, mask):
+        # Strings cached by the other harts are read from the shared memory
+        for h in self.parent.harts:
+            if h is not self and addr < h.str_cache_hi and addr+4 > h.str_cache_lo:
+                h._clr_str_cache()
+        super().memwrite(pc, addr, data, mask)
+
+
+@pybfms.bfm(hdl={
+    pybfms.BfmType.Verilog : pybfms.bfm_hdl_path(__file__, "hdl/riscv_debug_mh_bfm.v"),
+    pybfms.BfmType.SystemVerilog : pybfms.bfm_hdl_path(__file__, "hdl/riscv_debug_mh_bfm.v"),
+    }, has_init=True)
+class RiscvDebugMhBfm(object):
+
+    def __init__(self):
+        # Created when the HDL reports the number of harts
+        self.harts = []
+        self.mm = None
+        self.symtab : RiscvElfSymtab = None
+        self.trace_level : RiscvDebugTraceLevel = RiscvDebugTraceLevel.All
+        self.en_disasm = True
+        self.is_reset = False
+        self.reset_ev = pybfms.event()
+
+    def hart(self, i) -> RiscvDebugHart:
+        return self.harts[i]
+
+    def set_trace_level(self, l : RiscvDebugTraceLevel):
+        if l == RiscvDebugTraceLevel.Sample:
+            raise Exception("sampling is not supported by RiscvDebugMhBfm")
+        if self.trace_level != l:
+            self.trace_level = l
+            self._set_trace_level(int(l))
+
+            for h in self.harts:
+                h.trace_level = l
+                h.user_trace_level = l
+                if l != RiscvDebugTraceLevel.All:
+                    h._set_disasm_s("")
+
+    def set_elf(self, path):
+        """Reads function symbols from an ELF file, shared by all harts"""
+        self.symtab = RiscvElfSymtab(path)
+
+        if len(self.harts) > 0:
+            self._share_symtab()
+
+    def _share_symtab(self):
+        h0 = self.harts[0]
+        h0.symtab = self.symtab
+        h0.func_w.clear()
+        h0._build_func_w()
+        for h in self.harts[1:]:
+            h.symtab = self.symtab
+            h.func_w = h0.func_w
+
+    @pybfms.export_task(pybfms.uint32_t, pybfms.uint32_t)
+    def _set_parameters(self, n_harts, msg_sz):
+        self.harts = []
+        for i in range(n_harts):
+            h = RiscvDebugHart(self, i)
+            h._set_parameters(msg_sz)
+            h.trace_level = self.trace_level
+            h.user_trace_level = self.trace_level
+            self.harts.append(h)
+
+        # All harts share the memory mirror of the first
+        self.mm = self.harts[0].mm
+        for h in self.harts[1:]:
+            h.mm = self.mm
+
+        if self.symtab is not None:
+            self._share_symtab()
+
+    @pybfms.export_task(pybfms.uint8_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t)
+    def _instr_exec_mh(self, n,
+                       lp0, li0, pc0, in0, ma0, md0, c0, f0, r0,
+                       lp1, li1, pc1, in1, ma1, md1, c1, f1, r1,
+                       lp2, li2, pc2, in2, ma2, md2, c2, f2, r2,
+                       lp3, li3, pc3, in3, ma3, md3, c3, f3, r3):
+        """Receives up to MH_REC_MAX retire records of the harts that
+        retired an instruction in a clock cycle. Each record is passed
+        as nine 32-bit parameters: last_pc, last_instr, pc, instr, 
+        mem_addr, mem_data, count, flags and rd_wdata. The flags are
+        {rd[28:24], hart[18:16], wmask[11:8], rmask[7:4], pop[3], 
+        push[2], iret[1], intr[0]}
+        """
+        recs = (
+            (lp0, li0, pc0, in0, ma0, md0, c0, f0, r0),
+            (lp1, li1, pc1, in1, ma1, md1, c1, f1, r1),
+            (lp2, li2, pc2, in2, ma2, md2, c2, f2, r2),
+            (lp3, li3, pc3, in3, ma3, md3, c3, f3, r3))
+        show_disasm = self.en_disasm and self.trace_level == RiscvDebugTraceLevel.All
+
+        for i in range(n):
+            last_pc, last_instr, pc, instr, mem_addr, mem_data, count, f, r = recs[i]
+            h = self.harts[(f >> 16) & 0x7]
+
+            rd = (f >> 24) & 0x1F
+            if rd != 0:
+                h._write_reg(rd, r)
+
+            h._retire(
+                last_pc,
+                last_instr,
+                pc,
+                instr,
+                (f & 1),
+                ((f >> 1) & 1),
+                mem_addr,
+                mem_data,
+                ((f >> 8) & 0xF),
+                ((f >> 4) & 0xF),
+                count,
+                ((f >> 2) & 0x3))
+
+            if show_disasm:
+                h._set_disasm_pc(pc, instr)
+
+    @pybfms.export_task(pybfms.uint8_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,
+                        pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t)
+    def _write_regs_h(self, hart, mask,
+                      x1, x2, x3, x4, x5, x6, x7, x8,
+                      x9, x10, x11, x12, x13, x14, x15, x16,
+                      x17, x18, x19, x20, x21, x22, x23, x24,
+                      x25, x26, x27, x28, x29, x30, x31):
+        self.harts[hart]._write_regs(mask,
+            x1, x2, x3, x4, x5, x6, x7, x8,
+            x9, x10, x11, x12, x13, x14, x15, x16,
+            x17, x18, x19, x20, x21, x22, x23, x24,
+            x25, x26, x27, x28, x29, x30, x31)
+
+    @pybfms.export_task()
+    def _reset(self):
+        self.is_reset = True
+        for h in self.harts:
+            h._reset()
+        self.reset_ev.set()
+
+    @pybfms.import_task(pybfms.uint8_t,pybfms.uint8_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t)
+    def _set_tid_w_h(self, hart, idx, w0, w1, w2, w3):
+        pass
+
+    @pybfms.import_task(pybfms.uint8_t,pybfms.uint8_t,pybfms.uint8_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t)
+    def _set_func_w_h(self, hart, frame, idx, w0, w1, w2, w3):
+        pass
+
+    @pybfms.import_task(pybfms.uint8_t,pybfms.uint8_t)
+    def _clr_func_h(self, hart, frame):
+        pass
+
+    @pybfms.import_task(pybfms.uint8_t,pybfms.uint8_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t,pybfms.uint32_t)
+    def _set_disasm_w_h(self, hart, idx, w0, w1, w2, w3):
+        pass
+
+    @pybfms.import_task(pybfms.uint32_t)
+    def _set_trace_level(self, l):
+        pass
+
@@ -0,0 +1,541 @@
+#****************************************************************************
+#* riscv_decoder.py
+#*
+#* Table-driven decoder for the RV32IMC instruction set. The dispatch
+#* tables are built once at import, and are shared by the disassembler
+#* and the call/return classifier.
+#****************************************************************************
+
+REG_NAMES = (
+    "zero", "ra", "sp", "gp", "tp",
+    "t0", "t1", "t2", "s0", "s1",
+    "a0", "a1", "a2", "a3", "a4",
+    "a5", "a6", "a7", "s2", "s3",
+    "s4", "s5", "s6", "s7", "s8",
+    "s9", "s10", "s11", "t3", "t4",
+    "t5", "t6")
+
+CSR_NAMES = {
+    0x001 : "fflags",
+    0x002 : "frm",
+    0x003 : "fcsr",
+    0x300 : "mstatus",
+    0x301 : "misa",
+    0x304 : "mie",
+    0x305 : "mtvec",
+    0x340 : "mscratch",
+    0x341 : "mepc",
+    0x342 : "mcause",
+    0x343 : "mtval",
+    0x344 : "mip",
+    0xB00 : "mcycle",
+    0xB02 : "minstret",
+    0xB80 : "mcycleh",
+    0xB82 : "minstreth",
+    0xC00 : "cycle",
+    0xC01 : "time",
+    0xC02 : "instret",
+    0xC80 : "cycleh",
+    0xC81 : "timeh",
+    0xC82 : "instreth",
+    0xF11 : "mvendorid",
+    0xF12 : "marchid",
+    0xF13 : "mimpid",
+    0xF14 : "mhartid",
+    }
+
+#********************************************************************
+#* Field extractors
+#********************************************************************
+
+def _sext(v, bits):
+    m = 1 << (bits-1)
+    return (v ^ m) - m
+
+def _rd(i):
+    return (i >> 7) & 0x1F
+
+def _rs1(i):
+    return (i >> 15) & 0x1F
+
+def _rs2(i):
+    return (i >> 20) & 0x1F
+
+def _funct3(i):
+    return (i >> 12) & 0x7
+
+def _imm_i(i):
+    return _sext((i >> 20) & 0xFFF, 12)
+
+def _imm_s(i):
+    return _sext((((i >> 25) & 0x7F) << 5) | ((i >> 7) & 0x1F), 12)
+
+def _imm_b(i):
+    return _sext(
+        (((i >> 31) & 0x1) << 12) |
+        (((i >> 7) & 0x1) << 11) |
+        (((i >> 25) & 0x3F) << 5) |
+        (((i >> 8) & 0xF) << 1), 13)
+
+def _imm_u(i):
+    return _sext(i & 0xFFFFF000, 32)
+
+def _imm_j(i):
+    return _sext(
+        (((i >> 31) & 0x1) << 20) |
+        (((i >> 12) & 0xFF) << 12) |
+        (((i >> 20) & 0x1) << 11) |
+        (((i >> 21) & 0x3FF) << 1), 21)
+
+# Compressed-format extractors
+def _c_rd(i):
+    return (i >> 7) & 0x1F
+
+def _c_rs2(i):
+    return (i >> 2) & 0x1F
+
+def _c_rdp(i):
+    """rd'/rs2' field (bits 4:2)"""
+    return ((i >> 2) & 0x7) + 8
+
+def _c_rs1p(i):
+    """rd'/rs1' field (bits 9:7)"""
+    return ((i >> 7) & 0x7) + 8
+
+def _c_imm_ci(i):
+    return _sext((((i >> 12) & 0x1) << 5) | ((i >> 2) & 0x1F), 6)
+
+def _c_uimm_ci(i):
+    return (((i >> 12) & 0x1) << 5) | ((i >> 2) & 0x1F)
+
+def _c_imm_cj(i):
+    return _sext(
+        (((i >> 12) & 0x1) << 11) |
+        (((i >> 11) & 0x1) << 4) |
+        (((i >> 9) & 0x3) << 8) |
+        (((i >> 8) & 0x1) << 10) |
+        (((i >> 7) & 0x1) << 6) |
+        (((i >> 6) & 0x1) << 7) |
+        (((i >> 3) & 0x7) << 1) |
+        (((i >> 2) & 0x1) << 5), 12)
+
+def _c_imm_cb(i):
+    return _sext(
+        (((i >> 12) & 0x1) << 8) |
+        (((i >> 10) & 0x3) << 3) |
+        (((i >> 5) & 0x3) << 6) |
+        (((i >> 3) & 0x3) << 1) |
+        (((i >> 2) & 0x1) << 5), 9)
+
+def _c_uimm_clw(i):
+    """Offset of c.lw/c.sw"""
+    return ((((i >> 10) & 0x7) << 3) |
+            (((i >> 6) & 0x1) << 2) |
+            (((i >> 5) & 0x1) << 6))
+
+def _c_uimm_lwsp(i):
+    return ((((i >> 12) & 0x1) << 5) |
+            (((i >> 4) & 0x7) << 2) |
+            (((i >> 2) & 0x3) << 6))
+
+def _c_uimm_swsp(i):
+    return ((((i >> 9) & 0xF) << 2) |
+            (((i >> 7) & 0x3) << 6))
+
+def _c_uimm_addi4spn(i):
+    return ((((i >> 11) & 0x3) << 4) |
+            (((i >> 7) & 0xF) << 6) |
+            (((i >> 6) & 0x1) << 2) |
+            (((i >> 5) & 0x1) << 3))
+
+def _c_imm_addi16sp(i):
+    return _sext(
+        (((i >> 12) & 0x1) << 9) |
+        (((i >> 6) & 0x1) << 4) |
+        (((i >> 5) & 0x1) << 6) |
+        (((i >> 3) & 0x3) << 7) |
+        (((i >> 2) & 0x1) << 5), 10)
+
+#********************************************************************
+#* RV32IM disassembly
+#********************************************************************
+
+def _ill(pc, i):
+    return "ill"
+
+def _dis_lui(pc, i):
+    return "lui %s,0x%05x" % (REG_NAMES[_rd(i)], (i >> 12) & 0xFFFFF)
+
+def _dis_auipc(pc, i):
+    return "auipc %s,0x%08x" % (REG_NAMES[_rd(i)], (pc + _imm_u(i)) & 0xFFFFFFFF)
+
+def _dis_jal(pc, i):
+    rd = _rd(i)
+    target = (pc + _imm_j(i)) & 0xFFFFFFFF
+    if rd == 0:
+        return "j 0x%08x" % target
+    else:
+        return "jal %s,0x%08x" % (REG_NAMES[rd], target)
+
+def _dis_jalr(pc, i):
+    if _funct3(i) != 0:
+        return "ill"
+    rd = _rd(i)
+    rs1 = _rs1(i)
+    imm = _imm_i(i)
+
+    if rd != 0:
+        if imm == 0:
+            return "jalr %s,(%s)" % (REG_NAMES[rd], REG_NAMES[rs1])
+        else:
+            return "jalr %s,%d(%s)" % (REG_NAMES[rd], imm, REG_NAMES[rs1])
+    else:
+        if imm == 0:
+            return "jalr (%s)" % (REG_NAMES[rs1],)
+        else:
+            return "jalr %d(%s)" % (imm, REG_NAMES[rs1])
+
+_BRANCH_OPS = ("beq", "bne", None, None, "blt", "bge", "bltu", "bgeu")
+
+def _dis_branch(pc, i):
+    op = _BRANCH_OPS[_funct3(i)]
+    if op is None:
+        return "ill"
+    return "%s %s,%s,0x%04x" % (
+        op, REG_NAMES[_rs1(i)], REG_NAMES[_rs2(i)], (pc + _imm_b(i)) & 0xFFFFFFFF)
+
+_LOAD_OPS = ("lb", "lh", "lw", None, "lbu", "lhu", None, None)
+
+def _dis_load(pc, i):
+    op = _LOAD_OPS[_funct3(i)]
+    if op is None:
+        return "ill"
+    return "%s %s,%d(%s)" % (op, REG_NAMES[_rd(i)], _imm_i(i), REG_NAMES[_rs1(i)])
+
+_STORE_OPS = ("sb", "sh", "sw", None, None, None, None, None)
+
+def _dis_store(pc, i):
+    op = _STORE_OPS[_funct3(i)]
+    if op is None:
+        return "ill"
+    return "%s %s,%d(%s)" % (op, REG_NAMES[_rs2(i)], _imm_s(i), REG_NAMES[_rs1(i)])
+
+_OPIMM_OPS = ("addi", "slli", "slti", "sltiu", "xori", "srli", "ori", "andi")
+
+def _dis_opimm(pc, i):
+    f3 = _funct3(i)
+    rd = _rd(i)
+    rs1 = _rs1(i)
+
+    if f3 == 1 or f3 == 5:
+        # Shifts take a 5-bit shift amount, and funct7 selects srai
+        f7 = (i >> 25)
+        if f3 == 1 and f7 == 0:
+            op = "slli"
+        elif f3 == 5 and f7 == 0:
+            op = "srli"
+        elif f3 == 5 and f7 == 0x20:
+            op = "srai"
+        else:
+            return "ill"
+        return "%s %s,%s,%d" % (op, REG_NAMES[rd], REG_NAMES[rs1], _rs2(i))
+
+    imm = _imm_i(i)
+    if f3 == 0 and rs1 == 0:
+        if rd == 0 and imm == 0:
+            return "nop"
+        else:
+            # Synthetic li
+            return "li %s,%d" % (REG_NAMES[rd], imm)
+    return "%s %s,%s,%d" % (_OPIMM_OPS[f3], REG_NAMES[rd], REG_NAMES[rs1], imm)
+
+# OP mnemonics, keyed by (funct7 << 3) | funct3
+_OP_OPS = {}
+for _f3,_op in enumerate(("add", "sll", "slt", "sltu", "xor", "srl", "or", "and")):
+    _OP_OPS[(0x00 << 3) | _f3] = _op
+for _f3,_op in enumerate(("mul", "mulh", "mulhsu", "mulhu", "div", "divu", "rem", "remu")):
+    _OP_OPS[(0x01 << 3) | _f3] = _op
+_OP_OPS[(0x20 << 3) | 0] = "sub"
+_OP_OPS[(0x20 << 3) | 5] = "sra"
+
+def _dis_op(pc, i):
+    op = _OP_OPS.get(((i >> 22) & 0x3F8) | _funct3(i))
+    if op is None:
+        return "ill"
+    return "%s %s,%s,%s" % (op, REG_NAMES[_rd(i)], REG_NAMES[_rs1(i)], REG_NAMES[_rs2(i)])
+
+def _dis_miscmem(pc, i):
+    f3 = _funct3(i)
+    if f3 == 0:
+        return "fence"
+    elif f3 == 1:
+        return "fence.i"
+    return "ill"
+
+# SYSTEM instructions with funct3==0, keyed by imm[11:0]
+_PRIV_OPS = {
+    0x000 : "ecall",
+    0x001 : "ebreak",
+    0x002 : "uret",
+    0x102 : "sret",
+    0x302 : "mret",
+    0x105 : "wfi",
+    }
+
+_CSR_OPS = (None, "csrrw", "csrrs", "csrrc", None, "csrrwi", "csrrsi", "csrrci")
+
+def _csr_name(csr):
+    name = CSR_NAMES.get(csr)
+    return name if name is not None else "0x%03x" % csr
+
+def _dis_system(pc, i):
+    f3 = _funct3(i)
+
+    if f3 == 0:
+        op = _PRIV_OPS.get((i >> 20) & 0xFFF)
+        return op if op is not None else "ill"
+
+    op = _CSR_OPS[f3]
+    if op is None:
+        return "ill"
+
+    csr = _csr_name((i >> 20) & 0xFFF)
+    if f3 < 4:
+        return "%s %s,%s,%s" % (op, REG_NAMES[_rd(i)], csr, REG_NAMES[_rs1(i)])
+    else:
+        return "%s %s,%s,%d" % (op, REG_NAMES[_rd(i)], csr, _rs1(i))
+
+# Disassembly dispatch, indexed by opcode (instr[6:0])
+_DIS32 = [_ill]*128
+_DIS32[0x03] = _dis_load
+_DIS32[0x0F] = _dis_miscmem
+_DIS32[0x13] = _dis_opimm
+_DIS32[0x17] = _dis_auipc
+_DIS32[0x23] = _dis_store
+_DIS32[0x33] = _dis_op
+_DIS32[0x37] = _dis_lui
+_DIS32[0x63] = _dis_branch
+_DIS32[0x67] = _dis_jalr
+_DIS32[0x6F] = _dis_jal
+_DIS32[0x73] = _dis_system
+
+#********************************************************************
+#* RV32C disassembly
+#********************************************************************
+
+def _c_idx(i):
+    """Compressed dispatch index: {funct3, quadrant}"""
+    return ((i >> 11) & 0x1C) | (i & 0x3)
+
+def _cdis_addi4spn(pc, i):
+    imm = _c_uimm_addi4spn(i)
+    if imm == 0:
+        return "ill"
+    return "c.addi4spn %s,sp,%d" % (REG_NAMES[_c_rdp(i)], imm)
+
+def _cdis_lw(pc, i):
+    return "c.lw %s,%d(%s)" % (REG_NAMES[_c_rdp(i)], _c_uimm_clw(i), REG_NAMES[_c_rs1p(i)])
+
+def _cdis_sw(pc, i):
+    return "c.sw %s,%d(%s)" % (REG_NAMES[_c_rdp(i)], _c_uimm_clw(i), REG_NAMES[_c_rs1p(i)])
+
+def _cdis_addi(pc, i):
+    rd = _c_rd(i)
+    if rd == 0:
+        return "c.nop"
+    return "c.addi %s,%d" % (REG_NAMES[rd], _c_imm_ci(i))
+
+def _cdis_jal(pc, i):
+    return "c.jal 0x%08x" % ((pc + _c_imm_cj(i)) & 0xFFFFFFFF)
+
+def _cdis_li(pc, i):
+    return "c.li %s,%d" % (REG_NAMES[_c_rd(i)], _c_imm_ci(i))
+
+def _cdis_lui(pc, i):
+    rd = _c_rd(i)
+    if rd == 2:
+        imm = _c_imm_addi16sp(i)
+        return "c.addi16sp sp,%d" % imm if imm != 0 else "ill"
+    imm = _c_imm_ci(i)
+    if imm == 0:
+        return "ill"
+    return "c.lui %s,0x%x" % (REG_NAMES[rd], imm & 0xFFFFF)
+
+_CARITH_OPS = ("c.sub", "c.xor", "c.or", "c.and")
+
+def _cdis_miscalu(pc, i):
+    rd = REG_NAMES[_c_rs1p(i)]
+    f2 = (i >> 10) & 0x3
+
+    if f2 == 0:
+        return "c.srli %s,%d" % (rd, _c_uimm_ci(i))
+    elif f2 == 1:
+        return "c.srai %s,%d" % (rd, _c_uimm_ci(i))
+    elif f2 == 2:
+        return "c.andi %s,%d" % (rd, _c_imm_ci(i))
+    elif (i & 0x1000) == 0:
+        return "%s %s,%s" % (_CARITH_OPS[(i >> 5) & 0x3], rd, REG_NAMES[_c_rdp(i)])
+    return "ill"
+
+def _cdis_j(pc, i):
+    return "c.j 0x%08x" % ((pc + _c_imm_cj(i)) & 0xFFFFFFFF)
+
+def _cdis_beqz(pc, i):
+    return "c.beqz %s,0x%04x" % (REG_NAMES[_c_rs1p(i)], (pc + _c_imm_cb(i)) & 0xFFFFFFFF)
+
+def _cdis_bnez(pc, i):
+    return "c.bnez %s,0x%04x" % (REG_NAMES[_c_rs1p(i)], (pc + _c_imm_cb(i)) & 0xFFFFFFFF)
+
+def _cdis_slli(pc, i):
+    return "c.slli %s,%d" % (REG_NAMES[_c_rd(i)], _c_uimm_ci(i))
+
+def _cdis_lwsp(pc, i):
+    rd = _c_rd(i)
+    if rd == 0:
+        return "ill"
+    return "c.lwsp %s,%d(sp)" % (REG_NAMES[rd], _c_uimm_lwsp(i))
+
+def _cdis_jr_mv_add(pc, i):
+    rd = _c_rd(i)
+    rs2 = _c_rs2(i)
+
+    if (i & 0x1000) == 0:
+        if rs2 == 0:
+            return "c.jr %s" % REG_NAMES[rd] if rd != 0 else "ill"
+        return "c.mv %s,%s" % (REG_NAMES[rd], REG_NAMES[rs2])
+    else:
+        if rs2 == 0:
+            return "c.jalr %s" % REG_NAMES[rd] if rd != 0 else "c.ebreak"
+        return "c.add %s,%s" % (REG_NAMES[rd], REG_NAMES[rs2])
+
+def _cdis_swsp(pc, i):
+    return "c.swsp %s,%d(sp)" % (REG_NAMES[_c_rs2(i)], _c_uimm_swsp(i))
+
+# Disassembly dispatch, indexed by {funct3, quadrant}
+_DIS16 = [_ill]*32
+_DIS16[(0 << 2) | 0] = _cdis_addi4spn
+_DIS16[(2 << 2) | 0] = _cdis_lw
+_DIS16[(6 << 2) | 0] = _cdis_sw
+_DIS16[(0 << 2) | 1] = _cdis_addi
+_DIS16[(1 << 2) | 1] = _cdis_jal
+_DIS16[(2 << 2) | 1] = _cdis_li
+_DIS16[(3 << 2) | 1] = _cdis_lui
+_DIS16[(4 << 2) | 1] = _cdis_miscalu
+_DIS16[(5 << 2) | 1] = _cdis_j
+_DIS16[(6 << 2) | 1] = _cdis_beqz
+_DIS16[(7 << 2) | 1] = _cdis_bnez
+_DIS16[(0 << 2) | 2] = _cdis_slli
+_DIS16[(2 << 2) | 2] = _cdis_lwsp
+_DIS16[(4 << 2) | 2] = _cdis_jr_mv_add
+_DIS16[(6 << 2) | 2] = _cdis_swsp
+
+def disasm_32(pc, instr):
+    """Disassembles a 32-bit instruction"""
+    return _DIS32[instr & 0x7F](pc, instr)
+
+def disasm_16(pc, instr):
+    """Disassembles a 16-bit (compressed) instruction"""
+    if instr == 0:
+        return "ill"
+    return _DIS16[_c_idx(instr)](pc, instr)
+
+def disasm(pc, instr):
+    """Disassembles a single instruction"""
+    if (instr & 0x3) == 0x3:
+        return _DIS32[instr & 0x7F](pc, instr)
+    else:
+        return disasm_16(pc, instr)
+
+#********************************************************************
+#* Call/return classification
+#*
+#* Jumps are classified using the return-address-stack hints from
+#* the RISC-V unprivileged spec, where x1 and x5 are link registers:
+#*   rd=link,  rs1!=link         : push
+#*   rd!=link, rs1=link          : pop
+#*   rd=link,  rs1=link, rd!=rs1 : pop, then push
+#*   rd=link,  rs1=link, rd==rs1 : push
+#********************************************************************
+
+def _jump_jal(i):
+    return (_rd(i), 0, 4)
+
+def _jump_jalr(i):
+    if _funct3(i) != 0:
+        return None
+    return (_rd(i), _rs1(i), 4)
+
+def _cjump_jal(i):
+    return (1, 0, 2)
+
+def _cjump_j(i):
+    return (0, 0, 2)
+
+def _cjump_jr_jalr(i):
+    rs1 = _c_rd(i)
+    if _c_rs2(i) != 0 or rs1 == 0:
+        # c.mv, c.add or c.ebreak
+        return None
+    if (i & 0x1000) == 0:
+        # c.jr
+        return (0, rs1, 2)
+    else:
+        # c.jalr
+        return (1, rs1, 2)
+
+# Jump decode, indexed by opcode (instr[6:0])
+_JUMP32 = [None]*128
+_JUMP32[0x67] = _jump_jalr
+_JUMP32[0x6F] = _jump_jal
+
+# Jump decode, indexed by {funct3, quadrant}
+_JUMP16 = [None]*32
+_JUMP16[(1 << 2) | 1] = _cjump_jal
+_JUMP16[(5 << 2) | 1] = _cjump_j
+_JUMP16[(4 << 2) | 2] = _cjump_jr_jalr
+
+def jump_regs(instr):
+    """Returns (rd, rs1, size) if the instruction is an unconditional
+    jump, or None. rs1 is 0 for pc-relative jumps"""
+    if (instr & 0x3) == 0x3:
+        f = _JUMP32[instr & 0x7F]
+    else:
+        f = _JUMP16[_c_idx(instr)]
+
+    if f is None:
+        return None
+    return f(instr)
+
+def _link_class(rd, rs1):
+    rd_islink = rd in (1, 5)
+    rs1_islink = rs1 in (1, 5)
+
+    if rd_islink:
+        return (True, rs1_islink and rs1 != rd)
+    else:
+        return (False, rs1_islink)
+
+# (is_push, is_pop), indexed by (rd << 5) | rs1
+_LINK_CLASS = tuple(_link_class(rd, rs1) for rd in range(32) for rs1 in range(32))
+
+_NO_JUMP = (False, False, 0)
+
+def pushpop(instr):
+    """Classifies an instruction as a call (push) and/or return (pop).
+    Returns (is_push, is_pop, size)"""
+    if (instr & 0x3) == 0x3:
+        f = _JUMP32[instr & 0x7F]
+    else:
+        f = _JUMP16[((instr >> 11) & 0x1C) | (instr & 0x3)]
+
+    if f is None:
+        return _NO_JUMP
+
+    j = f(instr)
+    if j is None:
+        return _NO_JUMP
+
+    rd, rs1, size = j
+    is_push, is_pop = _LINK_CLASS[(rd << 5) | rs1]
+    return (is_push, is_pop, size)
+
@@ -0,0 +1,68 @@
+#****************************************************************************
+#* riscv_elf_symtab.py
+#*
+#* Function symbols of an ELF file, indexed by entry address and name.
+#****************************************************************************
+import bisect
+
+from elftools.elf.elffile import ELFFile
+from elftools.elf.sections import SymbolTableSection
+
+
+class RiscvElfSymtab(object):
+    """Function symbols read from an ELF file"""
+
+    def __init__(self, path):
+        self.path = path
+
+        # Entry address -> name, and name -> entry address
+        self.addr_m = {}
+        self.name_m = {}
+        
+        # Entry address -> size in bytes (0 if unknown)
+        self.size_m = {}
+
+        with open(path, "rb") as fp:
+            elf = ELFFile(fp)
+            for sec in elf.iter_sections():
+                if not isinstance(sec, SymbolTableSection):
+                    continue
+                for sym in sec.iter_symbols():
+                    if (sym["st_info"]["type"] != "STT_FUNC" or
+                            sym["st_value"] == 0 or sym.name == ""):
+                        continue
+                    addr = sym["st_value"]
+                    self.addr_m.setdefault(addr, sym.name)
+                    self.size_m.setdefault(addr, sym["st_size"])
+                    self.name_m.setdefault(sym.name, addr)
+
+        # Sorted entry addresses, for address-to-function lookup
+        self.addr_l = sorted(self.addr_m.keys())
+
+    def func(self, addr):
+        """Returns (entry, name) of the function containing 'addr',
+        or None if 'addr' precedes all functions"""
+        i = bisect.bisect_right(self.addr_l, addr)
+        if i == 0:
+            return None
+        entry = self.addr_l[i-1]
+        return (entry, self.addr_m[entry])
+
+    def addr(self, name):
+        """Returns the entry address of function 'name', or None"""
+        return self.name_m.get(name)
+
+    def range(self, entry):
+        """Returns the address range [entry..end) of the function at 
+        'entry'. Functions of unknown size extend to the next function"""
+        size = self.size_m.get(entry, 0)
+        if size != 0:
+            return (entry, entry+size)
+        i = bisect.bisect_right(self.addr_l, entry)
+        if i < len(self.addr_l):
+            return (entry, self.addr_l[i])
+        return (entry, entry)
+        
+    def names(self):
+        return self.name_m.keys()
+
@@ -0,0 +1,198 @@
+#****************************************************************************
+#* riscv_func_profiler.py
+#*
+#* Per-function retired-instruction profile, built from the call and
+#* return classification and instruction count of each retire record.
+#* Functions are assigned fixed slots from the ELF symbol table, and
+#* counts are kept in preallocated arrays, so the per-call cost doesn't
+#* allocate once each call path has been seen.
+#****************************************************************************
+from array import array
+
+from riscv_debug_bfms.riscv_elf_symtab import RiscvElfSymtab
+
+
+class RiscvFuncProfiler(object):
+    """Inclusive and exclusive instruction counts per function and per
+    call path. Counting starts at the first call or return seen"""
+
+    def __init__(self, symtab : RiscvElfSymtab, max_depth=256, max_paths=65536):
+        self.symtab = symtab
+        self.max_depth = max_depth
+        self.max_paths = max_paths
+
+        # One slot per function, plus one for code outside all functions
+        self.names = [symtab.addr_m[a] for a in symtab.addr_l] + ["??"]
+        self.n_slots = len(self.names)
+        self.slot_m = {a : i for i,a in enumerate(symtab.addr_l)}
+        self.unk_slot = self.n_slots - 1
+
+        # Slot of each call-target pc seen so far
+        self.pc_slot_m = {}
+
+        self.calls = array('Q', [0]*self.n_slots)
+        self.incl = array('Q', [0]*self.n_slots)
+        self.excl = array('Q', [0]*self.n_slots)
+
+        # Number of frames of each function on the stack. Inclusive
+        # counts are only added by the outermost frame of recursive calls
+        self.active = array('l', [0]*self.n_slots)
+
+        # Call-path tree. Node 0 is the root, above the outermost frame.
+        # Paths beyond max_paths are counted against their parent path
+        self.node_m = {}
+        self.node_parent = array('l', [0]*max_paths)
+        self.node_slot = array('l', [0]*max_paths)
+        self.node_excl = array('Q', [0]*max_paths)
+        self.n_nodes = 1
+        self.paths_dropped = 0
+
+        # Call stack. Frame 0 is the outermost function seen
+        self.st_slot = array('l', [0]*max_depth)
+        self.st_node = array('l', [0]*max_depth)
+        self.st_start = array('Q', [0]*max_depth)
+        self.st_child = array('Q', [0]*max_depth)
+        self.depth = -1
+
+        # Calls deeper than max_depth, whose returns must be skipped
+        self.overflow = 0
+        self.n_overflow = 0
+
+        self.last_count = 0
+
+    def retire(self, last_pc, pc, count, intr, iret, pushpop):
+        """Processes a retire record. Interrupt entry and exit are
+        treated as a call and a return"""
+        if (pushpop & 3) == 0 and not intr and not iret:
+            return
+
+        if self.depth == -1:
+            self._push(self._slot(last_pc), count-1)
+
+        if (pushpop & 2) != 0 or iret:
+            self._ret(pc, count)
+        if (pushpop & 1) != 0 or intr:
+            self._call(pc, count)
+
+        self.last_count = count
+
+    def _slot(self, pc):
+        slot = self.pc_slot_m.get(pc)
+        if slot is None:
+            f = self.symtab.func(pc)
+            slot = self.unk_slot if f is None else self.slot_m[f[0]]
+            self.pc_slot_m[pc] = slot
+        return slot
+
+    def _push(self, slot, count):
+        d = self.depth + 1
+        parent = self.st_node[d-1] if d > 0 else 0
+        key = parent*self.n_slots + slot
+        node = self.node_m.get(key)
+
+        if node is None:
+            if self.n_nodes < self.max_paths:
+                node = self.n_nodes
+                self.n_nodes += 1
+                self.node_parent[node] = parent
+                self.node_slot[node] = slot
+                self.node_m[key] = node
+            else:
+                node = parent
+                self.paths_dropped += 1
+
+        self.st_slot[d] = slot
+        self.st_node[d] = node
+        self.st_start[d] = count
+        self.st_child[d] = 0
+        self.active[slot] += 1
+        self.calls[slot] += 1
+        self.depth = d
+
+    def _pop(self, count):
+        d = self.depth
+        slot = self.st_slot[d]
+        n = count - self.st_start[d]
+        excl = n - self.st_child[d]
+
+        self.active[slot] -= 1
+        if self.active[slot] == 0:
+            self.incl[slot] += n
+        self.excl[slot] += excl
+        self.node_excl[self.st_node[d]] += excl
+
+        self.depth = d - 1
+        if d > 0:
+            self.st_child[d-1] += n
+
+    def _call(self, pc, count):
+        if self.depth+1 >= self.max_depth:
+            self.overflow += 1
+            self.n_overflow += 1
+            return
+        self._push(self._slot(pc), count)
+
+    def _ret(self, pc, count):
+        if self.overflow > 0:
+            self.overflow -= 1
+            return
+
+        self._pop(count)
+
+        if self.depth == -1:
+            # Returned from the outermost function seen. The caller
+            # becomes the new outermost function. Its path is rooted
+            # separately, since its own caller is unknown
+            self._push(self._slot(pc), count)
+
+    def profile(self):
+        """Returns a list of (function, calls, inclusive, exclusive),
+        sorted by exclusive count. Frames still on the stack are
+        counted up to the last record seen"""
+        incl, excl, _ = self._totals()
+        ret = []
+        for i in range(self.n_slots):
+            if self.calls[i] != 0:
+                ret.append((self.names[i], self.calls[i], incl[i], excl[i]))
+        ret.sort(key=lambda e: e[3], reverse=True)
+        return ret
+
+    def collapsed(self):
+        """Returns the exclusive count of each call path in the
+        collapsed-stack format used by flame-graph tools:
+        'main;foo;bar 1234'"""
+        _, _, node_excl = self._totals()
+        path_l = [None]*self.n_nodes
+        lines = []
+        for node in range(1, self.n_nodes):
+            name = self.names[self.node_slot[node]]
+            parent = self.node_parent[node]
+            path_l[node] = name if parent == 0 else path_l[parent] + ";" + name
+            if node_excl[node] != 0:
+                lines.append("%s %d" % (path_l[node], node_excl[node]))
+        return "\n".join(lines) + "\n"
+
+    def write_collapsed(self, path):
+        with open(path, "w") as fp:
+            fp.write(self.collapsed())
+
+    def _totals(self):
+        """Returns copies of the inclusive, exclusive and per-path counts,
+        with the frames on the stack closed at last_count"""
+        incl = array('Q', self.incl)
+        excl = array('Q', self.excl)
+        node_excl = array('Q', self.node_excl)
+        active = array('l', self.active)
+        child = 0
+
+        for d in range(self.depth, -1, -1):
+            slot = self.st_slot[d]
+            n = self.last_count - self.st_start[d]
+            active[slot] -= 1
+            if active[slot] == 0:
+                incl[slot] += n
+            excl[slot] += n - self.st_child[d] - child
+            node_excl[self.st_node[d]] += n - self.st_child[d] - child
+            child = n
+
+        return (incl, excl, node_excl)
@@ -0,0 +1,93 @@
+#****************************************************************************
+#* riscv_offline.py
+#*
+#* Support for using the BFM classes outside a simulator, for example
+#* to replay recorded traces or to benchmark the Python side of the BFM.
+#*
+#* install() replaces the pybfms BFM manager with one that discards 
+#* messages sent to the HDL. new_bfm() creates BFMs that are not bound
+#* to an HDL instance.
+#****************************************************************************
+import asyncio
+
+import pybfms
+from pybfms.bfm_info import BfmInfo
+from pybfms.bfm_mgr import BfmMgr
+
+
+class RiscvOfflineBackend(pybfms.backend.Backend):
+    """pybfms backend built on asyncio primitives"""
+
+    def event(self):
+        return asyncio.Event()
+
+    def lock(self):
+        return asyncio.Lock()
+
+    def delay(self, time_ps, units=None):
+        return asyncio.sleep(0)
+
+    def delta(self):
+        return asyncio.sleep(0)
+
+
+class RiscvOfflineBfmMgr(BfmMgr):
+    """BFM manager used when no simulator is present. Messages sent
+    to the HDL are counted, per message id, and discarded"""
+
+    def __init__(self):
+        self.bfm_l = []
+        self.bfm_type_info_m = {}
+        self.m_initialized = False
+        self.msg_count_m = {}
+
+    def send_msg(self, bfm_id, msg_id, param_l, type_info_l):
+        self.msg_count_m[msg_id] = self.msg_count_m.get(msg_id, 0) + 1
+
+    def _set_recv_msg_callback(self, f):
+        raise Exception("the offline BFM manager cannot be used in a simulation")
+
+
+def install() -> RiscvOfflineBfmMgr:
+    """Replaces the BFM manager with RiscvOfflineBfmMgr. BFM types 
+    registered so far are carried over"""
+    mgr = BfmMgr.inst()
+
+    if isinstance(mgr, RiscvOfflineBfmMgr):
+        return mgr
+
+    if mgr.m_initialized:
+        raise Exception("offline BFMs cannot be used inside a simulation")
+
+    offline = RiscvOfflineBfmMgr()
+    offline.bfm_type_info_m.update(mgr.bfm_type_info_m)
+    BfmMgr._inst = offline
+
+    if pybfms._backend is None:
+        pybfms.init_backend(RiscvOfflineBackend())
+
+    return offline
+
+
+def is_offline() -> bool:
+    return isinstance(BfmMgr._inst, RiscvOfflineBfmMgr)
+
+
+def new_bfm(T, *params, inst_name="offline"):
+    """Creates a BFM of type T that is not connected to an HDL instance.
+    'params' are passed to the BFM's _set_parameters task, as the HDL 
+    would. By default, a message size of 32 characters is used"""
+    mgr = install()
+
+    bfm = T()
+    bfm.bfm_info = BfmInfo(
+        bfm,
+        len(mgr.bfm_l),
+        inst_name,
+        mgr.bfm_type_info_m[T])
+    mgr.bfm_l.append(bfm)
+
+    bfm._set_parameters(*(params if len(params) > 0 else (32,)))
+
+    return bfm
+
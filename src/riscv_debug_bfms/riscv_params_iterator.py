@@ -7,6 +7,11 @@ from core_debug_common import ParamsIterator
 import hvlrpc
 from riscv_debug_bfms.riscv_va_params_iterator import RiscvVaParamsIterator
 
+# Number of integer argument registers (a0..a7)
+N_ARG_REGS = 8
+
+# Number of stack-argument words read from memory at a time
+STACK_BLK_WORDS = 16
 
 class RiscvParamsIterator(ParamsIterator):
     
@@ -15,19 +20,22 @@ class RiscvParamsIterator(ParamsIterator):
         self.bfm = bfm
         self.param_n = 0
         
-        # Capture the SP for later use
-        self.sp = bfm.reg(2)
+        # Registers at the point of the call, which are unaffected
+        # by later execution
+        self.regs = bfm.snapshot().regs
+        
+        # Arguments that don't fit in a0..a7 are passed in the 
+        # caller's frame, starting at SP
+        self.sp = self.regs[2]
+        
+        # Stack arguments consumed, and those read from memory
+        self.stack_n = 0
+        self.stack_w = []
         
         
     def int8(self) -> int:
         """Returns the next 8-bit parameter"""
-        if self.param_n < 8:
-            # Return register value
-            ret = self.bfm.reg(self.param_n+10)
-        else:
-            # Read memory on stack
-            raise NotImplementedError("mem-read not implemented")
-        self.param_n += 1
+        ret = self._next_word()
         
         # Handle negative values
         if (ret & 0x80) != 0:
@@ -38,26 +46,13 @@ class RiscvParamsIterator(ParamsIterator):
 
     def uint8(self) -> int:
         """Returns the next 8-bit parameter"""
-        if self.param_n < 8:
-            # Return register value
-            ret = self.bfm.reg(self.param_n+10)
-        else:
-            # Read memory on stack
-            raise NotImplementedError("mem-read not implemented")
-        self.param_n += 1
+        ret = self._next_word()
         
         return (ret & 0xFF)
             
     def int16(self) -> int:
         """Returns the next 16-bit parameter"""
-        if self.param_n < 8:
-            # Return register value
-            ret = self.bfm.reg(self.param_n+10)
-        else:
-            # Read memory on stack
-            raise NotImplementedError("mem-read not implemented")
-        
-        self.param_n += 1
+        ret = self._next_word() & 0xFFFF
         
         if (ret & 0x8000) != 0:
             ret = -((~ret & 0xFFFF) + 1) 
@@ -66,27 +61,13 @@ class RiscvParamsIterator(ParamsIterator):
     
     def uint16(self) -> int:
         """Returns the next 16-bit parameter"""
-        if self.param_n < 8:
-            # Return register value
-            ret = self.bfm.reg(self.param_n+10)
-        else:
-            # Read memory on stack
-            raise NotImplementedError("mem-read not implemented")
-        
-        self.param_n += 1
+        ret = self._next_word()
         
-        return ret    
+        return (ret & 0xFFFF)
     
     def int32(self) -> int:
         """Returns the next 32-bit parameter"""
-        if self.param_n < 8:
-            # Return register value
-            ret = self.bfm.reg(self.param_n+10)
-        else:
-            # Read memory on stack
-            raise NotImplementedError("mem-read not implemented")
-        
-        self.param_n += 1
+        ret = self._next_word()
 
         if (ret & 0x80000000) != 0:
             ret = -((~ret & 0xFFFFFFFF) + 1)
@@ -95,30 +76,11 @@ class RiscvParamsIterator(ParamsIterator):
     
     def uint32(self) -> int:
         """Returns the next 32-bit parameter"""
-        if self.param_n < 8:
-            # Return register value
-            ret = self.bfm.reg(self.param_n+10)
-        else:
-            # Read memory on stack
-            raise NotImplementedError("mem-read not implemented")
-        
-        self.param_n += 1
-
-        return ret
+        return self._next_word()
     
     def int64(self) -> int:
         """Returns the next 64-bit parameter"""
-        # TODO:
-        raise NotImplementedError("next64 not implemented")
-    
-        if self.param_n < 8:
-            # Return register value
-            ret = self.bfm.reg(self.param_n+10)
-        else:
-            # Read memory on stack
-            raise NotImplementedError("mem-read not implemented")
-        
-        self.param_n += 1
+        ret = self._next_dword()
         
         if (ret & 0x8000000000000000) != 0:
             ret = -((~ret & 0xFFFFFFFFFFFFFFFF) + 1)
@@ -127,19 +89,47 @@ class RiscvParamsIterator(ParamsIterator):
 
     def uint64(self) -> int:
         """Returns the next 64-bit parameter"""
-        # TODO:
-        raise NotImplementedError("next64 not implemented")
+        return self._next_dword()
     
-        if self.param_n < 8:
-            # Return register value
-            ret = self.bfm.reg(self.param_n+10)
+    def _next_word(self) -> int:
+        """Returns the next XLEN-sized argument, from a0..a7 and then
+        from the stack"""
+        if self.param_n < N_ARG_REGS:
+            ret = self.regs[self.param_n+10]
+            self.param_n += 1
         else:
-            # Read memory on stack
-            raise NotImplementedError("mem-read not implemented")
-        
-        self.param_n += 1
-        
-        return ret        
+            ret = self._stack_word(self.stack_n)
+            self.stack_n += 1
+        return ret
+    
+    def _next_dword(self) -> int:
+        """Returns the next 2*XLEN-sized argument. Per the ILP32 calling
+        convention, it is passed in the next two argument registers, 
+        split between a7 and the stack, or in an 8-byte-aligned stack slot"""
+        if self.param_n < N_ARG_REGS-1:
+            lo = self.regs[self.param_n+10]
+            hi = self.regs[self.param_n+11]
+            self.param_n += 2
+        elif self.param_n == N_ARG_REGS-1:
+            lo = self.regs[self.param_n+10]
+            hi = self._stack_word(self.stack_n)
+            self.param_n += 1
+            self.stack_n += 1
+        else:
+            self.stack_n += (self.stack_n & 1)
+            lo = self._stack_word(self.stack_n)
+            hi = self._stack_word(self.stack_n+1)
+            self.stack_n += 2
+        return (hi << 32) | lo
+    
+    def _stack_word(self, idx) -> int:
+        """Returns word 'idx' of the stack-argument area. The area is
+        read from the memory mirror in blocks, on first use"""
+        while idx >= len(self.stack_w):
+            addr = self.sp + 4*len(self.stack_w)
+            self.stack_w.extend(map(self.bfm.mm.read32, 
+                range(addr, addr+4*STACK_BLK_WORDS, 4)))
+        return self.stack_w[idx]
     
     def ptr(self) -> int:
         """Returns the next pointer parameter"""
@@ -150,22 +140,7 @@ class RiscvParamsIterator(ParamsIterator):
     
     def str(self) -> str:
         """Returns the next string-type (const char *) parameter"""
-        addr = self.ptr()
-        mm = self.bfm.mm
-        ret = ""
-
-        # Artificially limit strings to 1k
-        for i in range(1024):
-            ch = mm.read8(addr)
-            
-            if ch == 0:
-                break
-            else:
-                ret += "%c" % (ch,)
-                
-            addr += 1
-            
-        return ret
+        return self.bfm.read_str(self.ptr())
     
     def va(self) -> hvlrpc.va_list:
         """Returns the an iterator for variadic params"""
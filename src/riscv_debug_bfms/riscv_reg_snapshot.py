@@ -0,0 +1,28 @@
+#****************************************************************************
+#* riscv_reg_snapshot.py
+#*
+#* Frozen register state of a RiscvDebugBfm. A snapshot shares the
+#* BFM's register file, which the BFM copies on its next register
+#* write, so taking a snapshot doesn't copy the registers.
+#****************************************************************************
+
+
+class RiscvRegSnapshot(object):
+    """Register values as of instruction 'count'. 'regs' is a read-only
+    memoryview of x0..x31"""
+    __slots__ = ("count", "regs")
+
+    def __init__(self, count, regs):
+        self.count = count
+        self.regs = regs
+
+    def reg(self, addr) -> int:
+        return self.regs[addr]
+
+    @property
+    def sp(self) -> int:
+        return self.regs[2]
+
+    def args(self):
+        """Returns a view of the argument registers a0..a7"""
+        return self.regs[10:18]
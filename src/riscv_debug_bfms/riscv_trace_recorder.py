@@ -0,0 +1,185 @@
+#****************************************************************************
+#* riscv_trace_recorder.py
+#*
+#* Records the retire stream seen by RiscvDebugBfm to a binary file.
+#*
+#* The file starts with a header (HDR_FMT), followed by fixed-width
+#* records of REC_WORDS little-endian 32-bit words. The low byte of
+#* the first word holds the record type:
+#*
+#* REC_RETIRE: [flags, last_pc, last_instr, pc, instr, mem_addr, mem_data, count]
+#*   flags: intr[8], iret[9], push[10], pop[11], rmask[19:16], wmask[23:20]
+#* REC_REGS:   [type, mask, v0, ..., v5]
+#*   Values of the registers set in 'mask', in ascending register order.
+#*   Registers are always written before the retire records they precede
+#****************************************************************************
+from array import array
+import atexit
+import hashlib
+import struct
+
+
+TRACE_MAGIC = b"RVTR"
+TRACE_VERSION = 1
+
+# magic, version, xlen, trace level, record words, flags, ELF SHA-256
+HDR_FMT = "<4sHBBBB2x32s"
+HDR_SZ = struct.calcsize(HDR_FMT)
+
+# Header flags
+HDR_F_REGS = (1 << 0)
+
+REC_WORDS = 8
+REC_FMT = "<%dI" % REC_WORDS
+REC_SZ = 4*REC_WORDS
+
+# Record types
+REC_RETIRE = 0
+REC_REGS = 1
+
+# Maximum number of register values in a REC_REGS record
+REC_REGS_MAX = REC_WORDS-2
+
+
+def elf_hash(path) -> bytes:
+    """Returns the SHA-256 digest of an ELF file"""
+    h = hashlib.sha256()
+    with open(path, "rb") as fp:
+        while True:
+            b = fp.read(1 << 16)
+            if not b:
+                break
+            h.update(b)
+    return h.digest()
+
+
+class RiscvTraceRecorder(object):
+    """Appends retire records to a binary trace file. Records are
+    packed into a preallocated buffer, which is written out when full.
+    The file is closed at exit if close() hasn't been called"""
+
+    def __init__(self, path, elf=None, regs=False, buf_recs=4096):
+        self.path = path
+        self.elf = elf
+        self.en_regs = regs
+        self.fp = None
+        self.n_recs = 0
+
+        self.buf = array('I', [0])*(REC_WORDS*buf_recs)
+        self.buf_sz = REC_SZ*buf_recs
+        self.buf_off = 0
+        self.pack_into = struct.Struct(REC_FMT).pack_into
+
+    def start(self, xlen, trace_level):
+        """Opens the trace file and writes the header"""
+        digest = elf_hash(self.elf) if self.elf is not None else bytes(32)
+
+        self.fp = open(self.path, "wb")
+        self.fp.write(struct.pack(HDR_FMT,
+            TRACE_MAGIC,
+            TRACE_VERSION,
+            xlen,
+            int(trace_level),
+            REC_WORDS,
+            HDR_F_REGS if self.en_regs else 0,
+            digest))
+        atexit.register(self.close)
+
+    def retire(self,
+               last_pc,
+               last_instr,
+               pc,
+               instr,
+               intr,
+               iret,
+               mem_addr,
+               mem_data,
+               mem_wmask,
+               mem_rmask,
+               count,
+               pushpop):
+        """Appends a retire record"""
+        if self.buf_off >= self.buf_sz:
+            self.flush()
+        self.pack_into(self.buf, self.buf_off,
+            (REC_RETIRE | (intr << 8) | (iret << 9) | (pushpop << 10)
+                | (mem_rmask << 16) | (mem_wmask << 20)),
+            last_pc,
+            last_instr,
+            pc,
+            instr,
+            mem_addr,
+            mem_data,
+            count)
+        self.buf_off += REC_SZ
+        self.n_recs += 1
+
+    def write_regs(self, mask, regs):
+        """Appends the values of the registers set in 'mask'"""
+        if not self.en_regs:
+            return
+
+        while mask:
+            m = 0
+            vals = [0]*REC_REGS_MAX
+            for i in range(REC_REGS_MAX):
+                lsb = mask & -mask
+                if lsb == 0:
+                    break
+                vals[i] = regs[lsb.bit_length()-1]
+                m |= lsb
+                mask ^= lsb
+
+            if self.buf_off >= self.buf_sz:
+                self.flush()
+            self.pack_into(self.buf, self.buf_off, REC_REGS, m, *vals)
+            self.buf_off += REC_SZ
+            self.n_recs += 1
+
+    def flush(self):
+        """Writes buffered records to the trace file"""
+        if self.buf_off > 0:
+            self.fp.write(memoryview(self.buf).cast('B')[:self.buf_off])
+            self.buf_off = 0
+
+    def close(self):
+        if self.fp is not None:
+            atexit.unregister(self.close)
+            self.flush()
+            self.fp.close()
+            self.fp = None
+
+
+class RiscvTraceReader(object):
+    """Reads a trace file written by RiscvTraceRecorder"""
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as fp:
+            hdr = fp.read(HDR_SZ)
+
+        if len(hdr) != HDR_SZ:
+            raise Exception("%s: truncated trace header" % path)
+
+        (magic, version, self.xlen, self.trace_level,
+            rec_words, self.flags, self.elf_hash) = struct.unpack(HDR_FMT, hdr)
+
+        if magic != TRACE_MAGIC:
+            raise Exception("%s is not a trace file" % path)
+        if version != TRACE_VERSION or rec_words != REC_WORDS:
+            raise Exception("%s: unsupported trace version %d" % (path, version))
+
+    def records(self, start=0, chunk_recs=4096):
+        """Yields each record, from record index 'start', as a tuple 
+        of REC_WORDS integers"""
+        unpack = struct.Struct(REC_FMT).iter_unpack
+
+        with open(self.path, "rb") as fp:
+            fp.seek(HDR_SZ + REC_SZ*start)
+            while True:
+                b = fp.read(REC_SZ*chunk_recs)
+                if len(b) < REC_SZ:
+                    break
+                yield from unpack(b[:len(b) - (len(b) % REC_SZ)])
+
@@ -0,0 +1,165 @@
+#****************************************************************************
+#* riscv_trace_replay.py
+#*
+#* Replays a trace recorded by RiscvTraceRecorder through RiscvDebugBfm,
+#* without a simulator. Call-stack tracking, memory mirroring, parameter
+#* decoding and listeners behave as they did during simulation.
+#****************************************************************************
+from concurrent.futures import ProcessPoolExecutor
+
+from riscv_debug_bfms import riscv_offline
+from riscv_debug_bfms.riscv_checkpoint import RiscvCheckpointReader, NO_TRACE
+from riscv_debug_bfms.riscv_debug_bfm import RiscvDebugBfm
+from riscv_debug_bfms.riscv_trace_recorder import RiscvTraceReader, \
+    REC_RETIRE, REC_REGS, elf_hash
+
+
+class RiscvTraceReplay(object):
+    """Feeds the records of a trace file to a BFM. By default, an
+    offline RiscvDebugBfm is created to receive the records. 'ckpt' 
+    optionally names a checkpoint file saved while the trace was 
+    recorded, which lets the first seek start from a checkpoint"""
+
+    def __init__(self, path, bfm : RiscvDebugBfm = None, ckpt=None):
+        self.reader = RiscvTraceReader(path)
+        self.ckpt = None if ckpt is None else RiscvCheckpointReader(ckpt)
+
+        if bfm is None:
+            bfm = riscv_offline.new_bfm(RiscvDebugBfm)
+        self.bfm = bfm
+
+        # Instruction count of the last record replayed
+        self.count = 0
+        self.n_recs = 0
+
+        self._rec_it = self.reader.records()
+        
+        # Records read ahead by seek(), in trace order
+        self._pending = []
+        self._pending_idx = 0
+
+    def elf_matches(self, elf) -> bool:
+        """Checks whether the trace was recorded while running 'elf'"""
+        return elf_hash(elf) == self.reader.elf_hash
+
+    def step(self) -> bool:
+        """Replays the next retire record, and the register updates
+        that precede it. Returns False at the end of the trace"""
+        return self._replay(None, 1) > 0
+
+    def run(self, count=None) -> int:
+        """Replays records until the instruction count reaches 'count',
+        or to the end of the trace. Returns the number of retire
+        records replayed"""
+        return self._replay(count, None)
+
+    def seek(self, count):
+        """Advances the replay to the first record whose instruction
+        count is at or after 'count'. The BFM state is only valid when
+        every record is replayed, so seeking backwards is not supported"""
+        if count < self.count:
+            raise Exception("cannot seek backwards from %d to %d" % (self.count, count))
+        
+        # Before anything is replayed, state can be restored from 
+        # the last checkpoint before 'count'
+        if self.ckpt is not None and self.count == 0 and self.n_recs == 0:
+            idx = self.ckpt.find(count-1)
+            while idx is not None and self.ckpt.trace_recs[idx] == NO_TRACE:
+                idx = idx-1 if idx > 0 else None
+            if idx is not None:
+                self.count, trace_rec = self.ckpt.restore(self.bfm, idx)
+                self._rec_it = self.reader.records(trace_rec)
+                self._pending = []
+                self._pending_idx = 0
+            
+        self._replay(count, None, stop_before=True)
+
+    def _next_rec(self):
+        if self._pending_idx < len(self._pending):
+            rec = self._pending[self._pending_idx]
+            self._pending_idx += 1
+            return rec
+        return next(self._rec_it, None)
+
+    def _replay(self, count, limit, stop_before=False):
+        bfm = self.bfm
+        n = 0
+        
+        # Register updates are held back while seeking, since they
+        # belong to the retire record that follows them
+        held = []
+
+        while limit is None or n < limit:
+            rec = self._next_rec()
+
+            if rec is None:
+                break
+
+            w0 = rec[0]
+            typ = (w0 & 0xFF)
+
+            if typ == REC_REGS:
+                if stop_before:
+                    held.append(rec)
+                else:
+                    self._apply_regs((rec,))
+            elif typ == REC_RETIRE:
+                if stop_before:
+                    if rec[7] >= count:
+                        held.append(rec)
+                        self._pending = held
+                        self._pending_idx = 0
+                        held = []
+                        break
+                    self._apply_regs(held)
+                    held.clear()
+
+                bfm._retire(
+                    rec[1],
+                    rec[2],
+                    rec[3],
+                    rec[4],
+                    (w0 >> 8) & 1,
+                    (w0 >> 9) & 1,
+                    rec[5],
+                    rec[6],
+                    (w0 >> 20) & 0xF,
+                    (w0 >> 16) & 0xF,
+                    rec[7],
+                    (w0 >> 10) & 0x3)
+                self.count = rec[7]
+                self.n_recs += 1
+                n += 1
+
+                if count is not None and rec[7] >= count:
+                    break
+
+        # End of trace reached while seeking
+        self._apply_regs(held)
+
+        return n
+    
+    def _apply_regs(self, recs):
+        regs = self.bfm._regs_wr()
+        for rec in recs:
+            mask = rec[1]
+            i = 2
+            while mask:
+                lsb = mask & -mask
+                regs[lsb.bit_length()-1] = rec[i]
+                mask ^= lsb
+                i += 1
+
+
+def _replay_worker(path, analyze):
+    return analyze(RiscvTraceReplay(path))
+
+
+def replay_parallel(paths, analyze, max_workers=None):
+    """Replays each trace in 'paths' in a separate process. 'analyze' is
+    called with the RiscvTraceReplay for each trace. It must be a
+    module-level function that attaches any listeners, runs the replay
+    and returns a picklable result. Returns the results in order"""
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        return list(ex.map(_replay_worker, paths, [analyze]*len(paths)))
+
@@ -3,8 +3,137 @@ Created on Feb 21, 2021
 
 @author: mballance
 '''
+import math
+import re
+import struct
+
 import hvlrpc
 
+# C conversion specification: flags, width, precision, length, conversion
+FMT_SPEC_RE = re.compile(
+    r"%([-+ #0]*)(\*|\d+)?(?:\.(\*|\d*))?(hh|h|ll|l|j|z|t|L|q)?([diouxXeEfFgGaAcspn%])")
+
+# Argument kinds, as laid out in the va_list area
+ARG_NONE = 0
+ARG_I32 = 1
+ARG_U32 = 2
+ARG_I64 = 3
+ARG_U64 = 4
+ARG_F64 = 5
+ARG_F128 = 6
+
+# Size of each argument kind in the va_list area. Slots larger than
+# a word are aligned to their size. As in the ILP32 ABI, long double
+# is wider than two words and so is passed by reference
+ARG_SZ = (0, 4, 4, 8, 8, 8, 4)
+
+# Parsed format strings, keyed by the format string
+_fmt_cache = {}
+_fmt_cache_sz = 256
+
+def _parse_fmt(fmt):
+    """Splits a C format string into literal text and conversions. 
+    Conversions are (flags, width, prec, conv, kind, bits), where width
+    and prec are None, an int, or '*', and bits is the width integer
+    conversions are truncated to (0 for none). Returns (items, arg_kinds)"""
+    items = []
+    kinds = []
+    pos = 0
+
+    for m in FMT_SPEC_RE.finditer(fmt):
+        if m.start() > pos:
+            items.append(fmt[pos:m.start()])
+        pos = m.end()
+
+        flags, width, prec, length, conv = m.groups()
+        
+        if conv == '%':
+            items.append('%')
+            continue
+        
+        if width is not None and width != '*':
+            width = int(width)
+        if prec is not None and prec != '*':
+            prec = int(prec) if prec != '' else 0
+            
+        if width == '*':
+            kinds.append(ARG_I32)
+        if prec == '*':
+            kinds.append(ARG_I32)
+
+        wide = length in ("ll", "j", "q")
+        bits = 8 if length == "hh" else 16 if length == "h" else 0
+        if conv in "di":
+            kind = ARG_I64 if wide else ARG_I32
+        elif conv in "ouxXc":
+            kind = ARG_U64 if wide else ARG_U32
+        elif conv in "eEfFgGaA":
+            kind = ARG_F128 if length == "L" else ARG_F64
+        else:
+            # Pointers: s, p, n
+            kind = ARG_U32
+        kinds.append(kind)
+        
+        items.append((flags, width, prec, conv, kind, bits))
+        
+    if pos < len(fmt):
+        items.append(fmt[pos:])
+        
+    return (items, kinds)
+
+def _f128(lo, hi) -> float:
+    """Converts an IEEE binary128 value to the nearest double"""
+    sign = -1.0 if (hi >> 127-64) & 1 else 1.0
+    exp = (hi >> 48) & 0x7FFF
+    mant = ((hi & 0xFFFFFFFFFFFF) << 64) | lo
+    
+    if exp == 0x7FFF:
+        return sign*float("inf") if mant == 0 else float("nan")
+    if exp == 0:
+        return sign*mant*2.0**(-16382-112)
+    try:
+        return sign*(1.0 + mant*2.0**-112)*2.0**(exp-16383)
+    except OverflowError:
+        return sign*float("inf")
+
+def _hex_float(v, flags, prec) -> str:
+    """Renders a double as C's %a does, without padding"""
+    if math.copysign(1.0, v) < 0:
+        sign = "-"
+    else:
+        sign = "+" if "+" in flags else " " if " " in flags else ""
+    if math.isinf(v) or math.isnan(v):
+        return sign + ("inf" if math.isinf(v) else "nan")
+
+    bits = struct.unpack("<Q", struct.pack("<d", abs(v)))[0]
+    mant = bits & ((1 << 52)-1)
+    if (bits >> 52) == 0:
+        lead = 0
+        exp = 0 if mant == 0 else -1022
+    else:
+        lead = 1
+        exp = (bits >> 52) - 1023
+
+    if prec is None:
+        digits = ("%013x" % mant).rstrip("0")
+    elif prec >= 13:
+        digits = ("%013x" % mant) + "0"*(prec-13)
+    else:
+        # Round to nearest even. The leading digit may round up to 2
+        shift = 4*(13-prec)
+        full = (lead << 52) | mant
+        r = full >> shift
+        rem = full & ((1 << shift)-1)
+        half = 1 << (shift-1)
+        if rem > half or (rem == half and (r & 1)):
+            r += 1
+        lead = r >> (4*prec)
+        digits = "%0*x" % (prec, r & ((1 << (4*prec))-1)) if prec > 0 else ""
+
+    point = "." if digits != "" or "#" in flags else ""
+    return "%s0x%d%s%sp%+d" % (sign, lead, point, digits, exp)
+
+
 class RiscvVaParamsIterator(hvlrpc.va_list):
     """Implements the variadic-argument iterator for RISC-V"""
     
@@ -75,8 +204,11 @@ class RiscvVaParamsIterator(hvlrpc.va_list):
     
     def int64(self) -> int:
         """Returns the next 64-bit parameter"""
+        # 64-bit values are passed in aligned register pairs, and
+        # so occupy an aligned slot in the va_list area
+        self.addr = (self.addr + 7) & ~7
         ret = self.bfm.mm.read64(self.addr)
-        self.addr += 4
+        self.addr += 8
         
         ret &= 0xFFFFFFFFFFFFFFFF
         if (ret & 0x8000000000000000) != 0:
@@ -86,8 +218,9 @@ class RiscvVaParamsIterator(hvlrpc.va_list):
     
     def uint64(self) -> int:
         """Returns the next 64-bit parameter"""
+        self.addr = (self.addr + 7) & ~7
         ret = self.bfm.mm.read64(self.addr)
-        self.addr += 4
+        self.addr += 8
         
         ret &= 0xFFFFFFFFFFFFFFFF
 
@@ -102,22 +235,135 @@ class RiscvVaParamsIterator(hvlrpc.va_list):
     
     def str(self) -> str:
         """Returns the next string-type (const char *) parameter"""
-        addr = self.ptr()
-        mm = self.bfm.mm
-        ret = ""
-
-        # Artificially limit strings to 1k
-        for i in range(1024):
-            ch = mm.read8(addr)
+        return self.bfm.read_str(self.ptr())
+    
+    def format(self, fmt) -> str:
+        """Renders a C printf-style format string, consuming its arguments.
+        'fmt' is either the format string or its address. Parsed format
+        strings are cached, and the arguments are read from memory in
+        a single bulk read. long double arguments (%Lf etc) are read 
+        through the pointer the ILP32 ABI passes in their place"""
+        if not isinstance(fmt, str):
+            fmt = self.bfm.read_str(fmt)
             
-            if ch == 0:
-                break
+        ent = _fmt_cache.get(fmt)
+        if ent is None:
+            ent = _parse_fmt(fmt)
+            if len(_fmt_cache) >= _fmt_cache_sz:
+                _fmt_cache.clear()
+            _fmt_cache[fmt] = ent
+        items, kinds = ent
+        
+        # Locate each argument, then read the whole area at once
+        base = self.addr
+        offs = []
+        addr = base
+        for k in kinds:
+            sz = ARG_SZ[k]
+            if sz > 4:
+                addr = (addr + sz-1) & ~(sz-1)
+            offs.append(addr - base)
+            addr += sz
+        self.addr = addr
+        
+        words = list(map(self.bfm.mm.read32, range(base, addr, 4)))
+        
+        def arg(i):
+            k = kinds[i]
+            w = offs[i] >> 2
+            v = words[w]
+            if k == ARG_I32:
+                return v - (1 << 32) if (v & 0x80000000) else v
+            elif k == ARG_U32:
+                return v
+            elif k == ARG_F128:
+                read32 = self.bfm.mm.read32
+                return _f128(
+                    read32(v) | (read32(v+4) << 32),
+                    read32(v+8) | (read32(v+12) << 32))
+            v |= (words[w+1] << 32)
+            if k == ARG_I64:
+                return v - (1 << 64) if (v & (1 << 63)) else v
+            elif k == ARG_U64:
+                return v
             else:
-                ret += "%c" % (ch,)
-                
-            addr += 1
+                return struct.unpack("<d", struct.pack("<Q", v))[0]
             
-        return ret
+        ret = []
+        i = 0
+        for it in items:
+            if isinstance(it, str):
+                ret.append(it)
+                continue
+            
+            flags, width, prec, conv, _, bits = it
+            if width == '*':
+                width = arg(i)
+                i += 1
+                if width < 0:
+                    flags += '-'
+                    width = -width
+            if prec == '*':
+                prec = arg(i)
+                i += 1
+                if prec < 0:
+                    prec = None
+            v = arg(i)
+            i += 1
+            
+            if bits != 0 and conv in "diouxX":
+                v &= (1 << bits)-1
+                if conv in "di" and (v >> (bits-1)):
+                    v -= (1 << bits)
+
+            if conv == 'n':
+                continue
+            elif conv == 's':
+                v = self.bfm.read_str(v)
+            elif conv == 'p':
+                v = "0x%x" % v if v != 0 else "(nil)"
+                conv = 's'
+            elif conv in "aA" or (conv == 'o' and '#' in flags):
+                # Python renders these differently from C, so they are
+                # rendered and zero-padded here
+                if conv == 'o':
+                    v = "%o" % v
+                    if prec is not None:
+                        v = v.zfill(prec)
+                    if not v.startswith("0"):
+                        v = "0" + v
+                    pad = (prec is None)
+                    pfx = 0
+                else:
+                    v = _hex_float(v, flags, prec)
+                    if conv == 'A':
+                        v = v.upper()
+                    # Zeros go after the sign and '0x', but inf/nan 
+                    # aren't padded
+                    pfx = len(v) - len(v.lstrip("-+ "))
+                    pad = (v[pfx] == '0')
+                    pfx += 2
+                if pad and '0' in flags and '-' not in flags and width is not None:
+                    v = v[:pfx] + v[pfx:].rjust(width - pfx, "0")
+                flags = "-" if '-' in flags else ""
+                conv = 's'
+                prec = None
+            elif conv == 'c':
+                v = chr(v & 0xFF)
+            elif conv in "iu":
+                conv = 'd'
+            elif conv in "xX" and v == 0:
+                # C doesn't prefix zero with '0x'
+                flags = flags.replace('#', '')
+
+            spec = "%" + flags
+            if width is not None:
+                spec += str(width)
+            if prec is not None:
+                spec += "." + str(prec)
+            ret.append((spec + conv) % v)
+            
+        return "".join(ret)
     
     def va(self) -> 'ParamsIterator':
         """Returns the an iterator for variadic params"""